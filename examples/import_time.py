@@ -0,0 +1,77 @@
+"""Import time benchmark.
+
+Measures the cold start time of 'import imaids' and of its main
+submodules in fresh interpreters, and checks that heavy optional
+dependencies are not loaded at import time.
+
+Usage:
+
+    python import_time.py [--repeat N] [--max-time SECONDS]
+
+Exits with status 1 if a heavy dependency is imported eagerly or if the
+'import imaids' time exceeds --max-time.
+"""
+
+import argparse
+import subprocess
+import sys
+
+
+HEAVY_MODULES = [
+    'matplotlib', 'pandas', 'openpyxl', 'spectra',
+    'scipy.integrate', 'scipy.interpolate', 'scipy.optimize', 'scipy.signal',
+]
+
+STATEMENTS = [
+    'import imaids',
+    'import imaids.models',
+    'import imaids.shimming',
+]
+
+CODE = '''
+import sys, time
+t0 = time.perf_counter()
+{statement}
+elapsed = time.perf_counter() - t0
+# Attributes of lazy modules must not be accessed, that would load them.
+loaded = [m for m in {heavy!r} if m in sys.modules and
+          type(sys.modules[m]).__name__ != '_LazyModule']
+print(elapsed)
+print(','.join(loaded))
+'''
+
+
+def measure(statement, repeat):
+    times = []
+    loaded = ''
+    for _ in range(repeat):
+        code = CODE.format(statement=statement, heavy=HEAVY_MODULES)
+        output = subprocess.run(
+            [sys.executable, '-c', code], check=True,
+            capture_output=True, text=True).stdout.splitlines()
+        times.append(float(output[0]))
+        loaded = output[1] if len(output) > 1 else ''
+    return min(times), loaded
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--max-time', type=float, default=0.5)
+    args = parser.parse_args()
+
+    status = 0
+    for statement in STATEMENTS:
+        elapsed, loaded = measure(statement, args.repeat)
+        print('{0:<28s} {1:8.3f} s   eager heavy modules: {2:s}'.format(
+            statement, elapsed, loaded or '-'))
+        if loaded:
+            status = 1
+        if statement == 'import imaids' and elapsed > args.max_time:
+            status = 1
+
+    return status
+
+
+if __name__ == '__main__':
+    sys.exit(main())
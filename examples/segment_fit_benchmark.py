@@ -0,0 +1,111 @@
+"""Trajectory segment fitting benchmark.
+
+Compares UndulatorShimming.fit_trajectory_segments with the previous
+implementation (one search and two polynomial fits per segment) on a
+synthetic undulator trajectory, and checks that the outputs agree.
+
+Usage:
+
+    python segment_fit_benchmark.py [--periods N] [--step MM] [--repeat N]
+"""
+
+import argparse
+import sys
+import time
+
+import numpy as np
+
+from imaids.shimming import UndulatorShimming
+
+
+def fit_trajectory_segments_loop(trajectory, segs, max_size):
+    trajx = trajectory[:, 0]
+    trajy = trajectory[:, 1]
+    trajz = trajectory[:, 2]
+
+    index_list = []
+    for pos in segs:
+        index_list.append(np.where(trajz >= pos)[0][0])
+    last_index = np.where(trajz >= segs[-1] + max_size)[0]
+    if len(last_index) == 0:
+        index_list.append(len(trajz)-1)
+    else:
+        index_list.append(last_index[0])
+
+    seg_start, seg_end, poly_x, poly_y = [], [], [], []
+    for i in range(len(segs)):
+        initial, final = index_list[i], index_list[i+1]
+        tx = trajx[initial:final]
+        ty = trajy[initial:final]
+        tz = trajz[initial:final]
+        if len(tx) == 0:
+            break
+        seg_start.append([tx[0], ty[0], tz[0]])
+        seg_end.append([tx[-1], ty[-1], tz[-1]])
+        poly_x.append(np.polynomial.polynomial.polyfit(tz, tx, 1))
+        poly_y.append(np.polynomial.polynomial.polyfit(tz, ty, 1))
+
+    return (np.array(poly_x), np.array(poly_y), np.array(seg_start),
+            np.array(seg_end), index_list)
+
+
+def synthetic_trajectory(nr_periods, period, step):
+    length = (nr_periods + 4)*period
+    z = np.arange(-length/2, length/2 + step/2, step)
+    k = 2*np.pi/period
+    x = 1e-3*np.sin(k*z) + 1e-7*z
+    y = 1e-5*np.cos(k*z)
+    xl = 1e-3*k*np.cos(k*z) + 1e-7
+    yl = -1e-5*k*np.sin(k*z)
+    zl = np.sqrt(1 - xl**2 - yl**2)
+    traj = np.transpose([x, y, z, xl, yl, zl])
+    segs = np.arange(-nr_periods/2, nr_periods/2, 0.5)*period
+    return traj, segs
+
+
+def best_time(func, repeat):
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - t0)
+    return min(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--periods', type=int, nargs='+', default=[50, 200])
+    parser.add_argument('--period', type=float, default=52.5)
+    parser.add_argument('--step', type=float, default=0.5)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    status = 0
+    for nr_periods in args.periods:
+        traj, segs = synthetic_trajectory(nr_periods, args.period, args.step)
+        max_size = args.period/2
+
+        old = fit_trajectory_segments_loop(traj, segs, max_size)
+        new = UndulatorShimming.fit_trajectory_segments(
+            traj, segs, max_size, full_output=True)
+        diff = max(np.max(np.abs(o - n)) for o, n in zip(old[:4], new[:4]))
+        if diff > 1e-9 or list(old[4]) != list(new[4]):
+            status = 1
+
+        t_old = best_time(
+            lambda: fit_trajectory_segments_loop(traj, segs, max_size),
+            args.repeat)
+        t_new = best_time(
+            lambda: UndulatorShimming.fit_trajectory_segments(
+                traj, segs, max_size), args.repeat)
+        print(('{0:4d} periods, {1:4d} segments, {2:7d} points: '
+               'loop {3:8.2f} ms, vectorized {4:8.2f} ms, '
+               'speedup {5:6.1f}, max diff {6:.1e}').format(
+                   nr_periods, len(segs), len(traj), t_old*1e3, t_new*1e3,
+                   t_old/t_new, diff))
+
+    return status
+
+
+if __name__ == '__main__':
+    sys.exit(main())
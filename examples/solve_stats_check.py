@@ -0,0 +1,96 @@
+"""Stepped relaxation and interaction reuse check.
+
+Checks that FieldModel.solve_with_stats, which relaxes in steps of a few
+iterations (radia RlxAuto) over a single interaction matrix, and
+FieldModel.solve with a reused interaction (FieldModel.create_interaction)
+reach the same magnetization and field as a single relaxation
+(radia Solve), on a hybrid planar model whose iron poles need many
+iterations.
+
+Usage:
+
+    python solve_stats_check.py [--periods N] [--step N] [--prec T]
+"""
+
+import argparse
+import sys
+
+import numpy as np
+import radia as rad
+
+from imaids.models import HybridPlanar
+
+
+def get_magnetization(model):
+    values = []
+
+    def flatten(value):
+        if isinstance(value, (list, tuple)):
+            for item in value:
+                flatten(item)
+        else:
+            values.append(float(value))
+
+    flatten(rad.ObjM(model.radia_object))
+    return np.array(values).reshape(-1, 6)[:, 3:]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--periods', type=int, default=3)
+    parser.add_argument('--step', type=int, default=5)
+    parser.add_argument('--prec', type=float, default=1e-5)
+    parser.add_argument('--max-iter', type=int, default=1000)
+    args = parser.parse_args()
+
+    model = HybridPlanar(nr_periods=args.periods)
+    zpos = np.linspace(-args.periods*model.period_length,
+                       args.periods*model.period_length, 501)
+
+    result = model.solve(prec=args.prec, max_iter=args.max_iter)
+    mag_ref = get_magnetization(model)
+    field_ref = model.get_field(z=zpos)
+    print('solve: {0:d} iterations, dm_avg = {1:.3e}'.format(
+        int(result[3]), result[0]))
+
+    stats = model.solve_with_stats(
+        prec=args.prec, max_iter=args.max_iter, step=args.step)
+    mag = get_magnetization(model)
+    field = model.get_field(z=zpos)
+    print('solve_with_stats (step {0:d}): {1:d} iterations, '
+          'dm_avg = {2:.3e}, status {3:s}'.format(
+              args.step, stats['iterations'], stats['result'][0],
+              stats['status']))
+
+    mag_diff = np.max(np.abs(mag - mag_ref))
+    field_diff = np.max(np.abs(field - field_ref))
+    print('max magnetization difference [T]: {0:.3e}'.format(mag_diff))
+    print('max field difference [T]: {0:.3e}'.format(field_diff))
+
+    tol = 10*args.prec
+    ok = (
+        stats['status'] == 'converged' and
+        stats['iterations'] > args.step and
+        abs(stats['iterations'] - int(result[3])) <= args.step and
+        mag_diff < tol and field_diff < tol)
+
+    # Repeated solves over a reused interaction start from zero
+    # magnetization, as radia Solve.
+    model.create_interaction()
+    for _ in range(2):
+        result_intrc = model.solve(prec=args.prec, max_iter=args.max_iter)
+    mag_diff = np.max(np.abs(get_magnetization(model) - mag_ref))
+    field_diff = np.max(np.abs(model.get_field(z=zpos) - field_ref))
+    model.delete_interaction()
+    print('solve with interaction: {0:d} iterations, max magnetization '
+          'difference [T]: {1:.3e}, max field difference [T]: {2:.3e}'.format(
+              int(result_intrc[3]), mag_diff, field_diff))
+    ok = ok and (
+        int(result_intrc[3]) == int(result[3]) and
+        mag_diff < tol and field_diff < tol)
+    print('OK' if ok else 'FAILED')
+    return 0 if ok else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,9 +1,38 @@
+"""Insertion devices package.
 
-from . import materials
-from . import blocks
-from . import cassettes
-from . import fieldsource
-from . import insertiondevice
-from . import models
-from . import utils
-from . import shimming
\ No newline at end of file
+Submodules are imported lazily, on first attribute access (e.g.
+imaids.models), so that worker processes and command line jobs only pay
+the import time of the modules they use.
+"""
+
+import importlib as _importlib
+
+
+__all__ = [
+    'profiling',
+    'materials',
+    'lifecycle',
+    'blocks',
+    'cassettes',
+    'fieldsource',
+    'insertiondevice',
+    'models',
+    'utils',
+    'shimming',
+    'fieldmapjobs',
+    'batchmaps',
+]
+
+
+def __getattr__(name):
+    if name in __all__:
+        module = _importlib.import_module('.' + name, __name__)
+        globals()[name] = module
+        return module
+    raise AttributeError(
+        'module {0:s} has no attribute {1:s}'.format(
+            repr(__name__), repr(name)))
+
+
+def __dir__():
+    return sorted(list(globals()) + __all__)
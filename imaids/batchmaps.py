@@ -0,0 +1,356 @@
+"""Batch fieldmap and kickmap production.
+
+Command line usage example:
+
+    imaids-maps --model AppleIISabia --configs configs.json \\
+        --x -5 5 0.5 --y -3 3 0.5 --z -800 800 1 --energy 3 --nproc 4
+
+A state file (--state) may be given to load a customized model with the
+load_state method of the --model class.
+
+The configurations file holds a list of dictionaries with keyword
+arguments for the model set_cassete_positions method, optionally with
+a 'name' entry used for the output file names, e.g.:
+
+    [{"name": "hp", "dp": 0, "dg": 0}, {"name": "vp", "dp": 26.25, "dg": 0}]
+
+Outputs whose parameters did not change since the last run are skipped.
+"""
+
+import argparse as _argparse
+import json as _json
+import os as _os
+import time as _time
+from concurrent.futures import ProcessPoolExecutor as _ProcessPoolExecutor
+import numpy as _np
+
+from . import fieldmapjobs as _fieldmapjobs
+from . import utils as _utils
+
+
+def get_grid(grid_spec):
+    """Get grid positions from specification.
+
+    Args:
+        grid_spec (list or float): [min, max, step] list (in mm) or a single
+            position.
+
+    Returns:
+        numpy.ndarray: Grid positions (in mm).
+    """
+    if int(_np.ndim(grid_spec)) == 0:
+        return _np.array([grid_spec], dtype=float)
+    if len(grid_spec) == 1:
+        return _np.array(grid_spec, dtype=float)
+    vmin, vmax, step = grid_spec
+    npts = int(round((vmax - vmin)/step)) + 1
+    return _np.linspace(vmin, vmax, npts)
+
+
+def get_configuration_name(configuration):
+    """Get configuration name used in output file names.
+
+    Args:
+        configuration (dict): Cassette positions, with an optional 'name'.
+
+    Returns:
+        str: Configuration name.
+    """
+    if 'name' in configuration:
+        return str(configuration['name'])
+    items = sorted(configuration.items())
+    return '_'.join('{0:s}={1:g}'.format(k, v) for k, v in items)
+
+
+def create_model(model, state_filename=None):
+    """Create model from class name and optional state file.
+
+    Args:
+        model (str): Class name in imaids.models or full class path
+            ('module.ClassName').
+        state_filename (str, optional): Path to state file loaded with the
+            class load_state method. If None, the model is created with
+            default arguments. Defaults to None.
+
+    Returns:
+        InsertionDeviceModel: Created model.
+    """
+    if '.' not in model:
+        model = 'imaids.models.' + model
+    cls = _fieldmapjobs.load_class(model)
+
+    if state_filename is not None:
+        return cls.load_state(state_filename)
+    return cls()
+
+
+def is_up_to_date(filename, parameters):
+    """Check if output file was created with the same parameters.
+
+    Args:
+        filename (str): Path to output file.
+        parameters (dict): Parameters used to create the output.
+
+    Returns:
+        bool: True if the output file and its parameters file exist and
+            the saved parameters are equal to parameters.
+    """
+    params_filename = filename + '.json'
+    if not (_os.path.isfile(filename) and _os.path.isfile(params_filename)):
+        return False
+    with open(params_filename) as f:
+        return _json.load(f) == parameters
+
+
+def _save_parameters(filename, parameters):
+    with open(filename + '.json', 'w') as f:
+        _json.dump(parameters, f)
+
+
+def run_configuration(spec):
+    """Calculate fieldmap and kickmap of a single configuration.
+
+    Args:
+        spec (dict): Run specification with keys 'model', 'state_filename',
+            'state_mtime', 'configuration', 'x', 'y', 'z', 'energy',
+            'rkstep', 'fieldmap_filename', 'kickmap_filename' and 'force'.
+            Fieldmap or kickmap are not calculated if the corresponding
+            filename is None.
+
+    Returns:
+        dict: Elapsed time of each stage (in s), None for skipped stages.
+    """
+    configuration = dict(spec['configuration'])
+    configuration.pop('name', None)
+
+    parameters = {k: v for k, v in spec.items() if k not in [
+        'fieldmap_filename', 'kickmap_filename', 'force']}
+    kickmap_parameters = dict(parameters)
+    fieldmap_parameters = dict(parameters)
+    for key in ['energy', 'rkstep']:
+        fieldmap_parameters.pop(key)
+
+    do_fieldmap = spec['fieldmap_filename'] is not None and (
+        spec['force'] or not is_up_to_date(
+            spec['fieldmap_filename'], fieldmap_parameters))
+    do_kickmap = spec['kickmap_filename'] is not None and (
+        spec['force'] or not is_up_to_date(
+            spec['kickmap_filename'], kickmap_parameters))
+
+    timing = {'solve': None, 'fieldmap': None, 'kickmap': None}
+    if not (do_fieldmap or do_kickmap):
+        return timing
+
+    t0 = _time.perf_counter()
+    _utils.set_len_tol()
+    device = create_model(spec['model'], spec['state_filename'])
+    if configuration:
+        device.set_cassete_positions(**configuration)
+    device.solve()
+    t1 = _time.perf_counter()
+    timing['solve'] = t1 - t0
+
+    x_list = get_grid(spec['x'])
+    y_list = get_grid(spec['y'])
+    z_list = get_grid(spec['z'])
+
+    if do_fieldmap:
+        device.save_fieldmap(
+            spec['fieldmap_filename'], x_list, y_list, z_list)
+        _save_parameters(spec['fieldmap_filename'], fieldmap_parameters)
+        t2 = _time.perf_counter()
+        timing['fieldmap'] = t2 - t1
+        t1 = t2
+
+    if do_kickmap:
+        device.save_kickmap(
+            spec['kickmap_filename'], spec['energy'], x_list, y_list,
+            z_list[0], z_list[-1], spec['rkstep'])
+        _save_parameters(spec['kickmap_filename'], kickmap_parameters)
+        timing['kickmap'] = _time.perf_counter() - t1
+
+    return timing
+
+
+def run(model, state_filename=None, configurations=None,
+        x=0, y=0, z=(-800, 800, 1), energy=3.0, rkstep=1.0,
+        output_dir='.', prefix=None, fieldmap=True, kickmap=True,
+        nproc=None, force=False, verbose=True):
+    """Calculate fieldmaps and kickmaps for a list of configurations.
+
+    Args:
+        model (str): Class name in imaids.models or full class path.
+        state_filename (str, optional): Path to model state file. If None,
+            the model is created with default arguments. Defaults to None.
+        configurations (list, optional): List of dictionaries with cassette
+            positions (see module documentation). If None, a single run with
+            the default model positions is performed. Defaults to None.
+        x (list or float, optional): x grid [min, max, step] or single
+            position (in mm). Defaults to 0.
+        y (list or float, optional): y grid [min, max, step] or single
+            position (in mm). Defaults to 0.
+        z (list, optional): z grid [min, max, step] (in mm), also defines
+            the kickmap integration limits. Defaults to (-800, 800, 1).
+        energy (float, optional): Electron energy for kickmaps (in GeV).
+            Defaults to 3.0.
+        rkstep (float, optional): Kickmap trajectory integration step
+            (in mm). Defaults to 1.0.
+        output_dir (str, optional): Output directory. Defaults to '.'.
+        prefix (str, optional): Output file names prefix. If None, model
+            or state file name is used. Defaults to None.
+        fieldmap (bool, optional): If True, save fieldmaps (.fld).
+            Defaults to True.
+        kickmap (bool, optional): If True, save kickmaps (.kck).
+            Defaults to True.
+        nproc (int, optional): Number of processes, each one running a
+            configuration. Must be >=1. If None, configurations are run
+            serially. Defaults to None.
+        force (bool, optional): If True, outputs are recalculated even if
+            up to date. Defaults to False.
+        verbose (bool, optional): If True, print timing of each stage.
+            Defaults to True.
+
+    Raises:
+        ValueError: If provided, number of processes must be >=1.
+
+    Returns:
+        list: List of timing dictionaries (see run_configuration), one for
+            each configuration.
+    """
+    if configurations is None:
+        configurations = [{}]
+
+    if prefix is None:
+        if state_filename is not None:
+            prefix = _os.path.splitext(_os.path.basename(state_filename))[0]
+        else:
+            prefix = model.rsplit('.', 1)[-1]
+
+    if state_filename is not None:
+        state_filename = _os.path.abspath(state_filename)
+        state_mtime = _os.path.getmtime(state_filename)
+    else:
+        state_mtime = None
+
+    _os.makedirs(output_dir, exist_ok=True)
+
+    specs = []
+    for configuration in configurations:
+        name = prefix
+        config_name = get_configuration_name(configuration)
+        if config_name:
+            name += '_' + config_name
+        basename = _os.path.join(output_dir, name)
+        specs.append({
+            'model': model,
+            'state_filename': state_filename,
+            'state_mtime': state_mtime,
+            'configuration': configuration,
+            'x': _np.array(x).tolist(),
+            'y': _np.array(y).tolist(),
+            'z': _np.array(z).tolist(),
+            'energy': energy,
+            'rkstep': rkstep,
+            'fieldmap_filename': basename + '.fld' if fieldmap else None,
+            'kickmap_filename': basename + '.kck' if kickmap else None,
+            'force': force,
+        })
+
+    t0 = _time.perf_counter()
+    if nproc is not None:
+        nproc = int(nproc)
+        if nproc < 1:
+            raise ValueError('Number or processes must be >=1.')
+        with _ProcessPoolExecutor(max_workers=nproc) as executor:
+            timings = list(executor.map(run_configuration, specs))
+    else:
+        timings = [run_configuration(spec) for spec in specs]
+
+    if verbose:
+        for spec, timing in zip(specs, timings):
+            name = get_configuration_name(spec['configuration']) or prefix
+            stages = []
+            for stage in ['solve', 'fieldmap', 'kickmap']:
+                value = timing[stage]
+                value = 'skipped' if value is None else '{0:.1f}'.format(
+                    value)
+                stages.append('{0:s} time [s]: {1:s}'.format(stage, value))
+            print('{0:s}: {1:s}'.format(name, ', '.join(stages)))
+        print('total time [s]: {0:.1f}'.format(_time.perf_counter() - t0))
+
+    return timings
+
+
+def get_parser():
+    """Get command line argument parser.
+
+    Returns:
+        argparse.ArgumentParser: Argument parser.
+    """
+    parser = _argparse.ArgumentParser(
+        description='Batch fieldmap and kickmap calculation.')
+    parser.add_argument(
+        '--model', required=True,
+        help='class name in imaids.models or full class path.')
+    parser.add_argument(
+        '--state', help='model state file (.json) loaded by the model class.')
+    parser.add_argument(
+        '--configs', help='configurations file (.json list of cassette '
+        'positions dictionaries).')
+    parser.add_argument(
+        '--x', type=float, nargs='+', default=[0],
+        help='x grid: min max step, or single position [mm].')
+    parser.add_argument(
+        '--y', type=float, nargs='+', default=[0],
+        help='y grid: min max step, or single position [mm].')
+    parser.add_argument(
+        '--z', type=float, nargs=3, default=[-800, 800, 1],
+        help='z grid: min max step [mm].')
+    parser.add_argument(
+        '--energy', type=float, default=3.0,
+        help='electron energy for kickmaps [GeV].')
+    parser.add_argument(
+        '--rkstep', type=float, default=1.0,
+        help='kickmap integration step [mm].')
+    parser.add_argument('--output-dir', default='.', help='output directory.')
+    parser.add_argument('--prefix', help='output file names prefix.')
+    parser.add_argument(
+        '--no-fieldmap', action='store_true', help='do not save fieldmaps.')
+    parser.add_argument(
+        '--no-kickmap', action='store_true', help='do not save kickmaps.')
+    parser.add_argument(
+        '--nproc', type=int, help='number of parallel processes.')
+    parser.add_argument(
+        '--force', action='store_true',
+        help='recalculate outputs even if up to date.')
+    return parser
+
+
+def main(argv=None):
+    """Command line entry point."""
+    parser = get_parser()
+    args = parser.parse_args(argv)
+
+    for name in ['x', 'y']:
+        if len(getattr(args, name)) not in [1, 3]:
+            parser.error(
+                '--{0:s} requires 1 or 3 values.'.format(name))
+
+    configurations = None
+    if args.configs is not None:
+        with open(args.configs) as f:
+            configurations = _json.load(f)
+
+    run(model=args.model, state_filename=args.state,
+        configurations=configurations,
+        x=args.x, y=args.y, z=args.z,
+        energy=args.energy, rkstep=args.rkstep,
+        output_dir=args.output_dir, prefix=args.prefix,
+        fieldmap=not args.no_fieldmap, kickmap=not args.no_kickmap,
+        nproc=args.nproc, force=args.force)
+
+    return 0
+
+
+if __name__ == '__main__':
+    main()
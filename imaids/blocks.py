@@ -9,6 +9,154 @@ from . import materials as _materials
 from . import fieldsource as _fieldsource
 
 
+def get_draw_color(magnetization, draw_color_component=None):
+    """RGB color used for drawing a block.
+
+    Args:
+        magnetization (list): Block magnetization vector [T].
+        draw_color_component (int, optional): Magnetization component used
+            for determining the color (see Block). Defaults to None.
+
+    Returns:
+        list: RGB color.
+    """
+    if draw_color_component is None:
+        return [0.8, 0.9, 0.7] # standard color.
+    else:
+        magnetization_array = _np.array(magnetization)
+        component = magnetization_array[draw_color_component]
+        eps = 10*_np.finfo(_np.float64).eps # Very small number (10 times
+                                            # the smallest epsilon for a
+                                            # flaot) may mean 0.0.
+        if component > eps:
+            return [0, 0.6, 0.7] # blue-ish.
+        elif component < -1*eps:
+            return [0.7, 0.2, 0.5] # pink-ish.
+        else:
+            return [0.8, 0.8, 0.8] # light gray.
+
+
+def get_shape_and_subdivision(shape, subdivision=None):
+    """Get shape and subdivision of a (non cylinder) block as nested lists.
+
+    Args:
+        shape (list, Mx2 or NxMx2): Block shape (see Block). Tuples and
+            numpy arrays (e.g. Block.shape) are also accepted.
+        subdivision (list, 3 or Nx3, optional): Block subdivision (see
+            Block). Defaults to None (no subdivision).
+
+    Raises:
+        ValueError: if the lengths of subdivision and shape arguments
+            (numbers of subblocks) are inconsistent.
+
+    Returns:
+        list, NxMx2: Cross sections of the N subblocks.
+        list, Nx3: Subdivisions of the N subblocks.
+    """
+    shape = _utils.to_list(shape)
+    if _utils.depth(shape) != 3:
+        shape = [shape]
+
+    if subdivision is None:
+        subdivision = [[1, 1, 1]]*len(shape)
+    subdivision = _utils.to_list(subdivision)
+    if _utils.depth(subdivision) != 2:
+        subdivision = [subdivision]
+
+    if len(subdivision) != len(shape):
+        raise ValueError(
+            'Inconsistent length between block_sudivision ' +
+            'and block_shape arguments.')
+    return shape, subdivision
+
+
+def create_block_object(
+        shape, length, longitudinal_position, magnetization, subdivision,
+        material, rectangular=False, cylinder=False, cylinder_nseg=64,
+        draw_color=None):
+    """Creates the radia object of a block, without a Block instance.
+
+    Used by Block and by cassettes, which create the radia objects of their
+    blocks from the block table and create Block objects only when needed.
+
+    Args:
+        shape (list, NxMx2 or float): Cross sections of the N subblocks, or
+            cylinder radius (see Block). In mm.
+        length (float): Block length in mm. If 0, no object is created.
+        longitudinal_position (float): Block center longitudinal position
+            in mm.
+        magnetization (list): Magnetization vector [T].
+        subdivision (list, Nx3): Subdivisions of each subblock.
+        material (Material): Material applied to the subblocks.
+        rectangular (bool, optional): See Block. Defaults to False.
+        cylinder (bool, optional): See Block. Defaults to False.
+        cylinder_nseg (int, optional): See Block. Defaults to 64.
+        draw_color (list, optional): RGB draw color. If None, the standard
+            color is used. Defaults to None.
+
+    Returns:
+        int: Radia object reference, None if length is 0.
+    """
+    if length == 0:
+        return None
+
+    if draw_color is None:
+        draw_color = get_draw_color(magnetization)
+
+    # In both ObjRecMag and ObjThckPgn, 'Frame->Lab' is used so that
+    # div determines the number of divisions in each cartesian direction.
+    # The default option, ('Frame->Loc') would use a local reference
+    # system in which the x direction is the extrusion direction.
+
+    if rectangular:
+        center = []
+        width = []
+        height = []
+        for shp in shape:
+            shp = _np.array(shp)
+            min0 = _np.min(shp[:, 0])
+            max0 = _np.max(shp[:, 0])
+            min1 = _np.min(shp[:, 1])
+            max1 = _np.max(shp[:, 1])
+            center.append([(max0 + min0)/2, (max1 + min1)/2])
+            width.append(max0 - min0)
+            height.append(max1 - min1)
+
+        subblock_list = []
+        for ctr, wdt, hgt, div in zip(center, width, height, subdivision):
+            subblock = _rad.ObjRecMag(
+                [ctr[0], ctr[1], longitudinal_position],
+                [wdt, hgt, length], magnetization)
+            subblock = _rad.MatApl(subblock, material.radia_object)
+            subblock = _rad.ObjDivMag(subblock, div, 'Frame->Lab')
+            subblock_list.append(subblock)
+            _rad.ObjDrwAtr(subblock, draw_color)
+        return _rad.ObjCnt(subblock_list)
+    elif cylinder:
+        subblock_list = []
+        for div in subdivision:
+            # There will be only one subdivision element in this case.
+            subblock = _rad.ObjCylMag([0, 0, longitudinal_position],
+                                      shape, length,
+                                      cylinder_nseg, 'y',
+                                      magnetization)
+            subblock = _rad.MatApl(subblock, material.radia_object)
+            subblock = _rad.ObjDivMag(subblock, div, 'Frame->Lab')
+            subblock_list.append(subblock)
+            _rad.ObjDrwAtr(subblock, draw_color)
+        return _rad.ObjCnt(subblock_list)
+    else:
+        subblock_list = []
+        for shp, div in zip(shape, subdivision):
+            subblock = _rad.ObjThckPgn(
+                longitudinal_position, length, shp, 'z', magnetization)
+            subblock = _rad.MatApl(subblock, material.radia_object)
+            subblock = _rad.ObjDivMag(subblock, div, 'Frame->Lab')
+            subblock_list.append(subblock)
+            _rad.ObjDrwAtr(subblock, draw_color)
+        return _rad.ObjCnt(subblock_list)
+
+
 class Block(_fieldsource.FieldModel):
     """Magnetic material block."""
 
@@ -224,7 +372,7 @@ class Block(_fieldsource.FieldModel):
             self, shape, length, longitudinal_position,
             magnetization=[0, 1.37, 0], subdivision=None, rectangular=False,
             cylinder=False, cylinder_nseg=64, name='', material=None,
-            draw_color_component=None, **kwargs):
+            draw_color_component=None, radia_object=None, **kwargs):
         """Create the radia object for a block with magnetization.
 
         Args:
@@ -287,6 +435,9 @@ class Block(_fieldsource.FieldModel):
                      another color if My < 0 and of a neutral color if My = 0.
                 Defaults to None, meaning no magnetization-related coloring
                     scheme (default color to all blocks).
+            radia_object (int, optional): Radia object already created for
+                the block arguments (see create_block_object), used instead
+                of creating a new one. Defaults to None.
             **kwargs: if material==None additional keyword arguments are passed
                 to the Material initialization, overriding default arguments.
                 Default magnetization can not be overwridden, in this case
@@ -311,35 +462,27 @@ class Block(_fieldsource.FieldModel):
             else:
                 self._shape = shape
         else:
-            if _utils.depth(shape) != 3:
-                self._shape = [shape]
-            else:
-                self._shape = shape
+            self._shape, subdivision = get_shape_and_subdivision(
+                shape, subdivision)
 
         if length < 0:
             raise ValueError('The length must be a positive number.')
         self._length = length
 
         self._check_magnetization(magnetization)
-        self._magnetization = magnetization
-
-        if subdivision is None:
-            if not cylinder:
-                sub = [[1, 1, 1]]*len(self._shape)
-            else:
-                sub = [[1,1,1]]
-        else:
-            sub = subdivision
-
-        if _utils.depth(sub) != 2:
-            sub = [sub]
+        # Magnetization is stored by the block table row, if attached
+        # (see table_row), and by the block otherwise.
+        self._table_row = None
+        self._magnetization = _utils.to_list(magnetization)
 
         if not cylinder:
-            if len(sub) != len(self._shape):
-                raise ValueError(
-                    'Inconsistent length between block_sudivision ' +
-                    'and block_shape arguments.')
-        self._subdivision = sub
+            self._subdivision = subdivision
+        else:
+            sub = [[1, 1, 1]] if subdivision is None else _utils.to_list(
+                subdivision)
+            if _utils.depth(sub) != 2:
+                sub = [sub]
+            self._subdivision = sub
 
         self._rectangular = rectangular
         self._cylinder = cylinder
@@ -352,21 +495,80 @@ class Block(_fieldsource.FieldModel):
         if material is None:
             self._use_default_material = True
             self._default_material_kwargs = kwargs
-            self._material = _materials.Material(
-                mr=_np.linalg.norm(self._magnetization), **kwargs)
+            self._material = _materials.registry.get_material(
+                mr=_np.linalg.norm(magnetization), **kwargs)
         else:
             self._use_default_material = False
             self._material = material
 
-        self.name = name
+        self._name = name
 
-        self._radia_object = None
-        self.create_radia_object()
+        self._shape_view = None
+        self._magnetization_view = None
+        self._subdivision_view = None
+
+        if radia_object is not None:
+            self._radia_object = radia_object
+            self._register_radia_object()
+        else:
+            self._radia_object = None
+            self.create_radia_object()
+
+    @property
+    def name(self):
+        """Block label."""
+        if self._table_row is not None:
+            return self._table_row.name
+        return self._name
+
+    @name.setter
+    def name(self, value):
+        if self._table_row is not None:
+            self._table_row.name = value
+        else:
+            self._name = value
+
+    @property
+    def table_row(self):
+        """Row accessor of the block table storing the block name and
+        magnetization (see cassettes.BlockTable), or None."""
+        return self._table_row
+
+    @table_row.setter
+    def table_row(self, value):
+        # Attributes are moved to the new storage, so that they are
+        # stored only once.
+        name = self.name
+        magnetization = self._get_magnetization()
+        self._table_row = value
+        self._magnetization_view = None
+        if value is not None:
+            value.name = name
+            value.magnetization = magnetization
+            self._name = None
+            self._magnetization = None
+        else:
+            self._name = name
+            self._magnetization = magnetization
+
+    def _get_magnetization(self):
+        """Magnetization vector from table row or block storage."""
+        if self._table_row is not None:
+            return self._table_row.magnetization.tolist()
+        return self._magnetization
 
     @property
     def shape(self):
-        """Block list of shapes [mm]."""
-        return _deepcopy(self._shape)
+        """Block shapes [mm], read-only.
+
+        Tuple of read-only arrays (one for each subblock polygon), or the
+        base radius for cylinder blocks. Use copy_shape for a mutable copy.
+        """
+        if self._cylinder:
+            return self._shape
+        if self._shape_view is None:
+            self._shape_view = _utils.readonly_shape(self._shape)
+        return self._shape_view
 
     @property
     def length(self):
@@ -380,28 +582,46 @@ class Block(_fieldsource.FieldModel):
 
     @property
     def magnetization(self):
-        """Block magnetization vector [T]."""
-        return _deepcopy(self._magnetization)
+        """Block magnetization vector [T], read-only array.
+
+        Use copy_magnetization for a mutable copy.
+        """
+        if self._table_row is not None:
+            return _utils.readonly_array(self._table_row.magnetization)
+        if self._magnetization_view is None:
+            self._magnetization_view = _utils.readonly_array(
+                self._magnetization)
+        return self._magnetization_view
 
     @magnetization.setter
     def magnetization(self, new_magnetization):
         """Set new block magnetization vector [T]."""
         # check magnetization input
         self._check_magnetization(new_magnetization)
-        self._magnetization = new_magnetization
-        # replace material object.
+        if self._table_row is not None:
+            self._table_row.magnetization = new_magnetization
+        else:
+            self._magnetization = _utils.to_list(new_magnetization)
+        self._magnetization_view = None
+        # replace material object. The previous shared material is released
+        # when the previous radia object is deleted.
         if self._use_default_material:
             kwargs = self._default_material_kwargs
-            _rad.UtiDel(self._material.radia_object)
-            self._material = _materials.Material(
-                mr=_np.linalg.norm(self._magnetization), **kwargs)
+            self._material = _materials.registry.get_material(
+                mr=_np.linalg.norm(new_magnetization), **kwargs)
         # replace radia_object with a replica with new mag.
         self.create_radia_object()
 
     @property
     def subdivision(self):
-        """Block list of shape subdivisions."""
-        return _deepcopy(self._subdivision)
+        """Block shape subdivisions, read-only Nx3 array.
+
+        Use copy_subdivision for a mutable copy.
+        """
+        if self._subdivision_view is None:
+            self._subdivision_view = _utils.readonly_array(
+                self._subdivision, dtype=int)
+        return self._subdivision_view
 
     @property
     def rectangular(self):
@@ -426,20 +646,8 @@ class Block(_fieldsource.FieldModel):
     @property
     def draw_color(self):
         """RGB color used for draw method."""
-        if self.draw_color_component is None:
-            return [0.8, 0.9, 0.7] # standard color.
-        else:
-            magnetization_array = _np.array(self._magnetization)
-            component = magnetization_array[self.draw_color_component]
-            eps = 10*_np.finfo(_np.float64).eps # Very small number (10 times
-                                                # the smallest epsilon for a
-                                                # flaot) may mean 0.0.
-            if component > eps:
-                return [0, 0.6, 0.7] # blue-ish.
-            elif component < -1*eps:
-                return [0.7, 0.2, 0.5] # pink-ish.
-            else:
-                return [0.8, 0.8, 0.8] # light gray.
+        return get_draw_color(
+            self._get_magnetization(), self.draw_color_component)
 
     @property
     def state(self):
@@ -447,7 +655,7 @@ class Block(_fieldsource.FieldModel):
             'shape': self._shape,
             'length': self._length,
             'longitudinal_position': self._longitudinal_position,
-            'magnetization': self._magnetization,
+            'magnetization': self._get_magnetization(),
             'subdivision': self._subdivision,
             'rectangular': self._rectangular,
             'cylinder': self._cylinder,
@@ -456,6 +664,18 @@ class Block(_fieldsource.FieldModel):
         data.update(self._material.state)
         return data
 
+    def copy_shape(self):
+        """Returns mutable copy of the block shapes list [mm]."""
+        return _deepcopy(self._shape)
+
+    def copy_magnetization(self):
+        """Returns mutable copy of the block magnetization vector [T]."""
+        return _deepcopy(self._get_magnetization())
+
+    def copy_subdivision(self):
+        """Returns mutable copy of the block subdivisions list."""
+        return _deepcopy(self._subdivision)
+
     @classmethod
     def get_predefined_shape(cls, device_name):
         """Get predefined block shape(s) for the device.
@@ -484,66 +704,25 @@ class Block(_fieldsource.FieldModel):
 
     def create_radia_object(self):
         """Creates the radia object."""
+        # The previous object is deleted only after the new one is created,
+        # so that a shared material used by both is not released.
+        previous_radia_object = self._radia_object
+        self._radia_object = None
+        self._create_radia_object()
         if self._radia_object is not None:
-            _utils.delete_recursive(self._radia_object)
-
-        if self._length == 0:
-            return
-
-        # In both ObjRecMag and ObjThckPgn, 'Frame->Lab' is used so that
-        # div determines the number of divisions in each cartesian direction.
-        # The default option, ('Frame->Loc') would use a local reference
-        # system in which the x direction is the extrusion direction.
-
-        if self._rectangular:
-            center = []
-            width = []
-            height = []
-            for shp in self._shape:
-                shp = _np.array(shp)
-                min0 = _np.min(shp[:, 0])
-                max0 = _np.max(shp[:, 0])
-                min1 = _np.min(shp[:, 1])
-                max1 = _np.max(shp[:, 1])
-                center.append([(max0 + min0)/2, (max1 + min1)/2])
-                width.append(max0 - min0)
-                height.append(max1 - min1)
-
-            subblock_list = []
-            for ctr, wdt, hgt, div in zip(
-                    center, width, height, self._subdivision):
-                subblock = _rad.ObjRecMag(
-                    [ctr[0], ctr[1], self._longitudinal_position],
-                    [wdt, hgt, self._length], self._magnetization)
-                subblock = _rad.MatApl(subblock, self._material.radia_object)
-                subblock = _rad.ObjDivMag(subblock, div, 'Frame->Lab')
-                subblock_list.append(subblock)
-                _rad.ObjDrwAtr(subblock, self.draw_color)
-            self._radia_object = _rad.ObjCnt(subblock_list)
-        elif self._cylinder:
-            subblock_list = []
-            for div in self._subdivision:
-                # There will be only one _subdivision elements in this case.
-                subblock = _rad.ObjCylMag([0,0,self._longitudinal_position],
-                                            self._shape, self._length,
-                                            self._cylinder_nseg, 'y',
-                                            self._magnetization)
-                subblock = _rad.MatApl(subblock, self._material.radia_object)
-                subblock = _rad.ObjDivMag(subblock, div, 'Frame->Lab')
-                subblock_list.append(subblock)
-                _rad.ObjDrwAtr(subblock, self.draw_color)
-            self._radia_object = _rad.ObjCnt(subblock_list)
-        else:
-            subblock_list = []
-            for shp, div in zip(self._shape, self._subdivision):
-                subblock = _rad.ObjThckPgn(
-                    self._longitudinal_position, self._length, shp, 'z',
-                    self._magnetization)
-                subblock = _rad.MatApl(subblock, self._material.radia_object)
-                subblock = _rad.ObjDivMag(subblock, div, 'Frame->Lab')
-                subblock_list.append(subblock)
-                _rad.ObjDrwAtr(subblock, self.draw_color)
-            self._radia_object = _rad.ObjCnt(subblock_list)
+            _materials.registry.add_reference(
+                self._material, self._radia_object)
+        if previous_radia_object is not None:
+            _utils.delete_recursive(previous_radia_object)
+        self._register_radia_object()
+
+    def _create_radia_object(self):
+        """Creates the radia object without deleting the previous one."""
+        self._radia_object = create_block_object(
+            self._shape, self._length, self._longitudinal_position,
+            self._get_magnetization(), self._subdivision, self._material,
+            rectangular=self._rectangular, cylinder=self._cylinder,
+            cylinder_nseg=self._cylinder_nseg, draw_color=self.draw_color)
 
     def get_geometry_bounding_box(self):
         """Geometrical limits (bounding box) of Block's input geometry
@@ -6,7 +6,165 @@ import radia as _rad
 
 from . import utils as _utils
 from . import blocks as _blocks
+from . import materials as _materials
 from . import fieldsource as _fieldsource
+from . import profiling as _profiling
+
+
+class BlockRow():
+    """Row accessor of a BlockTable."""
+
+    __slots__ = ('_table', '_index')
+
+    def __init__(self, table, index):
+        """Creates accessor for a table row.
+
+        Args:
+            table (BlockTable): Block table.
+            index (int): Row index.
+        """
+        self._table = table
+        self._index = index
+
+    @property
+    def index(self):
+        """Row index."""
+        return self._index
+
+    @property
+    def name(self):
+        """Block name."""
+        return self._table.name[self._index]
+
+    @name.setter
+    def name(self, value):
+        self._table.name[self._index] = value
+
+    @property
+    def length(self):
+        """Block length [mm]."""
+        return self._table.length[self._index]
+
+    @property
+    def longitudinal_position(self):
+        """Initial block longitudinal position [mm]."""
+        return self._table.longitudinal_position[self._index]
+
+    @property
+    def magnetization(self):
+        """Block magnetization vector [T]."""
+        return self._table.magnetization[self._index]
+
+    @magnetization.setter
+    def magnetization(self, value):
+        self._table.magnetization[self._index] = value
+
+    @property
+    def position_err(self):
+        """Block position error [mm]."""
+        return self._table.position_err[self._index]
+
+    @property
+    def is_pole(self):
+        """True if block is a pole, False otherwise."""
+        return self._table.is_pole[self._index]
+
+
+class BlockTable():
+    """Structure-of-arrays table of cassette block attributes.
+
+    Each attribute is stored as a numpy array column with one entry for
+    each block, so that selections, sorting and magnetization updates may
+    be vectorized.
+    """
+
+    def __init__(
+            self, name=None, length=None, longitudinal_position=None,
+            magnetization=None, position_err=None, is_pole=None):
+        """Creates table columns.
+
+        Args:
+            name (list, optional): Block names. Defaults to None.
+            length (list, optional): Block lengths [mm]. Defaults to None.
+            longitudinal_position (list, optional): Initial longitudinal
+                positions [mm]. Defaults to None.
+            magnetization (list, Nx3, optional): Magnetization vectors [T].
+                Defaults to None.
+            position_err (list, Nx3, optional): Position errors [mm].
+                Defaults to None.
+            is_pole (list, optional): Pole flags. Defaults to None.
+
+        Raises:
+            ValueError: If columns have inconsistent lengths.
+        """
+        self.length = _np.array(
+            length if length is not None else [], dtype=float)
+        nr_blocks = len(self.length)
+
+        if name is None:
+            name = ['']*nr_blocks
+        if longitudinal_position is None:
+            longitudinal_position = _np.zeros(nr_blocks)
+        if magnetization is None:
+            magnetization = _np.zeros((nr_blocks, 3))
+        if position_err is None:
+            position_err = _np.zeros((nr_blocks, 3))
+        if is_pole is None:
+            is_pole = _np.zeros(nr_blocks, dtype=bool)
+
+        self.name = _np.empty(nr_blocks, dtype=object)
+        self.name[:] = list(name)
+        self.longitudinal_position = _np.array(
+            longitudinal_position, dtype=float)
+        self.magnetization = _np.array(
+            magnetization, dtype=float).reshape(-1, 3)
+        self.position_err = _np.array(
+            position_err, dtype=float).reshape(-1, 3)
+        self.is_pole = _np.array(is_pole, dtype=bool)
+
+        columns = [
+            self.name, self.longitudinal_position, self.magnetization,
+            self.position_err, self.is_pole]
+        if any(len(column) != nr_blocks for column in columns):
+            raise ValueError('Inconsistent block table column lengths.')
+
+    def __len__(self):
+        """Number of blocks."""
+        return len(self.length)
+
+    def __getitem__(self, index):
+        """Row accessor for block index."""
+        if index < 0:
+            index += len(self)
+        if index < 0 or index >= len(self):
+            raise IndexError('Block index out of range.')
+        return BlockRow(self, index)
+
+    def __iter__(self):
+        """Iterate over row accessors."""
+        return (BlockRow(self, index) for index in range(len(self)))
+
+    def select(self, mask):
+        """Get indices of blocks selected by a mask.
+
+        Args:
+            mask (numpy.ndarray): Boolean mask with one entry for each block.
+
+        Returns:
+            numpy.ndarray: Indices of selected blocks.
+        """
+        return _np.flatnonzero(_np.asarray(mask, dtype=bool))
+
+    def argsort(self, column):
+        """Get indices that sort the blocks by a column.
+
+        Args:
+            column (str): Column name (e.g. 'longitudinal_position').
+
+        Returns:
+            numpy.ndarray: Sorting indices (stable sort).
+        """
+        return _np.argsort(getattr(self, column), kind='stable')
 
 
 class Cassette(
@@ -187,7 +345,7 @@ class Cassette(
             raise ValueError('Invalid value for upper_cassette argument.')
         self._upper_cassette = upper_cassette
 
-        self._block_shape = block_shape
+        self._block_shape = _utils.to_list(block_shape)
         self._rectangular = rectangular
 
         if start_blocks_length and start_blocks_distance:
@@ -242,12 +400,12 @@ class Cassette(
             if pole_material is None:
                 raise ValueError('If hybrid, pole_material must be provided.')
 
-        self._pole_shape = pole_shape
+        self._pole_shape = _utils.to_list(pole_shape)
         self._pole_length = pole_length
         self._pole_material = pole_material
-        self._pole_subdivision = pole_subdivision
+        self._pole_subdivision = _utils.to_list(pole_subdivision)
 
-        self._block_subdivision = block_subdivision
+        self._block_subdivision = _utils.to_list(block_subdivision)
         self._ksipar = ksipar
         self._ksiper = ksiper
         self._draw_color_component = draw_color_component
@@ -256,7 +414,9 @@ class Cassette(
         # Attributes not directly given by __init__ arguments
         self._position_err = []
         self._blocks = []
+        self._block_objects = []
         self._is_pole_list = []
+        self._block_table = BlockTable()
         self._radia_object = None
         if init_radia_object:
             self.create_radia_object()
@@ -275,6 +435,24 @@ class Cassette(
         # > longitudinal_distance_list
         # Which are deinfed below.
 
+    @staticmethod
+    def _readonly(value, dtype=float):
+        """Read-only array view of a list attribute (None is kept)."""
+        if value is None:
+            return None
+        return _utils.readonly_array(value, dtype=dtype)
+
+    def copy_attribute(self, name):
+        """Returns mutable copy of a cassette attribute.
+
+        Args:
+            name (str): Attribute name (e.g. 'block_shape', 'position_err').
+
+        Returns:
+            object: Deep copy of the attribute value.
+        """
+        return _deepcopy(getattr(self, '_' + name))
+
     @property
     def nr_periods(self):
         """Number of complete periods."""
@@ -287,8 +465,8 @@ class Cassette(
 
     @property
     def block_shape(self):
-        """Block list of shapes [mm]."""
-        return _deepcopy(self._block_shape)
+        """Block shapes [mm], tuple of read-only arrays."""
+        return _utils.readonly_shape(self._block_shape)
 
     @property
     def mr(self):
@@ -307,8 +485,8 @@ class Cassette(
 
     @property
     def block_subdivision(self):
-        """Block shape subdivision."""
-        return _deepcopy(self._block_subdivision)
+        """Block shape subdivision, read-only array."""
+        return self._readonly(self._block_subdivision, dtype=int)
 
     @property
     def rectangular(self):
@@ -332,8 +510,10 @@ class Cassette(
 
     @property
     def pole_shape(self):
-        """Pole list of shapes [mm]."""
-        return _deepcopy(self._pole_shape)
+        """Pole shapes [mm], tuple of read-only arrays."""
+        if self._pole_shape is None:
+            return None
+        return _utils.readonly_shape(self._pole_shape)
 
     @property
     def pole_length(self):
@@ -342,49 +522,72 @@ class Cassette(
 
     @property
     def pole_subdivision(self):
-        """Pole shape subdivision."""
-        return _deepcopy(self._pole_subdivision)
+        """Pole shape subdivision, read-only array."""
+        return self._readonly(self._pole_subdivision, dtype=int)
+
+    @property
+    def pole_material(self):
+        """Pole material."""
+        return self._pole_material
 
     @property
     def start_blocks_length(self):
-        """List of block lengths in the start of the cassette."""
-        return _deepcopy(self._start_blocks_length)
+        """Block lengths in the start of the cassette, read-only array."""
+        return self._readonly(self._start_blocks_length)
 
     @property
     def start_blocks_distance(self):
-        """List of distance between blocks in the start of the cassette."""
-        return _deepcopy(self._start_blocks_distance)
+        """Distances between blocks in the start of the cassette,
+        read-only array."""
+        return self._readonly(self._start_blocks_distance)
 
     @property
     def end_blocks_length(self):
-        """List of block lengths in the end of the cassette."""
-        return _deepcopy(self._end_blocks_length)
+        """Block lengths in the end of the cassette, read-only array."""
+        return self._readonly(self._end_blocks_length)
 
     @property
     def end_blocks_distance(self):
-        """List of distance between blocks in the end of the cassette."""
-        return _deepcopy(self._end_blocks_distance)
+        """Distances between blocks in the end of the cassette,
+        read-only array."""
+        return self._readonly(self._end_blocks_distance)
 
     @property
     def start_blocks_magnetization(self):
-        """List of magnetizations of blocks in the start of the cassette."""
-        return _deepcopy(self._start_blocks_magnetization)
+        """Magnetizations of blocks in the start of the cassette,
+        read-only array."""
+        return self._readonly(self._start_blocks_magnetization)
 
     @property
     def end_blocks_magnetization(self):
-        """List of magnetizations of blocks in the end of the cassette."""
-        return _deepcopy(self._end_blocks_magnetization)
+        """Magnetizations of blocks in the end of the cassette,
+        read-only array."""
+        return self._readonly(self._end_blocks_magnetization)
 
     @property
     def position_err(self):
-        """Position errors [mm]."""
-        return _deepcopy(self._position_err)
+        """Position errors [mm], read-only array."""
+        return self._readonly(self._position_err)
 
     @property
     def blocks(self):
-        """List of Block objects."""
+        """List of Block objects.
+
+        Block objects are created on first access, from the block table and
+        the Radia objects of the cassette (block attributes are stored only
+        by the block table).
+        """
+        if self._blocks is None:
+            self._blocks = [
+                self._create_block(idx)
+                for idx in range(len(self._block_table))]
         return self._blocks
 
+    @property
+    def block_table(self):
+        """Table (BlockTable) of block attributes, one row for each block."""
+        return self._block_table
+
     @property
     def is_pole_list(self):
         """List of boolean values, True if object is pole, False otherwise."""
@@ -424,8 +627,7 @@ class Cassette(
     @property
     def block_names(self):
         """List of block names."""
-        name_list = [block.name for block in self._blocks]
-        return name_list
+        return self._block_table.name.tolist()
 
     @property
     def magnetization_list(self):
@@ -434,20 +636,17 @@ class Cassette(
         This getter method will return the actual magnetization used for
         setting up the blocks.
         """
-        mag_list = [block.magnetization for block in self._blocks]
-        return mag_list
+        return self._block_table.magnetization.tolist()
 
     @property
     def length_list(self):
         """List of lengths for Block objects [mm]."""
-        length_list = [block.length for block in self._blocks]
-        return length_list
+        return self._block_table.length.tolist()
 
     @property
     def longitudinal_position_list(self):
         """List of initial longitudinal position of blocks [mm]."""
-        pos_list = [block.longitudinal_position for block in self._blocks]
-        return pos_list
+        return self._block_table.longitudinal_position.tolist()
 
     @property
     def longitudinal_distance_list(self):
@@ -481,24 +680,24 @@ class Cassette(
     def state(self):
         """Dictionary representing cassette properties"""
         data = {
-            'block_shape': self.block_shape,
+            'block_shape': self._block_shape,
             'nr_periods': self.nr_periods,
             'period_length': self.period_length,
             'mr': self.mr,
             'upper_cassette': self.upper_cassette,
             'longitudinal_distance': self.longitudinal_distance,
-            'block_subdivision': self.block_subdivision,
+            'block_subdivision': self._block_subdivision,
             'rectangular': self.rectangular,
             'ksipar': self.ksipar,
             'ksiper': self.ksiper,
-            'start_blocks_length': self.start_blocks_length,
-            'start_blocks_distance': self.start_blocks_distance,
-            'end_blocks_length': self.end_blocks_length,
-            'end_blocks_distance': self.end_blocks_distance,
+            'start_blocks_length': self._start_blocks_length,
+            'start_blocks_distance': self._start_blocks_distance,
+            'end_blocks_length': self._end_blocks_length,
+            'end_blocks_distance': self._end_blocks_distance,
             'hybrid': self.hybrid,
-            'pole_shape': self.pole_shape,
+            'pole_shape': self._pole_shape,
             'pole_length': self.pole_length,
-            'pole_subdivision': self.pole_subdivision,
+            'pole_subdivision': self._pole_subdivision,
             'name': self.name,
             'block_names': list(self.block_names),
             'magnetization_list': list(self.magnetization_list),
@@ -537,6 +736,7 @@ class Cassette(
 
         return cassette
 
+    @_profiling.timed
     def create_radia_object(
             self,
             block_names=None,
@@ -626,12 +826,12 @@ class Cassette(
         if magnetization_list is None:
             magnetization_list = self.get_ideal_magnetization_list()
         magnetization_list = _np.array(magnetization_list, dtype=float)
-        if self.start_blocks_magnetization and self.nr_start_blocks > 0:
+        if self._start_blocks_magnetization and self.nr_start_blocks > 0:
             magnetization_list[:self.nr_start_blocks] = \
-                                                self.start_blocks_magnetization
-        if self.end_blocks_magnetization and self.nr_end_blocks > 0:
+                                                self._start_blocks_magnetization
+        if self._end_blocks_magnetization and self.nr_end_blocks > 0:
             magnetization_list[-1*self.nr_end_blocks:] = \
-                                                self.end_blocks_magnetization
+                                                self._end_blocks_magnetization
         magnetization_list = magnetization_list.tolist()
 
         if self.hybrid:
@@ -698,50 +898,109 @@ class Cassette(
         position_list = _np.cumsum(position_list)
         position_list -= (position_list[0] + position_list[-1])/2
 
-        self._blocks = []
-        for length, position, magnetization, is_pole in zip(length_list,
-                position_list, magnetization_list, self.is_pole_list):
-            if is_pole:
+        self._block_table = BlockTable(
+            name=block_names, length=length_list,
+            longitudinal_position=position_list,
+            magnetization=magnetization_list,
+            position_err=position_err, is_pole=self._is_pole_list)
+        # Poles are created with [0,0,0] magnetization.
+        self._block_table.magnetization[self._block_table.is_pole] = 0
+
+        # Radia objects are created directly from the table, and Block
+        # objects only when the blocks property is accessed.
+        self._blocks = None
+        self._block_objects = []
+        for row in self._block_table:
+            if row.is_pole:
                 #POLE:  pole_material completely defines material properties
-                #       (by an MxH curve if linear, which is the typical case).                #.
+                #       (by an MxH curve if linear, which is the typical case).
                 #       Magnetization direction is always [0,0,0].
-                #       blocks.Block object uses pole_material and [0,0,0]
-                #       directly.
-                block = _blocks.Block(
-                    self._pole_shape, length, position, [0, 0, 0],
-                    subdivision=self._pole_subdivision,
-                    rectangular=self._rectangular,
-                    material=self._pole_material,
-                    draw_color_component=self.draw_color_component)
+                shape = self._pole_shape
+                subdivision = self._pole_subdivision
+                material = self._pole_material
             else:
-                #BLOCK: magnetization vector (direction and modulus) is passed
-                #       to blocks.Block object, defining magnetization modulus
-                #       and direction of a new linear material.
+                #BLOCK: magnetization vector (direction and modulus) defines
+                #       magnetization modulus and direction of a new linear
+                #       material, with ksipar and ksiper.
                 #       (if magnetization_list is not passed, this vector
                 #        was previously created using mr and a Halbach array).
-                #       ksipar and ksiper are also passed to the block object
-                #       completing the linear material definition.
-                block = _blocks.Block(
-                    self._block_shape, length, position, magnetization,
-                    subdivision=self._block_subdivision,
-                    rectangular=self._rectangular,
-                    ksipar=self._ksipar, ksiper=self._ksiper,
-                    draw_color_component=self.draw_color_component)
-            self._blocks.append(block)
-
-        for idx, block in enumerate(self._blocks):
-            block.shift(position_err[idx])
-
-        for name, block in zip(block_names, self._blocks):
-            block.name = name
-
-        # _blocks attribute becomes a single radia container object,
-        # whose index is the one stored in _radia_object.
-        rad_obj_list = []
-        for block in self._blocks:
-            if block.radia_object is not None:
-                rad_obj_list.append(block.radia_object)
-        self._radia_object = _rad.ObjCnt(rad_obj_list)
+                shape = self._block_shape
+                subdivision = self._block_subdivision
+                material = _materials.registry.get_material(
+                    mr=_np.linalg.norm(row.magnetization),
+                    ksipar=self._ksipar, ksiper=self._ksiper)
+            shape, subdivision = _blocks.get_shape_and_subdivision(
+                shape, subdivision)
+            magnetization = row.magnetization.tolist()
+            obj = _blocks.create_block_object(
+                shape, float(row.length), float(row.longitudinal_position),
+                magnetization, subdivision, material,
+                rectangular=self._rectangular,
+                draw_color=_blocks.get_draw_color(
+                    magnetization, self.draw_color_component))
+            if obj is not None:
+                _materials.registry.add_reference(material, obj)
+                obj = _rad.TrfOrnt(
+                    obj, _rad.TrfTrsl(row.position_err.tolist()))
+            self._block_objects.append(obj)
+
+        # The blocks radia objects are grouped in a single radia container
+        # object, whose index is the one stored in _radia_object.
+        self._radia_object = _rad.ObjCnt(
+            [obj for obj in self._block_objects if obj is not None])
+        self._register_radia_object()
+
+    def _map_radia_objects(self, ref_map):
+        """Replace Radia object references of a copy by the duplicated
+        ones (see FieldModel.__deepcopy__)."""
+        super()._map_radia_objects(ref_map)
+        self._block_objects = [
+            None if obj is None else ref_map[obj]
+            for obj in self._block_objects]
+
+    def _create_block(self, idx):
+        """Create Block object of the block table row idx, using the
+        existing radia object."""
+        row = self._block_table[idx]
+        if row.is_pole:
+            block = _blocks.Block(
+                self._pole_shape, float(row.length),
+                float(row.longitudinal_position), [0, 0, 0],
+                subdivision=self._pole_subdivision,
+                rectangular=self._rectangular,
+                material=self._pole_material,
+                draw_color_component=self.draw_color_component,
+                radia_object=self._block_objects[idx])
+        else:
+            block = _blocks.Block(
+                self._block_shape, float(row.length),
+                float(row.longitudinal_position),
+                row.magnetization.tolist(),
+                subdivision=self._block_subdivision,
+                rectangular=self._rectangular,
+                ksipar=self._ksipar, ksiper=self._ksiper,
+                draw_color_component=self.draw_color_component,
+                radia_object=self._block_objects[idx])
+        block.table_row = row
+        return block
+
+    def get_longitudinal_center(self):
+        """Longitudinal center of the cassette at creation [mm].
+
+        Computed from block lengths, initial positions and longitudinal
+        position errors, without Radia introspection. Translations applied
+        after creation are not taken into account.
+
+        Returns:
+            float: Midpoint between the cassette longitudinal limits [mm].
+        """
+        table = self._block_table
+        if len(table) == 0:
+            return 0.0
+        pos = table.longitudinal_position + table.position_err[:, 2]
+        zmin = _np.min(pos - table.length/2)
+        zmax = _np.max(pos + table.length/2)
+        return (zmin + zmax)/2
 
     def get_ideal_magnetization_list(self):
         """List of magnetization vector without amplitude and
@@ -0,0 +1,264 @@
+"""Distributed fieldmap generation.
+
+The fieldmap grid is split in longitudinal slabs. Each slab is described by
+a .json job file holding the model class, a path to the model state file,
+the cassette positions and the slab grid. Jobs are independent and can be
+run by any process with access to the job directory, for instance on batch
+nodes:
+
+    python -m imaids.fieldmapjobs job_0000.json job_0001.json ...
+
+After all jobs are finished, the slabs are merged in order into a single
+fieldmap file with merge_fieldmap_slabs.
+"""
+
+import importlib as _importlib
+import json as _json
+import os as _os
+import sys as _sys
+from concurrent.futures import ProcessPoolExecutor as _ProcessPoolExecutor
+import numpy as _np
+
+from . import fieldsource as _fieldsource
+
+
+def get_class_path(obj):
+    """Get full class path of an object.
+
+    Args:
+        obj (object): Object instance.
+
+    Returns:
+        str: Class path in the 'module.ClassName' format.
+    """
+    cls = type(obj)
+    return '{0:s}.{1:s}'.format(cls.__module__, cls.__qualname__)
+
+
+def load_class(class_path):
+    """Import class from its full path.
+
+    Args:
+        class_path (str): Class path in the 'module.ClassName' format.
+
+    Returns:
+        type: Imported class.
+    """
+    module_name, class_name = class_path.rsplit('.', 1)
+    module = _importlib.import_module(module_name)
+    return getattr(module, class_name)
+
+
+def create_fieldmap_jobs(
+        model, directory, x_list, y_list, z_list, nr_slabs,
+        solve=True, prec=0.00001, max_iter=1000, name='fieldmap'):
+    """Save model state and job files for distributed fieldmap generation.
+
+    The z positions are split in nr_slabs contiguous slabs, so that merging
+    the slabs in order reproduces the save_fieldmap point ordering.
+
+    Args:
+        model (FieldModel): Model with load_state and save_state methods.
+        directory (str): Directory to save state, job and slab files.
+        x_list (list or float or int): x positions of the grid (in mm).
+        y_list (list or float or int): y positions of the grid (in mm).
+        z_list (list or float or int): z positions of the grid (in mm).
+        nr_slabs (int): Number of longitudinal slabs (jobs).
+        solve (bool, optional): If True, each job solves the model before
+            calculating the field. Defaults to True.
+        prec (float, optional): Solve precision. Defaults to 0.00001.
+        max_iter (int, optional): Maximum number of solve iterations.
+            Defaults to 1000.
+        name (str, optional): Prefix of the created files.
+            Defaults to 'fieldmap'.
+
+    Raises:
+        ValueError: If nr_slabs is smaller than 1.
+
+    Returns:
+        list: Paths of the job files, in slab order.
+    """
+    nr_slabs = int(nr_slabs)
+    if nr_slabs < 1:
+        raise ValueError('Number of slabs must be >=1.')
+
+    if int(_np.ndim(x_list)) == 0:
+        x_list = [x_list]
+
+    if int(_np.ndim(y_list)) == 0:
+        y_list = [y_list]
+
+    if int(_np.ndim(z_list)) == 0:
+        z_list = [z_list]
+
+    x_list = _np.round(x_list, decimals=8)
+    y_list = _np.round(y_list, decimals=8)
+    z_list = _np.round(z_list, decimals=8)
+
+    _os.makedirs(directory, exist_ok=True)
+
+    state_filename = name + '_state.json'
+    model.save_state(_os.path.join(directory, state_filename))
+
+    if hasattr(model, 'get_cassette_positions'):
+        cassette_positions = model.get_cassette_positions()
+    else:
+        cassette_positions = {}
+
+    z_slabs = [z for z in _np.array_split(z_list, nr_slabs) if len(z) > 0]
+
+    job_filenames = []
+    for index, z_slab in enumerate(z_slabs):
+        job = {
+            'index': index,
+            'nr_slabs': len(z_slabs),
+            'class': get_class_path(model),
+            'state_filename': state_filename,
+            'cassette_positions': cassette_positions,
+            'solve': solve,
+            'prec': prec,
+            'max_iter': max_iter,
+            'x_list': x_list.tolist(),
+            'y_list': y_list.tolist(),
+            'z_list': z_slab.tolist(),
+            'slab_filename': '{0:s}_slab_{1:04d}.npy'.format(name, index),
+        }
+        job_filename = _os.path.join(
+            directory, '{0:s}_job_{1:04d}.json'.format(name, index))
+        with open(job_filename, 'w') as f:
+            _json.dump(job, f)
+        job_filenames.append(job_filename)
+
+    return job_filenames
+
+
+def _read_job(job_filename):
+    """Read job file, resolving file names relative to its directory."""
+    with open(job_filename) as f:
+        job = _json.load(f)
+
+    directory = _os.path.dirname(_os.path.abspath(job_filename))
+    for key in ['state_filename', 'slab_filename']:
+        job[key] = _os.path.join(directory, job[key])
+
+    return job
+
+
+def run_fieldmap_job(job_filename):
+    """Calculate the fieldmap slab described by a job file.
+
+    The slab raw data ([x, y, z, bx, by, bz] rows) is saved in .npy format.
+    The file is written under a temporary name and renamed when complete,
+    so that partial slabs are never merged.
+
+    Args:
+        job_filename (str): Path to job file.
+
+    Returns:
+        str: Path to slab file.
+    """
+    job = _read_job(job_filename)
+
+    cls = load_class(job['class'])
+    model = cls.load_state(job['state_filename'])
+    if job['cassette_positions']:
+        model.set_cassete_positions(**job['cassette_positions'])
+    if job['solve']:
+        model.solve(prec=job['prec'], max_iter=job['max_iter'])
+
+    pos_list = []
+    for z in job['z_list']:
+        for y in job['y_list']:
+            for x in job['x_list']:
+                pos_list.append([x, y, z])
+
+    field = model.get_field_at_points(pos_list)
+    raw_data = _np.hstack([_np.array(pos_list).reshape(-1, 3), field])
+
+    slab_filename = job['slab_filename']
+    tmp_filename = slab_filename + '.tmp'
+    with open(tmp_filename, 'wb') as f:
+        _np.save(f, raw_data)
+    _os.replace(tmp_filename, slab_filename)
+
+    return slab_filename
+
+
+def run_fieldmap_jobs(job_filenames, nproc=None):
+    """Run fieldmap jobs locally.
+
+    Local launcher mainly intended for testing job files before
+    submitting them to batch nodes. Each job loads its own model from
+    the state file, so only the job file name is sent to the workers.
+
+    Args:
+        job_filenames (list): Paths to job files.
+        nproc (int, optional): number of processes for parallel computation.
+            Must be >=1. If None, jobs are run serially. Defaults to None.
+
+    Note:
+        Python multiprocessing does not work interactively, it must be
+        run in a __main__ module, inside the clause:
+            if __name__ == '__main__':
+
+    Raises:
+        ValueError: If provided, number of processes must be >=1.
+
+    Returns:
+        list: Paths to slab files.
+    """
+    if nproc is not None:
+        nproc = int(nproc)
+        if nproc < 1:
+            raise ValueError('Number or processes must be >=1.')
+        with _ProcessPoolExecutor(max_workers=nproc) as executor:
+            return list(executor.map(run_fieldmap_job, job_filenames))
+
+    return [run_fieldmap_job(job_filename) for job_filename in job_filenames]
+
+
+def merge_fieldmap_slabs(job_filenames, filename, header=None):
+    """Merge fieldmap slabs into a single fieldmap file.
+
+    Slabs are merged in job index order, independently of the order of
+    job_filenames or of job completion.
+
+    Args:
+        job_filenames (list): Paths to job files.
+        filename (str): Path to fieldmap file. If it ends with '.npy', raw
+            data is saved in numpy binary format. Otherwise, the text format
+            of FieldSource.save_fieldmap is used.
+        header (list, optional): List of header lines, only used for text
+            files. Defaults to None.
+
+    Raises:
+        ValueError: If slabs are missing.
+
+    Returns:
+        bool: True.
+    """
+    jobs = sorted(
+        [_read_job(job_filename) for job_filename in job_filenames],
+        key=lambda job: job['index'])
+
+    indices = [job['index'] for job in jobs]
+    if len(jobs) == 0 or indices != list(range(jobs[0]['nr_slabs'])):
+        raise ValueError('Job files do not cover all slabs.')
+
+    for job in jobs:
+        if not _os.path.isfile(job['slab_filename']):
+            raise ValueError(
+                'Missing slab file: {0:s}'.format(job['slab_filename']))
+
+    raw_data = _np.vstack([_np.load(job['slab_filename']) for job in jobs])
+
+    if filename.endswith('.npy'):
+        _np.save(filename, raw_data)
+        return True
+
+    return _fieldsource.write_fieldmap(filename, raw_data, header=header)
+
+
+if __name__ == '__main__':
+    for job_filename in _sys.argv[1:]:
+        run_fieldmap_job(job_filename)
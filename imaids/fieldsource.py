@@ -1,12 +1,56 @@
 
 import json as _json
+import time as _time
+import weakref as _weakref
+from copy import copy as _copy
+from copy import deepcopy as _deepcopy
 from concurrent.futures import ProcessPoolExecutor as _ProcessPoolExecutor
 import numpy as _np
-from scipy import integrate as _integrate
-from scipy import interpolate as _interpolate
 import radia as _rad
 
 from . import utils as _utils
+from . import lifecycle as _lifecycle
+from . import profiling as _profiling
+
+_integrate = _utils.lazy_import('scipy.integrate')
+_interpolate = _utils.lazy_import('scipy.interpolate')
+
+# Deep copy memo key of the {original: duplicated} Radia references map.
+_RADIA_REF_MAP = 'radia_ref_map'
+
+
+def write_fieldmap(filename, rows, header=None):
+    """Write fieldmap text file (format of FieldSource.save_fieldmap).
+
+    Args:
+        filename (str): Path to file.
+        rows (iterable): Rows of x, y, z positions (in mm) and bx, by, bz
+            field components (in T). Rows are written as they are
+            iterated, so a generator may be used.
+        header (list, optional): List of header lines. Defaults to None.
+
+    Returns:
+        bool: True.
+    """
+    if header is None:
+        header = []
+
+    with open(filename, 'w') as fieldmap:
+        for line in header:
+            fieldmap.write(line)
+
+        fieldmap.write('X[mm]\tY[mm]\tZ[mm]\tBx[T]\tBy[T]\tBz[T]\n')
+        fieldmap.write(
+            '----------------------------------------' +
+            '----------------------------------------' +
+            '----------------------------------------' +
+            '----------------------------------------\n')
+
+        line_fmt = '{0:g}\t{1:g}\t{2:g}\t{3:g}\t{4:g}\t{5:g}\n'
+        for row in rows:
+            fieldmap.write(line_fmt.format(*row))
+
+    return True
 
 
 class FieldSource():
@@ -89,6 +133,7 @@ class FieldSource():
         """
         return _utils.delete_all()
 
+    @_profiling.timed
     def calc_field_integrals(self, z_list, x=0, y=0, field_list=None,
                                 nproc=None, chunksize=100):
         """Calculate field integrals.
@@ -178,8 +223,11 @@ class FieldSource():
 
         return _utils.fit_multipole_coef(x, ibx, x, iby)
 
+    @_profiling.timed
     def calc_trajectory(
-            self, energy, r0, zmax, rkstep, dz=0, on_axis_field=False):
+            self, energy, r0, zmax, rkstep, dz=0, on_axis_field=False,
+            adaptive=False, rtol=1e-8, atol=1e-10, max_step=None,
+            field_limits=None):
         """Calculate electron trajectory.
 
         Args:
@@ -189,15 +237,41 @@ class FieldSource():
                 dimensionless.
             zmax (float): Final position to calculate trajectory (in mm).
             rkstep (float): Step to solve the equation of motion (in mm).
+                If adaptive is True, spacing of the uniform z sampling of
+                the returned trajectory (in mm).
             dz (int or float, optional): Distance to add in z initial
                 position. Defaults to 0.
             on_axis_field (bool, optional): If True, get field on axis,
                 (B(x,y,z) = B(0,0,z)). Defaults to False.
+            adaptive (bool, optional): If True, the trajectory is calculated
+                by calc_trajectory_adaptive. Otherwise, fixed step RK4 is
+                used. Defaults to False.
+            rtol (float, optional): Relative tolerance of the adaptive
+                integration. Defaults to 1e-8.
+            atol (float, optional): Absolute tolerance of the adaptive
+                integration (in m or rad). Defaults to 1e-10.
+            max_step (float, optional): Maximum step of the adaptive
+                integration (in mm). Defaults to None.
+            field_limits (list or str, optional): [zmin, zmax] limits of the
+                region with non negligible field (in mm). Outside it the
+                trajectory is propagated analytically as a drift, without
+                field evaluations. If 'auto', limits are obtained from
+                get_field_limits at the initial transverse position.
+                If None, field is evaluated along the whole trajectory.
+                Defaults to None.
 
         Returns:
             numpy.ndarray: Electron trajectory [x,y,z,x',y',z'],
                 x,y,z in mm and x',y',z' in rad/dimensionless.
         """
+        if adaptive:
+            return self.calc_trajectory_adaptive(
+                energy, r0, zmax, rkstep, dz=dz, on_axis_field=on_axis_field,
+                rtol=rtol, atol=atol, max_step=max_step,
+                field_limits=field_limits)
+
+        zlim = self._get_trajectory_field_limits(r0, field_limits)
+
         r1 = _np.zeros(6, dtype=float)
         r2 = _np.zeros(6, dtype=float)
         r3 = _np.zeros(6, dtype=float)
@@ -219,8 +293,21 @@ class FieldSource():
 
         z0 = r[2]
         lz = _np.abs(zmax/1000 - z0)
+        ndrift = 0
 
         while _np.abs(r[2]- z0) < lz:
+            if zlim is not None:
+                znext = r[2] + step*r[5]
+                if (max(r[2], znext) < zlim[0]) or (
+                        min(r[2], znext) > zlim[1]):
+                    # Field free region: straight line propagation.
+                    r[:3] += step*r[3:]
+                    ndrift += 1
+                    trajectory.append([
+                        r[0]*1000, r[1]*1000, r[2]*1000, r[3], r[4], r[5]
+                    ])
+                    continue
+
             pos = [p*1000 for p in r[:3]]
             if on_axis_field:
                 pos[0], pos[1] = 0, 0
@@ -255,9 +342,314 @@ class FieldSource():
             ])
 
         trajectory = _np.array(trajectory)
+        _profiling.count('trajectory_steps', len(trajectory) - 1)
+        _profiling.count(
+            'field_evaluations', 4*(len(trajectory) - 1 - ndrift))
 
         return trajectory
 
+    def get_field_limits(self, x=0, y=0, field_tol=1e-5):
+        """Longitudinal limits of the region with non negligible field.
+
+        Args:
+            x (float, optional): x position (in mm). Defaults to 0.
+            y (float, optional): y position (in mm). Defaults to 0.
+            field_tol (float, optional): Field magnitude below which the
+                field is considered negligible (in T). Defaults to 1e-5.
+
+        Returns:
+            list: [zmin, zmax] limits (in mm), or None if the limits
+                are unknown.
+        """
+        return None
+
+    def _get_trajectory_field_limits(self, r0, field_limits):
+        """Field limits in m for trajectory calculation, or None."""
+        if field_limits is None:
+            return None
+        if isinstance(field_limits, str):
+            if field_limits != 'auto':
+                raise ValueError("field_limits must be a list or 'auto'.")
+            field_limits = self.get_field_limits(x=r0[0], y=r0[1])
+            if field_limits is None:
+                return None
+        return [field_limits[0]/1000, field_limits[1]/1000]
+
+    @_profiling.timed
+    def calc_trajectory_adaptive(
+            self, energy, r0, zmax, zstep, dz=0, on_axis_field=False,
+            rtol=1e-8, atol=1e-10, max_step=None, z_list=None,
+            field_limits=None, full_output=False):
+        """Calculate electron trajectory with adaptive step integration.
+
+        The equation of motion is solved with the Dormand-Prince 5(4)
+        embedded method, whose step size is controlled by the tolerances,
+        so that large steps are taken in field free regions. Trajectory is
+        sampled by dense output at uniformly spaced z positions, so the
+        result can be used as the output of calc_trajectory (e.g. in
+        calc_phase_error and calc_trajectory_avg_over_period).
+
+        Args:
+            energy (float): Electron energy at the beam (in KeV).
+            r0 (list): Initial position to calculate trajectory
+                [x,y,z,x',y',z'] x,y,z in mm and x',y',z' in rad or
+                dimensionless.
+            zmax (float): Final position to calculate trajectory (in mm).
+            zstep (float): Spacing of the z positions at which the
+                trajectory is sampled (in mm). Also used as initial step.
+            dz (int or float, optional): Distance to add in z initial
+                position. Defaults to 0.
+            on_axis_field (bool, optional): If True, get field on axis,
+                (B(x,y,z) = B(0,0,z)). Defaults to False.
+            rtol (float, optional): Relative tolerance. Defaults to 1e-8.
+            atol (float, optional): Absolute tolerance (in m for positions
+                and rad for angles). Defaults to 1e-10.
+            max_step (float, optional): Maximum integration step (in mm).
+                If None, step size is only limited by the tolerances.
+                Defaults to None.
+            z_list (list, optional): Monotonic z positions at which the
+                trajectory is sampled (in mm), between the initial position
+                and zmax. If None, positions from the initial z to zmax
+                spaced by zstep are used. Defaults to None.
+            field_limits (list or str, optional): [zmin, zmax] limits of the
+                region with non negligible field (in mm), see calc_trajectory.
+                Outside it, field is taken as zero without evaluation.
+                Defaults to None.
+            full_output (bool, optional): If True, integration statistics
+                are also returned. Defaults to False.
+
+        Raises:
+            ValueError: If longitudinal direction of r0 does not point
+                towards zmax.
+            ValueError: If step size becomes too small.
+
+        Returns:
+            numpy.ndarray: Electron trajectory [x,y,z,x',y',z'],
+                x,y,z in mm and x',y',z' in rad/dimensionless.
+            dict: Only returned if full_output is True. Number of field
+                evaluations ('nfev'), accepted steps ('nsteps') and
+                rejected steps ('nrejected').
+        """
+        beta, _, brho = _utils.calc_beam_parameters(energy)
+        a = 1/brho/beta
+
+        # from mm to m
+        r = _np.array(r0, dtype=float)
+        r[0] = r[0]/1000
+        r[1] = r[1]/1000
+        r[2] = (r[2] + dz)/1000
+
+        direction = 1 if zmax >= r[2]*1000 else -1
+        if r[5]*direction <= 0:
+            raise ValueError(
+                'Longitudinal direction must point towards zmax.')
+
+        if z_list is None:
+            npts = int(_np.ceil(_np.round(
+                _np.abs(zmax - r[2]*1000)/zstep, decimals=8)))
+            z_targets = r[2] + direction*(zstep/1000)*_np.arange(npts + 1)
+        else:
+            z_targets = _np.array(z_list, dtype=float)/1000
+
+        zlim = self._get_trajectory_field_limits(r0, field_limits)
+        nfev = 0
+
+        def derivative(y):
+            nonlocal nfev
+            if zlim is not None and not zlim[0] <= y[2] <= zlim[1]:
+                return _utils.newton_lorentz_equation(a, y, [0, 0, 0])
+            nfev += 1
+            pos = [p*1000 for p in y[:3]]
+            if on_axis_field:
+                pos[0], pos[1] = 0, 0
+            b = self.get_field_at_point(pos)
+            return _utils.newton_lorentz_equation(a, y, b)
+
+        h = zstep/1000
+        h_max = _np.inf if max_step is None else max_step/1000
+        h_min = 1e-12*max(1, _np.abs(z_targets[-1] - r[2]))
+        nsteps = 0
+        nrejected = 0
+
+        trajectory = []
+        idx = 0
+        while idx < len(z_targets) and (
+                direction*(z_targets[idx] - r[2]) <= 0):
+            trajectory.append(r.copy())
+            idx += 1
+
+        f = derivative(r)
+        while idx < len(z_targets):
+            h = min(h, h_max)
+            r_new, f_new, error, k = _utils.dormand_prince_step(
+                derivative, r, f, h)
+
+            scale = atol + rtol*_np.maximum(_np.abs(r), _np.abs(r_new))
+            error_norm = _np.sqrt(_np.mean((error/scale)**2))
+            if error_norm > 1:
+                nrejected += 1
+                h = h*max(0.2, 0.9*error_norm**(-1/5))
+                if h < h_min:
+                    raise ValueError('Step size too small.')
+                continue
+
+            # Sample dense output at targets within the step,
+            # solving z(theta) = target with Newton iterations.
+            q = _np.dot(k[:, 2], _utils.DOPRI_P)
+            while idx < len(z_targets) and (
+                    direction*(z_targets[idx] - r_new[2]) <= 0):
+                target = z_targets[idx]
+                theta = (target - r[2])/(r_new[2] - r[2])
+                for _ in range(5):
+                    powers = theta**_np.arange(1, 5)
+                    dpowers = _np.arange(1, 5)*theta**_np.arange(0, 4)
+                    zval = r[2] + h*_np.dot(q, powers)
+                    dzval = h*_np.dot(q, dpowers)
+                    theta = min(max(theta - (zval - target)/dzval, 0), 1)
+                trajectory.append(_utils.dormand_prince_dense(r, h, k, theta))
+                idx += 1
+
+            r = r_new
+            f = f_new
+            nsteps += 1
+            factor = 10 if error_norm == 0 else min(
+                10, max(0.2, 0.9*error_norm**(-1/5)))
+            h = h*factor
+
+        trajectory = _np.array(trajectory)
+        trajectory[:, :3] = trajectory[:, :3]*1000
+
+        _profiling.count('trajectory_steps', nsteps)
+        _profiling.count('field_evaluations', nfev)
+
+        if full_output:
+            info = {'nfev': nfev, 'nsteps': nsteps, 'nrejected': nrejected}
+            return trajectory, info
+        return trajectory
+
+    @_profiling.timed
+    def track_particles(
+            self, energy, r0, zmax, rkstep, dz=0, on_axis_field=False,
+            field_limits=None, return_trajectories=False):
+        """Track several electrons together through the field source.
+
+        All particles are advanced with the same fixed step RK4 scheme of
+        calc_trajectory, and the field of all particles is evaluated in a
+        single get_field_at_points call at each stage. Each particle stops
+        when it reaches zmax, so the results are the same as those of
+        separate calc_trajectory calls.
+
+        Args:
+            energy (float): Electron energy at the beam (in GeV).
+            r0 (numpy.ndarray): Initial conditions array of shape (M, 6),
+                each row as [x,y,z,x',y',z'], x,y,z in mm and x',y',z' in
+                rad or dimensionless (see utils.sample_beam_distribution).
+            zmax (float): Final position to calculate trajectory (in mm).
+            rkstep (float): Step to solve the equation of motion (in mm).
+            dz (int or float, optional): Distance to add in z initial
+                positions. Defaults to 0.
+            on_axis_field (bool, optional): If True, get field on axis,
+                (B(x,y,z) = B(0,0,z)). Defaults to False.
+            field_limits (list or str, optional): Limits of the region with
+                non negligible field, see calc_trajectory. If 'auto', limits
+                are obtained at the mean initial transverse position.
+                Defaults to None.
+            return_trajectories (bool, optional): If True, trajectories are
+                also returned. Defaults to False.
+
+        Returns:
+            numpy.ndarray: Final coordinates and kicks array of shape (M, 8),
+                each row as [x, y, z, x', y', z', kx, ky], where x,y,z are in
+                mm, x',y',z' in rad or dimensionless, and kx, ky are the
+                differences between final and initial x', y' (in rad).
+            numpy.ndarray: Only returned if return_trajectories is True.
+                Trajectories array of shape (M, N, 6), in which the
+                trajectory of each particle is padded with its final
+                coordinates after it reaches zmax.
+        """
+        r0 = _np.array(r0, dtype=float).reshape(-1, 6)
+
+        beta, _, brho = _utils.calc_beam_parameters(energy)
+        a = 1/brho/beta
+
+        # from mm to m
+        r = r0.copy()
+        r[:, 0] = r[:, 0]/1000
+        r[:, 1] = r[:, 1]/1000
+        r[:, 2] = (r[:, 2] + dz)/1000
+        step = rkstep/1000
+
+        zlim = self._get_trajectory_field_limits(
+            _np.mean(r0, axis=0), field_limits)
+
+        z0 = r[:, 2].copy()
+        lz = _np.abs(zmax/1000 - z0)
+
+        def get_field(rs):
+            pos = rs[:, :3]*1000
+            if on_axis_field:
+                pos[:, :2] = 0
+            return self.get_field_at_points(pos)
+
+        trajectories = [r.copy()]
+        nfev = 0
+        nsteps = 0
+        active = _np.abs(r[:, 2] - z0) < lz
+        while _np.any(active):
+            ra = r[active]
+            if zlim is not None:
+                znext = ra[:, 2] + step*ra[:, 5]
+                drift = (_np.maximum(ra[:, 2], znext) < zlim[0]) | (
+                    _np.minimum(ra[:, 2], znext) > zlim[1])
+            else:
+                drift = _np.zeros(len(ra), dtype=bool)
+
+            # Field free region: straight line propagation.
+            rd = ra[drift]
+            rd[:, :3] += step*rd[:, 3:]
+            ra[drift] = rd
+
+            rf = ra[~drift]
+            if len(rf) > 0:
+                b = get_field(rf)
+                drds1 = _utils.newton_lorentz_equation(a, rf, b)
+                r1 = rf + (step/2)*drds1
+
+                b1 = get_field(r1)
+                drds2 = _utils.newton_lorentz_equation(a, r1, b1)
+                r2 = rf + (step/2)*drds2
+
+                b2 = get_field(r2)
+                drds3 = _utils.newton_lorentz_equation(a, r2, b2)
+                r3 = rf + step*drds3
+
+                b3 = get_field(r3)
+                drds4 = _utils.newton_lorentz_equation(a, r3, b3)
+
+                rf += (step/6)*(drds1 + 2*drds2 + 2*drds3 + drds4)
+                ra[~drift] = rf
+                nfev += 4*len(rf)
+
+            r[active] = ra
+            nsteps += 1
+            if return_trajectories:
+                trajectories.append(r.copy())
+            active = _np.abs(r[:, 2] - z0) < lz
+
+        _profiling.count('trajectory_steps', nsteps)
+        _profiling.count('field_evaluations', nfev)
+
+        r[:, :3] = r[:, :3]*1000
+        kicks = r[:, 3:5] - r0[:, 3:5]
+        result = _np.hstack([r, kicks])
+
+        if return_trajectories:
+            trajectories = _np.transpose(trajectories, axes=(1, 0, 2))
+            trajectories[:, :, :3] = trajectories[:, :, :3]*1000
+            return result, trajectories
+        return result
+
+    @_profiling.timed
     def get_field(self, x=0, y=0, z=0, nproc=None, chunksize=100):
         """Get field data.
 
@@ -301,6 +693,7 @@ class FieldSource():
             for pos_x in x:
                 for pos_y in y:
                     pos_list.append([pos_x, pos_y, pos_z])
+        _profiling.count('field_points', len(pos_list))
 
         if nproc is not None:
             nproc = int(nproc)
@@ -318,6 +711,21 @@ class FieldSource():
     def get_field_at_point(self, point):
         raise NotImplementedError
 
+    @_profiling.timed
+    def get_field_at_points(self, points):
+        """Get field data at a list of points.
+
+        Args:
+            points (list): List of [x, y, z] positions to get field (in mm).
+
+        Returns:
+            numpy.ndarray: Field data array of shape (npts, 3) with
+                [bx, by, bz] at each point (in T).
+        """
+        field = [self.get_field_at_point(point) for point in points]
+        return _np.array(field, dtype=float).reshape(-1, 3)
+
+    @_profiling.timed
     def save_fieldmap(self, filename, x_list, y_list, z_list, header=None,
                         nproc=None, chunksize=100):
         """Save fieldmap file.
@@ -349,9 +757,6 @@ class FieldSource():
         Returns:
             bool: True.
         """
-        if header is None:
-            header = []
-
         if int(_np.ndim(x_list)) == 0:
             x_list = [x_list]
 
@@ -365,49 +770,38 @@ class FieldSource():
         y_list = _np.round(y_list, decimals=8)
         z_list = _np.round(z_list, decimals=8)
 
-        with open(filename, 'w') as fieldmap:
-            for line in header:
-                fieldmap.write(line)
-
-            fieldmap.write('X[mm]\tY[mm]\tZ[mm]\tBx[T]\tBy[T]\tBz[T]\n')
-            fieldmap.write(
-                '----------------------------------------' +
-                '----------------------------------------' +
-                '----------------------------------------' +
-                '----------------------------------------\n')
-
-            line_fmt = '{0:g}\t{1:g}\t{2:g}\t{3:g}\t{4:g}\t{5:g}\n'
-
-            pos_list = []
-            for z in z_list:
-                for y in y_list:
-                    for x in x_list:
-                        pos_list.append([x,y,z])
+        pos_list = []
+        for z in z_list:
+            for y in y_list:
+                for x in x_list:
+                    pos_list.append([x,y,z])
 
-            if nproc is not None:
+        if nproc is not None:
 
-                nproc = int(nproc)
-                if nproc < 1:
-                    raise ValueError('Number or processes must be >=1.')
+            nproc = int(nproc)
+            if nproc < 1:
+                raise ValueError('Number or processes must be >=1.')
 
-                with _ProcessPoolExecutor(max_workers=nproc) as executor:
-                    field_gen = executor.map(self.get_field_at_point, pos_list,
-                                            chunksize=chunksize)
-                    for field, pos in zip(field_gen, pos_list):
-                        x, y, z = pos
-                        bx, by, bz = field
-                        line = line_fmt.format(x, y, z, bx, by, bz)
-                        fieldmap.write(line)
+            with _ProcessPoolExecutor(max_workers=nproc) as executor:
+                field_gen = executor.map(self.get_field_at_point, pos_list,
+                                        chunksize=chunksize)
+                write_fieldmap(
+                    filename,
+                    (list(pos) + list(field)
+                     for pos, field in zip(pos_list, field_gen)),
+                    header=header)
 
-            else:
-                    for pos in pos_list:
-                        x, y, z = pos
-                        bx, by, bz = self.get_field_at_point(pos)
-                        line = line_fmt.format(x, y, z, bx, by, bz)
-                        fieldmap.write(line)
+        else:
+            field_gen = map(self.get_field_at_point, pos_list)
+            write_fieldmap(
+                filename,
+                (list(pos) + list(field)
+                 for pos, field in zip(pos_list, field_gen)),
+                header=header)
 
         return True
 
+    @_profiling.timed
     def save_fieldmap_spectra(self, filename, x_list, y_list, z_list,
                                 nproc=None, chunksize=100):
         """Save fieldmap file to use in spectra.
@@ -511,8 +905,10 @@ class FieldSource():
 
         return True
 
+    @_profiling.timed
     def save_kickmap(
-            self, filename, energy, x_list, y_list, zmin, zmax, rkstep):
+            self, filename, energy, x_list, y_list, zmin, zmax, rkstep,
+            field_limits=None):
         """Save kickmap file.
 
         Args:
@@ -523,6 +919,9 @@ class FieldSource():
             zmin (float): z minimum position to save in file (in mm).
             zmax (float): z maximum position to save in file (in mm).
             rkstep (float): Step to solve the equation of motion (in mm).
+            field_limits (list or str, optional): Limits of the region with
+                non negligible field, passed to calc_trajectory.
+                Defaults to None.
 
         Returns:
             numpy.ndarray: Total Horizontal 2nd Order Kick (in T2m2).
@@ -563,7 +962,8 @@ class FieldSource():
             for i in range(nx):
                 xi = x_list[i]
                 traj = self.calc_trajectory(
-                    energy, [xi, yi, zmin, 0, 0, 1], zmax, rkstep)
+                    energy, [xi, yi, zmin, 0, 0, 1], zmax, rkstep,
+                    field_limits=field_limits)
                 xf = traj[-1, 0]
                 yf = traj[-1, 1]
                 xl = traj[-1, 3]
@@ -980,29 +1380,40 @@ class SinusoidalFieldSource(FieldSource):
         kv = _utils.calc_deflection_parameter(b_amp=bx_amp, period_length=period)
         return kh, kv
 
-    def calc_trajectory_avg_over_period(self, trajectory):
+    def calc_trajectory_avg_over_period(self, trajectory, angles=False):
         """Calculate the average electron trajectory over period.
 
+        The moving average is calculated from cumulative sums (see
+        utils.calc_moving_average). Trajectories with non uniform z steps
+        are averaged over one period length with the trapezoidal rule.
+        The first and last period of the trajectory are discarded.
+
         Args:
             trajectory (list): Electron trajectory [x,y,z,x',y',z'],
                 x,y,z in mm and x',y',z' in rad/dimensionless.
+            angles (bool, optional): If True, averaged x' and y' are also
+                returned. Defaults to False.
 
         Returns:
-            numpy.ndarray: Average electron trajectory over period.
+            numpy.ndarray: Average electron trajectory over period, as
+                [x,y,z] (or [x,y,z,x',y'] if angles is True) nested list.
         """
-        trajz = [t for t in trajectory[:, 2]]
-        step = _np.abs(trajz[1] - trajz[0])
-        navg = int(self.period_length/step)
+        trajectory = _np.asarray(trajectory)
+        trajz = trajectory[:, 2]
+        columns = [0, 1, 3, 4] if angles else [0, 1]
+        avg = _utils.calc_moving_average(
+            trajz, trajectory[:, columns], self.period_length)
 
-        avgtrajx = _np.convolve(
-            trajectory[:, 0], _np.ones(navg)/navg, mode='same')
-        avgtrajy = _np.convolve(
-            trajectory[:, 1], _np.ones(navg)/navg, mode='same')
+        step = _np.abs(trajz[1] - trajz[0])
+        steps = _np.diff(trajz)
+        if _np.all(_np.abs(steps - step) <= 1e-6*step):
+            navg = int(self.period_length/step)
+            sel = slice(navg, len(trajz) - navg)
+        else:
+            sel = (trajz >= trajz[0] + self.period_length) & (
+                trajz <= trajz[-1] - self.period_length)
 
-        trajz = trajz[navg:-navg]
-        avgtrajx = avgtrajx[navg:-navg]
-        avgtrajy = avgtrajy[navg:-navg]
-        avgtraj = _np.transpose([avgtrajx, avgtrajy, trajz])
+        avgtraj = _np.column_stack([avg[sel, :2], trajz[sel], avg[sel, 2:]])
 
         return avgtraj
 
@@ -1325,6 +1736,7 @@ class SinusoidalFieldSource(FieldSource):
             1 + (kh**2 + kv**2)/2)
         return wl
 
+    @_profiling.timed
     def calc_phase_error(
             self, energy, trajectory, bx_amp, by_amp,
             skip_poles=0, zmin=None, zmax=None, field_comp=None):
@@ -1385,6 +1797,152 @@ class SinusoidalFieldSource(FieldSource):
 
         return z_list, phase_error, phase_error_rms
 
+    @_profiling.timed
+    def calc_phase_error_batch(
+            self, energy, trajectories, bx_amp, by_amp,
+            skip_poles=0, zmin=None, zmax=None, field_comp=None):
+        """Calculate phase errors of many trajectories at once.
+
+        Poles, radiation phases, linear fits and phase error rms of all
+        trajectories are calculated with array operations, with the same
+        pole selection as calc_phase_error.
+
+        Args:
+            energy (float or list, M): Electron energy at the beam (in GeV).
+            trajectories (numpy.ndarray, MxNx6 or list): Stack of M electron
+                trajectories [x,y,z,x',y',z'], x,y,z in mm and x',y',z' in
+                rad/dimensionless, or list of M trajectories, possibly with
+                different numbers of points.
+            bx_amp (float or list, M): Bx field amplitude (in T).
+            by_amp (float or list, M): By field amplitude (in T).
+            skip_poles (int, optional): Number of poles to skip in start
+                and end of trajectory. Defaults to 0.
+            zmin (float, optional): z minimum position (in mm).
+                Defaults to None.
+            zmax (float, optional): z maximum position (in mm).
+                Defaults to None.
+            field_comp (int, optional): Parameter used to force one of the
+                components (x or y) to be used to determine the poles.
+                Defaults to None.
+
+        Returns:
+            numpy.ndarray, M: Structured array with one record per
+                trajectory and fields 'nr_poles', 'phase_error_rms' (in rad),
+                'phase_offset' (in rad), 'phase_slope' (in rad/mm) and
+                'wavelength' (in mm). Fit coefficients and rms are NaN for
+                trajectories with less than two poles.
+            numpy.ndarray: Structured array with one record per pole and
+                fields 'index' (trajectory index), 'z' (in mm), 'phase' and
+                'phase_error' (in rad), sorted by trajectory index.
+        """
+        if isinstance(trajectories, _np.ndarray) and trajectories.ndim == 3:
+            traj = trajectories
+        else:
+            # Stack trajectories, padding shorter ones with NaN.
+            trajectories = [_np.asarray(t) for t in trajectories]
+            npts = max(len(t) for t in trajectories)
+            traj = _np.full((len(trajectories), npts, 6), _np.nan)
+            for i, t in enumerate(trajectories):
+                traj[i, :len(t)] = t
+        ntrajs = traj.shape[0]
+        trajz = traj[:, :, 2]
+
+        energy = _np.broadcast_to(_np.asarray(energy, dtype=float), ntrajs)
+        bx_amp = _np.broadcast_to(_np.asarray(bx_amp, dtype=float), ntrajs)
+        by_amp = _np.broadcast_to(_np.asarray(by_amp, dtype=float), ntrajs)
+
+        if field_comp is None:
+            z_from_by = by_amp >= bx_amp
+        else:
+            z_from_by = _np.full(ntrajs, field_comp == 1)
+
+        # Poles: zeros of the transversal velocity (see find_zeros).
+        vel = _np.where(z_from_by[:, None], traj[:, :, 3], traj[:, :, 4])
+        sign = _np.sign(vel)
+        pole_row, idxb = (sign[:, :-1] + sign[:, 1:] == 0).nonzero()
+        idxa = idxb + 1
+        zb, za = trajz[pole_row, idxb], trajz[pole_row, idxa]
+        vb, va = vel[pole_row, idxb], vel[pole_row, idxa]
+        z_poles = (va*zb - vb*za)/(va - vb)
+
+        sel = _np.ones(len(z_poles), dtype=bool)
+        if zmin is not None:
+            sel &= z_poles >= zmin
+        if zmax is not None:
+            sel &= z_poles <= zmax
+
+        if skip_poles != 0:
+            counts = _np.bincount(pole_row[sel], minlength=ntrajs)
+            rank = _np.cumsum(sel) - 1 - (_np.cumsum(counts) - counts)[
+                pole_row]
+            limits = _np.array([
+                slice(skip_poles, -(skip_poles-1)).indices(count)[:2]
+                for count in counts]).reshape(-1, 2)
+            sel &= (rank >= limits[pole_row, 0]) & (
+                rank < limits[pole_row, 1])
+
+        pole_row, idxb, idxa = pole_row[sel], idxb[sel], idxa[sel]
+        zb, za, z_poles = zb[sel], za[sel], z_poles[sel]
+
+        # Radiation phase (see calc_radiation_phase), linearly interpolated
+        # at poles. Path length difference is accumulated step by step to
+        # avoid loss of precision.
+        beta, gamma, _ = _utils.calc_beam_parameters(energy)
+        kh, kv = self.calc_deflection_parameter(bx_amp, by_amp)
+        wavelength = (self.period_length/(2*(gamma**2)))*(
+            1 + (kh**2 + kv**2)/2)
+
+        dx = _np.diff(traj[:, :, 0], axis=1)
+        dy = _np.diff(traj[:, :, 1], axis=1)
+        dz = _np.diff(trajz, axis=1)
+        dpath = _np.sqrt(dx*dx + dy*dy + dz*dz)/beta[:, None] - dz
+        path = _np.zeros(trajz.shape)
+        _np.cumsum(_np.nan_to_num(dpath), axis=1, out=path[:, 1:])
+
+        frac = (z_poles - zb)/(za - zb)
+        path_poles = path[pole_row, idxb] + frac*(
+            path[pole_row, idxa] - path[pole_row, idxb])
+        phase_poles = (2*_np.pi/wavelength[pole_row])*path_poles
+
+        # Linear fits of all trajectories, relative to mean pole positions.
+        nr_poles = _np.bincount(pole_row, minlength=ntrajs)
+        with _np.errstate(invalid='ignore', divide='ignore'):
+            zmean = _np.bincount(
+                pole_row, weights=z_poles, minlength=ntrajs)/nr_poles
+            pmean = _np.bincount(
+                pole_row, weights=phase_poles, minlength=ntrajs)/nr_poles
+            zc = z_poles - zmean[pole_row]
+            szz = _np.bincount(pole_row, weights=zc*zc, minlength=ntrajs)
+            szp = _np.bincount(
+                pole_row, weights=zc*phase_poles, minlength=ntrajs)
+            slope = _np.where(nr_poles > 1, szp/szz, _np.nan)
+            offset = pmean - slope*zmean
+            phase_error = phase_poles - (
+                offset[pole_row] + slope[pole_row]*z_poles)
+            rms = _np.sqrt(_np.bincount(
+                pole_row, weights=phase_error**2,
+                minlength=ntrajs)/nr_poles)
+
+        results = _np.zeros(ntrajs, dtype=[
+            ('nr_poles', int), ('phase_error_rms', float),
+            ('phase_offset', float), ('phase_slope', float),
+            ('wavelength', float)])
+        results['nr_poles'] = nr_poles
+        results['phase_error_rms'] = rms
+        results['phase_offset'] = offset
+        results['phase_slope'] = slope
+        results['wavelength'] = wavelength
+
+        poles = _np.zeros(len(z_poles), dtype=[
+            ('index', int), ('z', float), ('phase', float),
+            ('phase_error', float)])
+        poles['index'] = pole_row
+        poles['z'] = z_poles
+        poles['phase'] = phase_poles
+        poles['phase_error'] = phase_error
+
+        return results, poles
+
     def get_filename(
             self, date, x_list, y_list, z_list, kh, kv,
             polarization_name=None, add_label=None,
@@ -1451,6 +2009,13 @@ class SinusoidalFieldSource(FieldSource):
 
 class FieldModel(FieldSource):
 
+    # Interaction matrix memory used by each pair of elementary objects
+    # (3x3 single precision matrix, in bytes).
+    INTERACTION_BYTES_PER_PAIR = 36
+
+    _interaction = None
+    _solve_stats = None
+
     def __init__(self, radia_object=None):
         """Field model class.
 
@@ -1460,11 +2025,77 @@ class FieldModel(FieldSource):
         """
         self._radia_object = radia_object
 
+    def __getstate__(self):
+        """State used for pickling (e.g. models sent to other processes),
+        without the interaction matrix, which is owned by this object."""
+        state = self.__dict__.copy()
+        state.pop('_interaction', None)
+        return state
+
+    def __deepcopy__(self, memo):
+        """Deep copy owning a duplicate of the Radia objects.
+
+        The Radia object tree is duplicated (radia ObjDpl) and registered
+        as owned by the copy. Nested models (e.g. blocks of a cassette)
+        are copied with the corresponding objects of the duplicated tree.
+        The interaction matrix is not copied.
+        """
+        ref_map = memo.setdefault(_RADIA_REF_MAP, {})
+        ref = self._radia_object
+        if ref is not None and ref not in ref_map:
+            _lifecycle.tracker.duplicate(ref, ref_map)
+
+        copy = self.__class__.__new__(self.__class__)
+        memo[id(self)] = copy
+        for key, value in self.__getstate__().items():
+            copy.__dict__[key] = _deepcopy(value, memo)
+        copy._map_radia_objects(ref_map)
+        copy._register_radia_object()
+        return copy
+
+    def _map_radia_objects(self, ref_map):
+        """Replace Radia object references of a copy by the duplicated
+        ones (see __deepcopy__)."""
+        if self._radia_object is not None:
+            self._radia_object = ref_map[self._radia_object]
+
+    def __enter__(self):
+        """Enter context, Radia objects are deleted on exit."""
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        """Exit context, deleting the owned Radia objects."""
+        self.delete_radia_object()
+        return False
+
     @property
     def radia_object(self):
         """Number of the radia object."""
         return self._radia_object
 
+    def _register_radia_object(self):
+        """Register radia object as owned by this model.
+
+        The owned objects are deleted when the model is garbage collected
+        or when delete_radia_object is called (see lifecycle module).
+        """
+        if self._radia_object is not None:
+            _lifecycle.tracker.register(self, self._radia_object)
+
+    def delete_radia_object(self):
+        """Delete the radia objects owned by this model.
+
+        Objects owned by other live models (e.g. blocks of a cassette)
+        are not deleted.
+
+        Returns:
+            int: Number of deleted radia objects.
+        """
+        self.delete_interaction()
+        count = _lifecycle.tracker.release(self)
+        self._radia_object = None
+        return count
+
     @property
     def center_point(self):
         """Vector coordinates ([x,y,z]) of radia object geometrical center."""
@@ -1502,6 +2133,49 @@ class FieldModel(FieldSource):
         _rad.ObjDrwOpenGL(self._radia_object)
         return True
 
+    def get_field_limits(self, x=0, y=0, field_tol=1e-5, max_iter=20):
+        """Longitudinal limits of the region with non negligible field.
+
+        The search starts at the geometrical limits of the radia object,
+        moving outwards with doubling distances until the field magnitude
+        at two consecutive points is below field_tol.
+
+        Args:
+            x (float, optional): x position (in mm). Defaults to 0.
+            y (float, optional): y position (in mm). Defaults to 0.
+            field_tol (float, optional): Field magnitude below which the
+                field is considered negligible (in T). Defaults to 1e-5.
+            max_iter (int, optional): Maximum number of distance doublings.
+                Defaults to 20.
+
+        Returns:
+            list: [zmin, zmax] limits (in mm), or None if the radia object
+                is None or if the limits were not found.
+        """
+        if self._radia_object is None:
+            return None
+
+        geo_lim = _rad.ObjGeoLim(self._radia_object)
+        distance0 = max(
+            geo_lim[1] - geo_lim[0], geo_lim[3] - geo_lim[2], 1)
+
+        limits = []
+        for z_edge, sign in [(geo_lim[4], -1), (geo_lim[5], 1)]:
+            distance = distance0
+            field_prev = _np.inf
+            for _ in range(max_iter):
+                b = self.get_field_at_point([x, y, z_edge + sign*distance])
+                field = _np.linalg.norm(b)
+                if max(field, field_prev) < field_tol:
+                    break
+                field_prev = field
+                distance *= 2
+            else:
+                return None
+            limits.append(z_edge + sign*distance/2)
+
+        return limits
+
     def get_field_at_point(self, point):
         """Get field data at point.
 
@@ -1516,6 +2190,25 @@ class FieldModel(FieldSource):
         """
         return _rad.Fld(self._radia_object, "b", point)
 
+    @_profiling.timed
+    def get_field_at_points(self, points):
+        """Get field data at a list of points.
+
+        All points are sent to Radia in a single call.
+
+        Args:
+            points (list): List of [x, y, z] positions to get field (in mm).
+
+        Returns:
+            numpy.ndarray: Field data array of shape (npts, 3) with
+                [bx, by, bz] at each point (in T).
+        """
+        points = _np.array(points, dtype=float).reshape(-1, 3).tolist()
+        if len(points) == 0:
+            return _np.zeros((0, 3))
+        field = _rad.Fld(self._radia_object, "b", points)
+        return _np.array(field, dtype=float).reshape(-1, 3)
+
     def save_state(self, filename):
         """Save state to file.
 
@@ -1529,9 +2222,130 @@ class FieldModel(FieldSource):
             _json.dump(self.state, f)
         return True
 
+    @property
+    def interaction(self):
+        """Radia interaction matrix reference reused by solve, None if
+        there is no interaction (see create_interaction)."""
+        if self._interaction is None:
+            return None
+        return self._interaction['key']
+
+    @_profiling.timed
+    def create_interaction(self, max_displacement=0.0):
+        """Create interaction matrix (radia RlxPre) reused by subsequent
+        calls of solve and solve_with_stats, skipping its construction.
+
+        The interaction is kept while the geometry does not change, and
+        changes of magnetization or material of the same objects do not
+        invalidate it. Before each solve the limits of the elementary objects
+        are compared to the ones at construction, and the matrix is rebuilt
+        if the radia object was replaced, if the number of elementary objects
+        changed or if any element was displaced by more than max_displacement
+        relative to the others. Translations of the whole model keep the
+        matrix exact, and rotate or mirror delete it.
+
+        Displacements up to max_displacement keep the matrix of the geometry
+        at construction. Solves relax from zero magnetization (as radia
+        Solve) over that matrix, so the displacements are ignored by the
+        relaxation and the resulting magnetization is the one of the
+        geometry at construction. Hence max_displacement must be 0 for
+        solves whose results depend on the displacements (e.g. shim response
+        matrix and signature calculations).
+
+        The matrix is deleted with delete_interaction, delete_radia_object
+        or when the model is garbage collected.
+
+        Args:
+            max_displacement (float, optional): Maximum relative displacement
+                of elementary objects accepted without rebuilding the
+                matrix (in mm). Defaults to 0.0.
+
+        Raises:
+            ValueError: If radia object is None.
+
+        Returns:
+            int: Radia interaction matrix reference.
+        """
+        if self._radia_object is None:
+            raise ValueError('Radia object is None.')
+        self.delete_interaction()
+
+        limits = _utils.get_element_limits(self._radia_object)
+        key = _rad.RlxPre(self._radia_object)
+        _profiling.count('interaction_builds')
+        finalizer = _weakref.finalize(self, _rad.UtiDel, key)
+        finalizer.atexit = False
+        self._interaction = {
+            'key': key,
+            'finalizer': finalizer,
+            'ref': self._radia_object,
+            'limits': limits,
+            'max_displacement': max_displacement,
+        }
+        return key
+
+    def delete_interaction(self):
+        """Delete interaction matrix created by create_interaction.
+
+        Subsequent calls of solve rebuild the matrix at each call.
+
+        Returns:
+            bool: True if an interaction was deleted, False otherwise.
+        """
+        if self._interaction is None:
+            return False
+        self._interaction['finalizer']()
+        self._interaction = None
+        return True
+
+    def get_interaction_displacement(self):
+        """Maximum relative displacement of elementary objects since the
+        construction of the interaction matrix.
+
+        The median displacement of the elements (common translation)
+        is discounted.
+
+        Returns:
+            float: Maximum displacement (in mm). Infinite if the radia object
+                was replaced or if the number of elements changed, None if
+                there is no interaction.
+        """
+        if self._interaction is None:
+            return None
+        if self._interaction['ref'] != self._radia_object:
+            return _np.inf
+
+        limits = _utils.get_element_limits(self._radia_object)
+        if limits.shape != self._interaction['limits'].shape:
+            return _np.inf
+        if len(limits) == 0:
+            return 0.0
+        diff = limits - self._interaction['limits']
+        diff -= _np.median(diff, axis=0)
+        return float(_np.max(_np.abs(diff)))
+
+    def get_interaction(self):
+        """Get valid interaction matrix, rebuilding it if the geometry
+        changed (see create_interaction).
+
+        Returns:
+            int: Radia interaction matrix reference, None if there is no
+                interaction.
+        """
+        if self._interaction is None:
+            return None
+        displacement = self.get_interaction_displacement()
+        if displacement > self._interaction['max_displacement']:
+            self.create_interaction(self._interaction['max_displacement'])
+        return self._interaction['key']
+
+    @_profiling.timed
     def solve(self, prec=0.00001, max_iter=1000):
         """Executes an automatic relaxation procedure.
 
+        If an interaction was created (see create_interaction), it is
+        reused. In both cases the relaxation starts from zero magnetization.
+
         Args:
             prec (float, optional): Absolute precision value
                 for magnetization, to be reached by the end of the
@@ -1551,8 +2365,157 @@ class FieldModel(FieldSource):
                 actual number of iterations done. The values (1)-(3) given,
                 are those of last iteration.
         """
+        intrc = self.get_interaction()
+        if intrc is not None:
+            return _rad.RlxAuto(intrc, prec, max_iter, 4, 'ZeroM->True')
         return _rad.Solve(self._radia_object, prec, max_iter)
 
+    @_profiling.timed
+    def solve_with_stats(
+            self, prec=0.00001, max_iter=1000, step=10, method=4,
+            callback=None, log_filename=None,
+            stagnation_iter=None, stagnation_tol=0.01):
+        """Executes an automatic relaxation procedure recording convergence
+        statistics.
+
+        The relaxation is performed in steps of at most step iterations
+        (radia RlxAuto), over a single interaction matrix (radia RlxPre).
+        As in solve, the first step starts from zero magnetization, and
+        each following step continues from the magnetization of the
+        previous one, so the result matches a single relaxation with the
+        same number of iterations.
+        If an interaction was created (see create_interaction), it is reused.
+        After each step, convergence metrics are recorded and streamed to
+        the callback function and to the log file.
+
+        Args:
+            prec (float, optional): Absolute precision value
+                for magnetization, to be reached by the end of the
+                relaxation (in T). Defaults to 0.00001.
+            max_iter (int, optional): Maximum number of iterations
+                permitted to reach the specified precision.
+                Defaults to 1000.
+            step (int, optional): Maximum number of iterations between
+                records. Defaults to 10.
+            method (int, optional): Radia relaxation method number.
+                Defaults to 4.
+            callback (callable, optional): Function called with the record
+                dictionary (see Returns) after each step. If it returns
+                False, the relaxation is stopped. Defaults to None.
+            log_filename (str, optional): If provided, records are appended
+                to this file in JSON lines format as they are produced.
+                Defaults to None.
+            stagnation_iter (int, optional): If provided, the relaxation
+                is stopped when the average magnetization change did not
+                decrease by a relative amount of stagnation_tol within the
+                last stagnation_iter iterations. Defaults to None.
+            stagnation_tol (float, optional): Relative decrease of average
+                magnetization change considered as progress.
+                Defaults to 0.01.
+
+        Raises:
+            ValueError: If step or max_iter are not positive.
+
+        Returns:
+            dict: Dictionary with keys:
+                'result': list as returned by solve.
+                'status': 'converged', 'max_iter', 'stagnated' or 'stopped'
+                    (by callback).
+                'iterations': number of iterations done.
+                'nr_elements': number of elementary objects.
+                'memory': interaction matrix memory estimate (in bytes).
+                'build_time', 'relax_time', 'total_time': wall times of the
+                    interaction matrix construction, of the relaxation and
+                    total (in s).
+                'history': list of records, dictionaries with keys
+                    'iteration', 'dm_avg' (average magnetization change),
+                    'm_max' (maximum magnetization), 'h_max' (maximum field
+                    strength) and 'time' (elapsed time, in s).
+                The dictionary is also stored in the solve_stats attribute.
+        """
+        if step < 1 or max_iter < 1:
+            raise ValueError('step and max_iter must be positive.')
+
+        t0 = _time.perf_counter()
+        nr_elements = _utils.count_elements(self._radia_object)
+        memory = nr_elements**2*self.INTERACTION_BYTES_PER_PAIR
+
+        log_file = open(log_filename, 'a') if log_filename else None
+        intrc = self.get_interaction()
+        temporary = intrc is None
+        if temporary:
+            intrc = _rad.RlxPre(self._radia_object)
+        t1 = _time.perf_counter()
+        stats = {
+            'result': None,
+            'status': 'max_iter',
+            'iterations': 0,
+            'nr_elements': nr_elements,
+            'memory': memory,
+            'build_time': t1 - t0,
+            'relax_time': 0.0,
+            'total_time': 0.0,
+            'history': [],
+        }
+
+        best_dm = None
+        best_iter = 0
+        zero_m = 'ZeroM->True'
+        try:
+            while stats['iterations'] < max_iter:
+                niter = min(step, max_iter - stats['iterations'])
+                result = _rad.RlxAuto(intrc, prec, niter, method, zero_m)
+                zero_m = 'ZeroM->False'
+                stats['iterations'] += int(result[3])
+                stats['result'] = [
+                    result[0], result[1], result[2], stats['iterations']]
+
+                record = {
+                    'iteration': stats['iterations'],
+                    'dm_avg': result[0],
+                    'm_max': result[1],
+                    'h_max': result[2],
+                    'time': _time.perf_counter() - t0,
+                }
+                stats['history'].append(record)
+                if log_file is not None:
+                    log_file.write(_json.dumps(record) + '\n')
+                    log_file.flush()
+
+                stop = callback is not None and callback(record) is False
+                if result[3] < niter or result[0] <= prec:
+                    stats['status'] = 'converged'
+                    break
+                if stop:
+                    stats['status'] = 'stopped'
+                    break
+
+                if best_dm is None or result[0] < best_dm*(1 - stagnation_tol):
+                    best_dm = result[0]
+                    best_iter = stats['iterations']
+                elif stagnation_iter is not None and (
+                        stats['iterations'] - best_iter >= stagnation_iter):
+                    stats['status'] = 'stagnated'
+                    break
+        finally:
+            if temporary:
+                _rad.UtiDel(intrc)
+            if log_file is not None:
+                log_file.close()
+
+        t2 = _time.perf_counter()
+        stats['relax_time'] = t2 - t1
+        stats['total_time'] = t2 - t0
+        _profiling.count('solve_iterations', stats['iterations'])
+
+        self._solve_stats = stats
+        return stats
+
+    @property
+    def solve_stats(self):
+        """Statistics of the last solve_with_stats call (None if not run)."""
+        return self._solve_stats
+
     def shift(self, value):
         """Shift radia object.
 
@@ -1586,6 +2549,7 @@ class FieldModel(FieldSource):
                 Else, return False.
         """
         if self._radia_object is not None:
+            self.delete_interaction()
             self._radia_object = _rad.TrfOrnt(
                 self._radia_object, _rad.TrfRot(point, vector, angle))
             return True
@@ -1606,6 +2570,7 @@ class FieldModel(FieldSource):
                 Else, return False.
         """
         if self._radia_object is not None:
+            self.delete_interaction()
             self._radia_object = _rad.TrfOrnt(
                 self._radia_object, _rad.TrfPlSym(point, normal))
             return True
@@ -1630,6 +2595,7 @@ class FieldData(FieldSource):
         self._nx = None
         self._ny = None
         self._nz = None
+        self._selected_y = selected_y
         self._px = None
         self._py = None
         self._pz = None
@@ -1748,47 +2714,175 @@ class FieldData(FieldSource):
                 self._px, self._pz, self._bz)
         return True
 
-    def add_field(self, other):
-        """Add field from another radia object.
+    def _has_same_grid(self, other):
+        """Check if other field data is defined on the same x and z grid.
 
         Args:
-            other (imaids.fieldsource.FieldModel): Other radia object
-                to get the field to add to the radia object field.
+            other (FieldSource): Other field source.
+
+        Returns:
+            bool: True if other is a FieldData object with the same x and z
+                positions and y slice, False otherwise.
         """
-        px = [i for i in self._px]
-        py = [i for i in self._py]
-        pz = [i for i in self._pz]
-        raw_data = []
-        for z in pz:
-            for y in py:
-                for x in px:
-                    b = self.get_field_at_point([x, y, z])
-                    bo = other.get_field_at_point([x, y, z])
-                    bs = _np.array(b) + _np.array(bo)
-                    raw_data.append([x, y, z, bs[0], bs[1], bs[2]])
-        raw_data = _np.array(raw_data)
-        self.read_raw_data(raw_data=raw_data)
-
-    def sub_field(self, other):
-        """Subtract field from another radia object.
+        if not isinstance(other, FieldData) or other._px is None:
+            return False
+        if self._bx.shape != other._bx.shape:
+            return False
+        if self._grid_y() != other._grid_y():
+            return False
+        return (_np.allclose(self._px, other._px)
+                and _np.allclose(self._pz, other._pz))
+
+    def _grid_y(self):
+        """y position of the loaded field slice (in mm)."""
+        if self._ny == 1:
+            return float(self._py[0])
+        return float(self._selected_y)
+
+    def _get_other_field_on_grid(self, other):
+        """Get field of other field source on this object's grid.
+
+        If other is a FieldData on the same grid its field arrays are used
+        directly, otherwise its field is evaluated on all grid points in a
+        single batched call.
 
         Args:
-            other (imaids.fieldsource.FieldModel): Other radia object
-                to get the field to subtract to the radia object field.
+            other (FieldSource): Other field source.
+
+        Returns:
+            tuple: bx, by and bz arrays with shape (nx, nz) (in T).
         """
-        px = [i for i in self._px]
-        py = [i for i in self._py]
-        pz = [i for i in self._pz]
-        raw_data = []
-        for z in pz:
-            for y in py:
-                for x in px:
-                    b = self.get_field_at_point([x, y, z])
-                    bo = other.get_field_at_point([x, y, z])
-                    bs = _np.array(b) - _np.array(bo)
-                    raw_data.append([x, y, z, bs[0], bs[1], bs[2]])
-        raw_data = _np.array(raw_data)
-        self.read_raw_data(raw_data=raw_data)
+        if self._has_same_grid(other):
+            return other._bx, other._by, other._bz
+
+        xg, zg = _np.meshgrid(self._px, self._pz, indexing='ij')
+        yg = _np.full(xg.shape, self._grid_y())
+        points = _np.transpose([xg.ravel(), yg.ravel(), zg.ravel()])
+        field = other.get_field_at_points(points)
+        shape = xg.shape
+        return (field[:, 0].reshape(shape),
+                field[:, 1].reshape(shape),
+                field[:, 2].reshape(shape))
+
+    def _copy_grid(self):
+        """Shallow copy of the object with independent position arrays.
+
+        Returns:
+            FieldData: Copy of this object.
+        """
+        data = _copy(self)
+        data._px = _np.copy(self._px)
+        data._py = _np.copy(self._py)
+        data._pz = _np.copy(self._pz)
+        return data
+
+    def _set_field(self, bx, by, bz):
+        """Set field arrays, rebuild raw data and interpolation functions.
+
+        Args:
+            bx (numpy.ndarray): bx array with shape (nx, nz) (in T).
+            by (numpy.ndarray): by array with shape (nx, nz) (in T).
+            bz (numpy.ndarray): bz array with shape (nx, nz) (in T).
+
+        Returns:
+            bool: True.
+        """
+        self._bx = _np.array(bx, dtype=float)
+        self._by = _np.array(by, dtype=float)
+        self._bz = _np.array(bz, dtype=float)
+
+        # raw data is ordered with z as outer loop, then y, then x.
+        pz, py, px = _np.meshgrid(
+            self._pz, self._py, self._px, indexing='ij')
+        shape = pz.shape
+        columns = [px.ravel(), py.ravel(), pz.ravel()]
+        for b in [self._bx, self._by, self._bz]:
+            b = _np.broadcast_to(_np.transpose(b)[:, None, :], shape)
+            columns.append(b.ravel())
+        self._raw_data = _np.transpose(columns)
+
+        self._update_interpolation_functions()
+        return True
+
+    def _combine_field(self, other, factor, inplace):
+        """Add field of other field source multiplied by factor.
+
+        Args:
+            other (FieldSource): Other field source.
+            factor (float): Multiplicative factor applied to other field.
+            inplace (bool): If True, modify this object, otherwise return
+                a modified copy.
+
+        Returns:
+            FieldData: Object with the combined field.
+        """
+        obx, oby, obz = self._get_other_field_on_grid(other)
+        data = self if inplace else self._copy_grid()
+        data._set_field(
+            self._bx + factor*obx,
+            self._by + factor*oby,
+            self._bz + factor*obz)
+        return data
+
+    def add_field(self, other, scale=1, inplace=True):
+        """Add field from another field source.
+
+        If other is a FieldData object defined on the same grid the field
+        arrays are added directly, otherwise the field of other is evaluated
+        on this object's grid.
+
+        Args:
+            other (FieldSource): Other field source (FieldData or
+                FieldModel) to get the field to add to this object field.
+            scale (float, optional): Multiplicative factor applied to the
+                field of other before adding. Defaults to 1.
+            inplace (bool, optional): If True, this object is modified.
+                If False, a new object is returned and this object is left
+                unchanged. Defaults to True.
+
+        Returns:
+            FieldData: Object with the resulting field.
+        """
+        return self._combine_field(other, scale, inplace)
+
+    def sub_field(self, other, scale=1, inplace=True):
+        """Subtract field from another field source.
+
+        If other is a FieldData object defined on the same grid the field
+        arrays are subtracted directly, otherwise the field of other is
+        evaluated on this object's grid.
+
+        Args:
+            other (FieldSource): Other field source (FieldData or
+                FieldModel) to get the field to subtract from this
+                object field.
+            scale (float, optional): Multiplicative factor applied to the
+                field of other before subtracting. Defaults to 1.
+            inplace (bool, optional): If True, this object is modified.
+                If False, a new object is returned and this object is left
+                unchanged. Defaults to True.
+
+        Returns:
+            FieldData: Object with the resulting field.
+        """
+        return self._combine_field(other, -scale, inplace)
+
+    def scale_field(self, factor, inplace=True):
+        """Multiply field data by a constant factor.
+
+        Args:
+            factor (float): Multiplicative factor.
+            inplace (bool, optional): If True, this object is modified.
+                If False, a new object is returned and this object is left
+                unchanged. Defaults to True.
+
+        Returns:
+            FieldData: Object with the scaled field.
+        """
+        data = self if inplace else self._copy_grid()
+        data._set_field(
+            factor*self._bx, factor*self._by, factor*self._bz)
+        return data
 
     def clear(self):
         """Clear all field data.
@@ -1798,6 +2892,7 @@ class FieldData(FieldSource):
         self._nx = None
         self._ny = None
         self._nz = None
+        self._selected_y = 0
         self._px = None
         self._py = None
         self._pz = None
@@ -1948,6 +3043,41 @@ class FieldData(FieldSource):
 
         self._update_interpolation_functions()
 
+    def get_field_limits(self, x=0, y=0, field_tol=1e-5):
+        """Longitudinal limits of the region with non negligible field.
+
+        Limits are taken from the data, as the range of z positions at
+        which the field magnitude exceeds field_tol for any x position,
+        extended by one grid point. Outside the data range, interpolated
+        fields are not defined.
+
+        Args:
+            x (float, optional): Not used, kept for compatibility with
+                FieldSource.get_field_limits. Defaults to 0.
+            y (float, optional): Not used. Defaults to 0.
+            field_tol (float, optional): Field magnitude below which the
+                field is considered negligible (in T). Defaults to 1e-5.
+
+        Returns:
+            list: [zmin, zmax] limits (in mm), or None if there is no
+                longitudinal data or if the field is negligible everywhere.
+        """
+        if self._pz is None or self._nz == 1:
+            return None
+
+        field = _np.sqrt(
+            _np.array(self._bx)**2 + _np.array(self._by)**2 +
+            _np.array(self._bz)**2)
+        field = _np.max(field.reshape(-1, self._nz), axis=0)
+        indices = _np.where(field >= field_tol)[0]
+        if len(indices) == 0:
+            return None
+
+        pz = _np.array(self._pz)
+        idx_min = max(indices[0] - 1, 0)
+        idx_max = min(indices[-1] + 1, self._nz - 1)
+        return [pz[idx_min], pz[idx_max]]
+
     def get_field_at_point(self, point):
         """Get field at point.
 
@@ -1957,6 +3087,7 @@ class FieldData(FieldSource):
         Returns:
             list: Field data list [bx, by, bz] (in T).
         """
+        _profiling.count('interpolations')
         if self._nx == 1:
             bx = self._bx_func(point[2])[0]
             by = self._by_func(point[2])[0]
@@ -1971,6 +3102,32 @@ class FieldData(FieldSource):
             bz = self._bz_func(point[0], point[2])[0, 0]
         return [bx, by, bz]
 
+    @_profiling.timed
+    def get_field_at_points(self, points):
+        """Get field at a list of points.
+
+        Interpolation functions are evaluated once for all points.
+
+        Args:
+            points (list): List of [x, y, z] positions to get field (in mm).
+
+        Returns:
+            numpy.ndarray: Field data array of shape (npts, 3) with
+                [bx, by, bz] at each point (in T).
+        """
+        points = _np.array(points, dtype=float).reshape(-1, 3)
+        x = points[:, 0]
+        z = points[:, 2]
+        _profiling.count('interpolations', len(points))
+        funcs = [self._bx_func, self._by_func, self._bz_func]
+        if self._nx == 1:
+            field = [func(z)[0] for func in funcs]
+        elif self._nz == 1:
+            field = [func(x)[0] for func in funcs]
+        else:
+            field = [func.ev(x, z) for func in funcs]
+        return _np.transpose(field)
+
     def shift(self, value):
         """Shift field data.
 
@@ -2023,6 +3180,7 @@ class FieldData(FieldSource):
             bool: True.
         """
         self._raw_data = raw_data
+        self._selected_y = selected_y
 
         px = self._raw_data[:, 0]
         py = self._raw_data[:, 1]
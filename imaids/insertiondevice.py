@@ -1,7 +1,12 @@
 
 import time as _time
 from copy import deepcopy as _deepcopy
+import inspect as _inspect
 import json as _json
+from types import MappingProxyType as _MappingProxyType
+
+import numpy as _np
+import radia as _rad
 
 from . import fieldsource as _fieldsource
 
@@ -113,7 +118,8 @@ class InsertionDeviceModel(
 
     def __init__(
             self, nr_periods=None, period_length=None, gap=None, name=None,
-            init_radia_object=True, trf_on_blocks=False, **kwargs):
+            init_radia_object=True, trf_on_blocks=False, use_symmetry=False,
+            **kwargs):
         """Insertion device model class.
 
         Args:
@@ -130,6 +136,13 @@ class InsertionDeviceModel(
                 applied to blocks when cassettes are positioned. Otherwise,
                 transformations are applied to the cassettes themselves.
                 Defaults to False.
+            use_symmetry (bool, optional): If True, models which support it
+                build only the lower half of the device and attach a Radia
+                midplane symmetry transformation, if the configured
+                magnetizations and position errors preserve the symmetry.
+                Otherwise, all cassettes are built explicitly. Individual
+                blocks can only be displaced (e.g. shimming) after
+                disable_midplane_symmetry. Defaults to False.
 
         Raises:
             ValueError: Magnetic gap must be bigger than zero.
@@ -145,6 +158,8 @@ class InsertionDeviceModel(
         self._cassette_properties = kwargs
         self._cassettes = {}
         self.trf_on_blocks = trf_on_blocks
+        self.use_symmetry = use_symmetry
+        self._symmetric = False
         self._radia_object = None
         if init_radia_object:
             self.create_radia_object()
@@ -154,10 +169,19 @@ class InsertionDeviceModel(
         """Magnetic gap [mm]."""
         return self._gap
 
+    @property
+    def symmetric(self):
+        """True if the radia object was built using midplane symmetry."""
+        return self._symmetric
+
     @property
     def cassettes(self):
-        """Cassettes dictionary."""
-        return _deepcopy(self._cassettes)
+        """Read-only view of the cassettes dictionary.
+
+        The view is not a copy, changes to the cassettes are reflected on
+        the device. Use copy_cassettes for an independent copy.
+        """
+        return _MappingProxyType(self._cassettes)
 
     @property
     def cassettes_ref(self):
@@ -195,7 +219,7 @@ class InsertionDeviceModel(
         pos_err_dict = {}
 
         for key, value in self._cassettes.items():
-            pos_err_dict[key] = value.position_err
+            pos_err_dict[key] = value.position_err.tolist()
 
         return pos_err_dict
 
@@ -243,6 +267,410 @@ class InsertionDeviceModel(
     def create_radia_object(self):
         raise NotImplementedError
 
+    def copy_cassettes(self):
+        """Returns a deep copy of the cassettes dictionary.
+
+        Copied cassettes own duplicates of the Radia objects of the
+        cassettes (see FieldModel.__deepcopy__), which are deleted with the
+        copies and are not part of the device Radia object. Radia objects
+        of the device itself are owned by the device and are deleted when
+        it is garbage collected, so the device must be kept alive while
+        its objects are used elsewhere (e.g. in radia ObjCnt containers).
+
+        Returns:
+            dict: Copy of the cassettes dictionary.
+        """
+        return _deepcopy(self._cassettes)
+
+    def get_cassette_positions(self):
+        """Get current cassette positions.
+
+        Returns:
+            dict: Keyword arguments of the model set_cassete_positions
+                method (e.g. dp, dcp, dg) with their current values (in mm).
+                Empty if the model does not define set_cassete_positions.
+        """
+        set_positions = getattr(self, 'set_cassete_positions', None)
+        if set_positions is None:
+            return {}
+        params = _inspect.signature(set_positions).parameters
+        return {key: getattr(self, key) for key in params}
+
+    def scan_cassette_positions(
+            self, configurations, func=None, solve=False,
+            prec=0.00001, max_iter=1000, restore=True):
+        """Move cassettes through a sequence of configurations.
+
+        Cassettes are moved incrementally from one configuration to the
+        next (only the position differences are applied), and func is
+        called at each configuration.
+
+        Args:
+            configurations (list): List of dictionaries with keyword
+                arguments for set_cassete_positions (e.g. [{'dp': 0},
+                {'dp': 10}]).
+            func (callable, optional): Function called with the model as
+                argument at each configuration. If None, the cassette
+                positions are returned. Defaults to None.
+            solve (bool, optional): If True, the model is solved at each
+                configuration before calling func. Defaults to False.
+            prec (float, optional): Solve precision. Defaults to 0.00001.
+            max_iter (int, optional): Maximum number of solve iterations.
+                Defaults to 1000.
+            restore (bool, optional): If True, the initial cassette
+                positions are restored at the end. Defaults to True.
+
+        Returns:
+            list: Values returned by func, one for each configuration.
+        """
+        initial_positions = self.get_cassette_positions()
+        if func is None:
+            func = type(self).get_cassette_positions
+
+        results = []
+        try:
+            for configuration in configurations:
+                self.set_cassete_positions(**configuration)
+                if solve:
+                    self.solve(prec=prec, max_iter=max_iter)
+                results.append(func(self))
+        finally:
+            if restore:
+                self.set_cassete_positions(**initial_positions)
+
+        return results
+
+    @staticmethod
+    def _get_shape_points(shape, mirror_x=False):
+        """Get sorted array of shape points, optionally mirrored in x."""
+        points = _np.array(shape, dtype=float).reshape(-1, 2)
+        if mirror_x:
+            points[:, 0] = -points[:, 0]
+        return points[_np.lexsort((points[:, 1], points[:, 0]))]
+
+    def check_midplane_symmetry(self, upper='cs', lower='ci', tol=1e-9):
+        """Check if upper cassette is the midplane mirror of lower cassette.
+
+        The upper cassette is assumed to be created as the lower one and
+        rotated by pi around the longitudinal axis, as done in the planar
+        models. The device is symmetric with respect to the y=0 plane (with
+        zero parallel field on the plane) if the cassettes have the same
+        block sequence and, for every pair of blocks:
+            > upper shape is the lower shape mirrored in x.
+            > upper magnetization is [mx, -my, -mz] of the lower one.
+            > upper position error is [-dx, dy, dz] of the lower one.
+
+        Args:
+            upper (str, optional): Upper cassette name. Defaults to 'cs'.
+            lower (str, optional): Lower cassette name. Defaults to 'ci'.
+            tol (float, optional): Absolute tolerance used for comparisons.
+                Defaults to 1e-9.
+
+        Returns:
+            bool: True if the cassettes are symmetric, False otherwise.
+        """
+        cs = self._cassettes.get(upper)
+        ci = self._cassettes.get(lower)
+        if cs is None or ci is None:
+            return False
+
+        if cs.nr_blocks != ci.nr_blocks or cs.hybrid != ci.hybrid:
+            return False
+
+        if list(cs.is_pole_list) != list(ci.is_pole_list):
+            return False
+
+        if cs.hybrid and cs.pole_material is not ci.pole_material:
+            return False
+
+        if not (_np.isclose(cs.ksipar, ci.ksipar)
+                and _np.isclose(cs.ksiper, ci.ksiper)):
+            return False
+
+        for shape_s, shape_i in [(cs.block_shape, ci.block_shape),
+                                 (cs.pole_shape, ci.pole_shape)]:
+            if shape_s is None and shape_i is None:
+                continue
+            if shape_s is None or shape_i is None:
+                return False
+            points_s = self._get_shape_points(shape_s, mirror_x=True)
+            points_i = self._get_shape_points(shape_i)
+            if points_s.shape != points_i.shape:
+                return False
+            if not _np.allclose(points_s, points_i, atol=tol):
+                return False
+
+        if not _np.allclose(cs.length_list, ci.length_list, atol=tol):
+            return False
+
+        if not _np.allclose(
+                cs.longitudinal_position_list,
+                ci.longitudinal_position_list, atol=tol):
+            return False
+
+        mag_s = _np.array(cs.magnetization_list, dtype=float)
+        mag_i = _np.array(ci.magnetization_list, dtype=float)
+        if not _np.allclose(mag_s, mag_i*[1, -1, -1], atol=tol):
+            return False
+
+        err_s = _np.array(cs.position_err, dtype=float)
+        err_i = _np.array(ci.position_err, dtype=float)
+        if not _np.allclose(err_s, err_i*[-1, 1, 1], atol=tol):
+            return False
+
+        return True
+
+    def _create_midplane_container(self, upper='cs', lower='ci'):
+        """Create device container using midplane symmetry if possible.
+
+        If use_symmetry is True and the cassettes are symmetric (see
+        check_midplane_symmetry), the container holds only the lower
+        cassette and a Radia symmetry transformation is attached to it,
+        so the upper cassette is not relaxed nor integrated by Radia.
+        Otherwise both cassettes are added to the container.
+
+        Args:
+            upper (str, optional): Upper cassette name. Defaults to 'cs'.
+            lower (str, optional): Lower cassette name. Defaults to 'ci'.
+
+        Returns:
+            bool: True if the symmetric container was created,
+                False otherwise.
+        """
+        cs = self._cassettes[upper]
+        ci = self._cassettes[lower]
+
+        if self.use_symmetry and self.check_midplane_symmetry(upper, lower):
+            self._radia_object = _rad.ObjCnt([ci.radia_object])
+            _rad.TrfZerPara(self._radia_object, [0, 0, 0], [0, 1, 0])
+            self._symmetric = True
+        else:
+            self._radia_object = _rad.ObjCnt(
+                [c.radia_object for c in [cs, ci]])
+            self._symmetric = False
+
+        self._register_radia_object()
+        return self._symmetric
+
+    def disable_midplane_symmetry(self):
+        """Rebuild the radia object with all cassettes built explicitly.
+
+        Needed before displacing individual blocks (e.g. shimming), since
+        the symmetric container neither includes the upper cassette nor
+        follows lower cassette changes that break the symmetry. The
+        use_symmetry attribute and the cassette positions are kept.
+
+        Returns:
+            bool: True if the radia object was rebuilt, False if it was
+                not built using midplane symmetry.
+        """
+        if not self._symmetric:
+            return False
+
+        positions = self.get_cassette_positions()
+        use_symmetry = self.use_symmetry
+        self.use_symmetry = False
+        try:
+            self.create_radia_object(
+                block_names_dict=self.block_names_dict,
+                magnetization_dict=self.magnetization_dict,
+                position_err_dict=self.position_err_dict)
+        finally:
+            self.use_symmetry = use_symmetry
+
+        # The new cassettes are created at the initial positions.
+        for key in positions:
+            setattr(self, '_' + key, 0)
+        self.set_cassete_positions(**positions)
+        return True
+
+    def create_periodic_model(
+            self, nr_periods=5, solve=True, prec=0.00001, max_iter=1000):
+        """Create reduced model with fewer periods for periodic reduction.
+
+        The reduced model has the same class, cassette properties and
+        cassette positions as this device, but only nr_periods core
+        periods. Start and end blocks are kept, so that the reduced model
+        contains both terminations and a central section whose field is
+        representative of the core periods of the full device.
+
+        The full device radia object does not need to be created, so long
+        devices may be initialized with init_radia_object=False.
+
+        Note: Magnetization and position errors are not transferred to the
+            reduced model, which is built from the ideal block list.
+
+        Args:
+            nr_periods (int, optional): Number of core periods of the
+                reduced model. Must be at least 3 so that the central period
+                is not adjacent to the terminations. Defaults to 5.
+            solve (bool, optional): If True, the reduced model is solved
+                before being returned. Defaults to True.
+            prec (float, optional): Solve precision, see FieldModel.solve.
+                Defaults to 0.00001.
+            max_iter (int, optional): Maximum number of solve iterations,
+                see FieldModel.solve. Defaults to 1000.
+
+        Raises:
+            ValueError: If nr_periods or period_length are not defined.
+            ValueError: If nr_periods is not in the [3, self.nr_periods]
+                interval.
+
+        Returns:
+            InsertionDeviceModel: Reduced model.
+        """
+        if self.nr_periods is None or self.period_length is None:
+            raise ValueError(
+                'nr_periods and period_length must be defined.')
+
+        nr_periods = int(nr_periods)
+        if nr_periods < 3 or nr_periods > self.nr_periods:
+            raise ValueError(
+                'nr_periods must be in the [3, {0:d}] interval.'.format(
+                    self.nr_periods))
+
+        kwargs = {
+            'nr_periods': nr_periods,
+            'period_length': self.period_length,
+            'gap': self.gap,
+            'name': self.name,
+        }
+        kwargs.update(self.cassette_properties)
+
+        model = self.__class__(
+            init_radia_object=False, trf_on_blocks=self.trf_on_blocks,
+            use_symmetry=self.use_symmetry, **kwargs)
+        model.create_radia_object()
+
+        positions = self.get_cassette_positions()
+        if positions:
+            model.set_cassete_positions(**positions)
+
+        if solve:
+            model.solve(prec=prec, max_iter=max_iter)
+
+        return model
+
+    def get_periodic_longitudinal_positions(self, reduced_model, z):
+        """Map longitudinal positions of this device to the reduced model.
+
+        Positions near the device entrance and exit are mapped to the
+        corresponding terminations of the reduced model. Positions in the
+        core region are folded into the central period of the reduced model.
+
+        Args:
+            reduced_model (InsertionDeviceModel): Reduced model created by
+                create_periodic_model.
+            z (list or float): Longitudinal positions (in mm).
+
+        Raises:
+            ValueError: If period lengths are different.
+
+        Returns:
+            numpy.ndarray: Longitudinal positions on the reduced model
+                (in mm).
+        """
+        if reduced_model.period_length != self.period_length:
+            raise ValueError('Period lengths must be equal.')
+
+        period = self.period_length
+        dz = (self.nr_periods - reduced_model.nr_periods)*period/2
+        z = _np.array(z, dtype=float, ndmin=1)
+
+        z_entrance = z + dz
+        z_exit = z - dz
+        z_core = z_entrance - period*_np.round(z_entrance/period)
+
+        return _np.where(
+            z_entrance <= -period/2, z_entrance,
+            _np.where(z_exit >= period/2, z_exit, z_core))
+
+    def get_periodic_field(self, reduced_model, x=0, y=0, z=0):
+        """Get field of this device reconstructed from a reduced model.
+
+        The field of the full device is obtained by tiling the central
+        period of the solved reduced model and stitching its terminations
+        to the device ends (see get_periodic_longitudinal_positions).
+
+        Args:
+            reduced_model (InsertionDeviceModel): Solved reduced model
+                created by create_periodic_model.
+            x (list or float or int, optional): x positions
+                to get field (in mm). Defaults to 0.
+            y (list or float or int, optional): y positions
+                to get field (in mm). Defaults to 0.
+            z (list or float or int, optional): z positions
+                to get field (in mm). Defaults to 0.
+
+        Raises:
+            ValueError: Position arguments must be valid.
+
+        Returns:
+            numpy.ndarray: Field data [bx, by, bz] (in T), in the same
+                order as returned by get_field.
+        """
+        if int(_np.ndim(x)) == 0:
+            x = [x]
+        if int(_np.ndim(y)) == 0:
+            y = [y]
+        if int(_np.ndim(z)) == 0:
+            z = [z]
+
+        if sum([len(i) > 1 for i in [x, y, z]]) > 1:
+            raise ValueError('Invalid position arguments.')
+
+        z = self.get_periodic_longitudinal_positions(reduced_model, z)
+        pos_list = []
+        for pos_z in z:
+            for pos_x in x:
+                for pos_y in y:
+                    pos_list.append([pos_x, pos_y, pos_z])
+
+        return reduced_model.get_field_at_points(pos_list)
+
+    def calc_periodic_reduction_error(self, reduced_model, z, x=0, y=0):
+        """Compare the reconstructed periodic field with this device field.
+
+        This device radia object must be created and solved.
+
+        Args:
+            reduced_model (InsertionDeviceModel): Solved reduced model
+                created by create_periodic_model.
+            z (list): z positions to compare fields (in mm).
+            x (float, optional): x position to compare fields (in mm).
+                Defaults to 0.
+            y (float, optional): y position to compare fields (in mm).
+                Defaults to 0.
+
+        Returns:
+            dict: Dictionary with the following numpy.ndarray entries,
+                each one containing [bx, by, bz] values:
+                    'max_abs_error': maximum absolute error (in T).
+                    'rms_error': rms error (in T).
+                    'field_amplitude': maximum absolute full field (in T).
+                    'relative_error': max_abs_error over the largest
+                        field_amplitude component.
+        """
+        z = _np.array(z, dtype=float, ndmin=1)
+        points = [[x, y, pos_z] for pos_z in z]
+        field_full = self.get_field_at_points(points)
+        field_periodic = self.get_periodic_field(
+            reduced_model, x=x, y=y, z=z)
+
+        error = field_periodic - field_full
+        max_abs_error = _np.max(_np.abs(error), axis=0)
+        rms_error = _np.sqrt(_np.mean(error**2, axis=0))
+        field_amplitude = _np.max(_np.abs(field_full), axis=0)
+        relative_error = max_abs_error/_np.max(field_amplitude)
+
+        results = {
+            'max_abs_error': max_abs_error,
+            'rms_error': rms_error,
+            'field_amplitude': field_amplitude,
+            'relative_error': relative_error,
+        }
+        return results
+
     def get_fieldmap_header(
             self, kh, kv, field_phase=None, polarization_name=None):
         """Get fieldmap header to save in file.
@@ -0,0 +1,312 @@
+
+import weakref as _weakref
+import radia as _rad
+
+from . import materials as _materials
+
+
+class RadiaObjectTracker():
+    """Ownership tracker of Radia objects created by field models.
+
+    Each owner (a FieldModel instance) registers the Radia object it
+    created. The owned tree (the object and its contained objects not
+    owned by other live owners) is deleted when the owner is garbage
+    collected, when the owner is used as a context manager and the
+    context exits, or when release is called.
+
+    References deleted by utils.delete_recursive are forgotten by the
+    tracker, and utils.delete_all clears it, so that objects are never
+    deleted twice.
+
+    Copies of an owner made with copy.deepcopy own duplicates of its Radia
+    objects (see FieldModel.__deepcopy__), so that the original and the
+    copy can be deleted independently. Radia objects shared in any other
+    way (e.g. added to user containers with radia ObjCnt) are still owned
+    by the model that created them, which must be kept alive while they
+    are used.
+
+    If auto_delete is False, objects of garbage collected owners are not
+    deleted. They are kept as leaks, which can be inspected with get_leaks
+    and freed with release_leaks.
+    """
+
+    # Rough memory used by each Radia elementary object (in bytes).
+    BYTES_PER_ELEMENT = 1000
+
+    def __init__(self, auto_delete=True):
+        """Initializes empty tracker.
+
+        Args:
+            auto_delete (bool, optional): If True, owned objects are deleted
+                when the owner is garbage collected. Defaults to True.
+        """
+        self.auto_delete = auto_delete
+        self._owners = {}
+        self._owner_by_ref = {}
+        self._leaks = {}
+
+    @property
+    def live_count(self):
+        """Number of live owners with registered Radia objects."""
+        return len(self._owners)
+
+    def _forget_key(self, key):
+        entry = self._owners.pop(key, None)
+        if entry is None:
+            return None
+        entry['finalizer'].detach()
+        self._owner_by_ref.pop(entry['ref'], None)
+        return entry
+
+    def _delete_tree(self, ref, key):
+        """Delete ref and contained objects not owned by other owners."""
+        owner_key = self._owner_by_ref.get(ref)
+        if owner_key is not None and owner_key != key:
+            return 0
+        try:
+            nr_objects = _rad.ObjCntSize(ref)
+            in_refs = _rad.ObjCntStuf(ref) if nr_objects > 0 else []
+        except RuntimeError:
+            # Already deleted.
+            return 0
+
+        count = 1
+        for in_ref in in_refs:
+            count += self._delete_tree(in_ref, key)
+        _rad.UtiDel(ref)
+        _materials.registry.release_reference(ref)
+        self._owner_by_ref.pop(ref, None)
+        return count
+
+    def _count_tree(self, ref, key):
+        """Number of objects in tree owned by key."""
+        owner_key = self._owner_by_ref.get(ref)
+        if owner_key is not None and owner_key != key:
+            return 0
+        try:
+            nr_objects = _rad.ObjCntSize(ref)
+            in_refs = _rad.ObjCntStuf(ref) if nr_objects > 0 else []
+        except RuntimeError:
+            return 0
+        return 1 + sum(self._count_tree(in_ref, key) for in_ref in in_refs)
+
+    def _finalize(self, key):
+        entry = self._owners.get(key)
+        if entry is None:
+            return
+        if self.auto_delete:
+            self.release_key(key)
+        else:
+            self._forget_key(key)
+            self._leaks[entry['ref']] = entry['class_name']
+
+    def register(self, owner, ref):
+        """Register Radia object created by owner.
+
+        If the owner had a different registered object, the previous
+        object tree is released first.
+
+        Args:
+            owner (object): Object owning the Radia object.
+            ref (int): Radia object reference.
+
+        Returns:
+            bool: True.
+        """
+        key = id(owner)
+        entry = self._owners.get(key)
+        if entry is not None:
+            if entry['ref'] == ref:
+                return True
+            self.release_key(key)
+
+        finalizer = _weakref.finalize(owner, self._finalize, key)
+        finalizer.atexit = False
+        self._owners[key] = {
+            'ref': ref,
+            'class_name': type(owner).__name__,
+            'name': getattr(owner, 'name', ''),
+            'finalizer': finalizer,
+            'nr_objects': None,
+        }
+        self._owner_by_ref[ref] = key
+        return True
+
+    def release_key(self, key):
+        """Delete Radia objects registered with owner key.
+
+        Args:
+            key (int): Owner key (id of owner).
+
+        Returns:
+            int: Number of deleted Radia objects.
+        """
+        entry = self._owners.get(key)
+        if entry is None:
+            return 0
+        count = self._delete_tree(entry['ref'], key)
+        self._forget_key(key)
+        return count
+
+    def release(self, owner):
+        """Delete Radia objects registered by owner.
+
+        Args:
+            owner (object): Object owning Radia objects.
+
+        Returns:
+            int: Number of deleted Radia objects.
+        """
+        return self.release_key(id(owner))
+
+    def forget(self, ref):
+        """Forget deleted Radia object reference.
+
+        Used by utils.delete_recursive, which deletes objects directly.
+
+        Args:
+            ref (int): Radia object reference.
+
+        Returns:
+            bool: True if the reference was registered, False otherwise.
+        """
+        self._leaks.pop(ref, None)
+        key = self._owner_by_ref.pop(ref, None)
+        if key is None:
+            return False
+        entry = self._owners.get(key)
+        if entry is not None and entry['ref'] == ref:
+            self._forget_key(key)
+        return True
+
+    def duplicate(self, ref, ref_map):
+        """Duplicate Radia object tree (radia ObjDpl).
+
+        The duplicated objects are not registered (they are registered by
+        the copies owning them, see FieldModel.__deepcopy__). Materials
+        applied to the original objects are also referenced by the
+        duplicated objects.
+
+        Args:
+            ref (int): Radia object reference.
+            ref_map (dict): Dictionary {original ref: duplicated ref}
+                updated with the references of the tree.
+
+        Returns:
+            int: Duplicated Radia object reference.
+        """
+        new_ref = _rad.ObjDpl(ref)
+        self._map_tree(ref, new_ref, ref_map)
+        return new_ref
+
+    def _map_tree(self, ref, new_ref, ref_map):
+        ref_map[ref] = new_ref
+        _materials.registry.copy_reference(ref, new_ref)
+        if _rad.ObjCntSize(ref) > 0:
+            for in_ref, new_in_ref in zip(
+                    _rad.ObjCntStuf(ref), _rad.ObjCntStuf(new_ref)):
+                if new_in_ref != in_ref:
+                    self._map_tree(in_ref, new_in_ref, ref_map)
+
+    def is_registered(self, owner):
+        """Check if owner has a registered Radia object.
+
+        Args:
+            owner (object): Object owning Radia objects.
+
+        Returns:
+            bool: True if owner has a registered object, False otherwise.
+        """
+        return id(owner) in self._owners
+
+    def get_owner_stats(self, count_objects=True):
+        """Registered objects statistics of each live owner.
+
+        Args:
+            count_objects (bool, optional): If True, the owned object trees
+                are traversed to count elementary objects and estimate
+                memory. Counts are cached until the object is replaced.
+                Defaults to True.
+
+        Returns:
+            list: List of dictionaries with keys 'class_name', 'name',
+                'ref', 'nr_objects' and 'memory' (estimated, in bytes).
+                nr_objects and memory are None if count_objects is False
+                and the owner was not counted before.
+        """
+        stats = []
+        for key, entry in self._owners.items():
+            if count_objects and entry['nr_objects'] is None:
+                entry['nr_objects'] = self._count_tree(entry['ref'], key)
+            nr_objects = entry['nr_objects']
+            memory = None if nr_objects is None else (
+                nr_objects*self.BYTES_PER_ELEMENT)
+            stats.append({
+                'class_name': entry['class_name'],
+                'name': entry['name'],
+                'ref': entry['ref'],
+                'nr_objects': nr_objects,
+                'memory': memory,
+            })
+        return stats
+
+    def get_class_stats(self, count_objects=True):
+        """Registered objects statistics grouped by owner class.
+
+        Args:
+            count_objects (bool, optional): See get_owner_stats.
+                Defaults to True.
+
+        Returns:
+            dict: Dictionary {class_name: {'nr_owners', 'nr_objects',
+                'memory'}}. Memory is estimated, in bytes.
+        """
+        class_stats = {}
+        for owner_stats in self.get_owner_stats(count_objects=count_objects):
+            stats = class_stats.setdefault(
+                owner_stats['class_name'],
+                {'nr_owners': 0, 'nr_objects': 0, 'memory': 0})
+            stats['nr_owners'] += 1
+            stats['nr_objects'] += owner_stats['nr_objects'] or 0
+            stats['memory'] += owner_stats['memory'] or 0
+        return class_stats
+
+    def get_leaks(self):
+        """Radia objects of garbage collected owners not deleted.
+
+        Leaks are only kept if auto_delete is False.
+
+        Returns:
+            dict: Dictionary {ref: class_name of former owner}.
+        """
+        return dict(self._leaks)
+
+    def release_leaks(self):
+        """Delete Radia objects of garbage collected owners.
+
+        Returns:
+            int: Number of deleted Radia objects.
+        """
+        count = 0
+        for ref in list(self._leaks):
+            self._leaks.pop(ref)
+            count += self._delete_tree(ref, None)
+        return count
+
+    def clear(self):
+        """Forget all registered objects without deleting them.
+
+        Used after all Radia objects were deleted (e.g. by utils.delete_all).
+
+        Returns:
+            bool: True.
+        """
+        for entry in self._owners.values():
+            entry['finalizer'].detach()
+        self._owners = {}
+        self._owner_by_ref = {}
+        self._leaks = {}
+        return True
+
+
+tracker = RadiaObjectTracker()
@@ -434,7 +434,7 @@ class MagicFingers(_fieldsource.FieldModel):
         regardless if they are set in initialization, read from file or
         altered by the solved magnetostatic problem.
         """
-        mag_list = [block.magnetization for block in self._blocks]
+        mag_list = [block.magnetization.tolist() for block in self._blocks]
         return mag_list
 
     @property
@@ -666,6 +666,7 @@ class MagicFingers(_fieldsource.FieldModel):
             if block.radia_object is not None:
                 rad_obj_list.append(block.radia_object)
         self._radia_object = _rad.ObjCnt(rad_obj_list)
+        self._register_radia_object()
 
 class MagicFingersSabia(MagicFingers):
 
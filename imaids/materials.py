@@ -74,6 +74,17 @@ class Material():
             r += fmtstr.format(name, str(value))
         return r
 
+    def __deepcopy__(self, memo):
+        """Deep copy, returning the material itself if it is interned (see
+        MaterialRegistry), so that copies share the registered material."""
+        if registry.is_interned(self):
+            return self
+        copy = self.__class__.__new__(self.__class__)
+        memo[id(self)] = copy
+        for key, value in self.__dict__.items():
+            copy.__dict__[key] = _deepcopy(value, memo)
+        return copy
+
     @property
     def linear(self):
         """True if the material is linear, False otherwise."""
@@ -204,6 +215,183 @@ class Material():
         return True
 
 
+class MaterialRegistry():
+    """Registry of interned materials shared between blocks.
+
+    Materials are interned by their properties: (mr, ksipar, ksiper) for
+    linear materials and (hlist, mlist) for nonlinear materials, so that
+    blocks with equal materials share a single Radia material object.
+
+    Each material keeps track of the Radia objects it was applied to.
+    References are released by utils.delete_recursive, and the Radia
+    material object is deleted when no object references it anymore.
+    """
+
+    def __init__(self):
+        """Initializes empty registry."""
+        self._materials = {}
+        self._references = {}
+        self._keys_by_reference = {}
+
+    def __len__(self):
+        """Number of interned materials."""
+        return len(self._materials)
+
+    @staticmethod
+    def get_key(
+            linear=True, mr=1.37, ksipar=0.06, ksiper=0.17,
+            hlist=None, mlist=None, **kwargs):
+        """Get interning key for material properties.
+
+        Args:
+            linear (bool, optional): Defaults to True.
+            mr (float, optional): Defaults to 1.37.
+            ksipar (float, optional): Defaults to 0.06.
+            ksiper (float, optional): Defaults to 0.17.
+            hlist (list, optional): Defaults to None.
+            mlist (list, optional): Defaults to None.
+            kwargs: Other material arguments, not used in the key.
+
+        Returns:
+            tuple: Material key.
+        """
+        if linear:
+            return (
+                True, round(float(mr), 12),
+                float(ksipar), float(ksiper))
+        return (
+            False, tuple(_np.array(hlist, dtype=float).tolist()),
+            tuple(_np.array(mlist, dtype=float).tolist()))
+
+    def get_material(self, **kwargs):
+        """Get interned material, creating it if necessary.
+
+        Args:
+            kwargs: Keyword arguments passed to Material initialization.
+
+        Returns:
+            Material: Shared material object.
+        """
+        key = self.get_key(**kwargs)
+        material = self._materials.get(key)
+        if material is None:
+            material = Material(**kwargs)
+            self._materials[key] = material
+            self._references[key] = set()
+        return material
+
+    def _get_interned_key(self, material):
+        key = self.get_key(**material.state)
+        interned = self._materials.get(key)
+        if interned is None or (
+                interned.radia_object != material.radia_object):
+            return None
+        return key
+
+    def is_interned(self, material):
+        """Check if material is interned.
+
+        Materials are compared by key and Radia object, so that copies of
+        an interned material are also recognized.
+
+        Args:
+            material (Material): Material.
+
+        Returns:
+            bool: True if material is interned, False otherwise.
+        """
+        return self._get_interned_key(material) is not None
+
+    def add_reference(self, material, ref):
+        """Register Radia object to which an interned material was applied.
+
+        Args:
+            material (Material): Interned material.
+            ref (int): Radia object reference.
+
+        Returns:
+            bool: True if material is interned, False otherwise.
+        """
+        key = self._get_interned_key(material)
+        if key is None:
+            return False
+        self._references[key].add(ref)
+        self._keys_by_reference[ref] = key
+        return True
+
+    def copy_reference(self, ref, new_ref):
+        """Register Radia object duplicated from a registered object.
+
+        Args:
+            ref (int): Registered Radia object reference.
+            new_ref (int): Duplicated Radia object reference.
+
+        Returns:
+            bool: True if ref is registered, False otherwise.
+        """
+        key = self._keys_by_reference.get(ref)
+        if key is None:
+            return False
+        self._references[key].add(new_ref)
+        self._keys_by_reference[new_ref] = key
+        return True
+
+    def release_reference(self, ref):
+        """Release Radia object reference.
+
+        If the material associated with the reference is not applied to any
+        other object, its Radia object is deleted and it is removed from the
+        registry.
+
+        Args:
+            ref (int): Radia object reference.
+
+        Returns:
+            bool: True if a material was deleted, False otherwise.
+        """
+        key = self._keys_by_reference.pop(ref, None)
+        if key is None:
+            return False
+        references = self._references[key]
+        references.discard(ref)
+        if references:
+            return False
+        material = self._materials.pop(key)
+        self._references.pop(key)
+        _rad.UtiDel(material.radia_object)
+        return True
+
+    def get_reference_count(self, material):
+        """Number of Radia objects using an interned material.
+
+        Args:
+            material (Material): Interned material.
+
+        Returns:
+            int: Number of references, 0 if material is not interned.
+        """
+        key = self._get_interned_key(material)
+        if key is None:
+            return 0
+        return len(self._references[key])
+
+    def clear(self):
+        """Forget all interned materials without deleting Radia objects.
+
+        Used after all Radia objects were deleted (e.g. by utils.delete_all).
+
+        Returns:
+            bool: True.
+        """
+        self._materials = {}
+        self._references = {}
+        self._keys_by_reference = {}
+        return True
+
+
+registry = MaterialRegistry()
+
+
 class NdFeB(Material):
     """Material class derivate with NdFeB values as default
     
@@ -8,6 +8,7 @@ from . import blocks as _blocks
 from . import cassettes as _cassettes
 from . import materials as _materials
 from . import utils as _utils
+from . import profiling as _profiling
 
 
 class Delta(_insertiondevice.InsertionDeviceModel):
@@ -19,6 +20,7 @@ class Delta(_insertiondevice.InsertionDeviceModel):
         self._dcp = 0
         self._dgv = 0
         self._dgh = 0
+        self._cassette_offsets = {}
         super().__init__(*args, **kwargs)
 
     @property
@@ -57,6 +59,7 @@ class Delta(_insertiondevice.InsertionDeviceModel):
     def dgh(self, value):
         self.set_cassete_positions(dgh=value)
 
+    @_profiling.timed
     def create_radia_object(
             self,
             block_names_dict=None,
@@ -155,8 +158,15 @@ class Delta(_insertiondevice.InsertionDeviceModel):
 
         self._radia_object = _rad.ObjCnt(
             [c.radia_object for c in [csd, cse, cid, cie]])
+        self._register_radia_object()
         self.rotate([0, 0, 0], [0, 0, 1], -_np.pi/4)
 
+        # Current longitudinal offsets of the cassette centers, updated by
+        # set_cassete_positions.
+        self._cassette_offsets = {
+            name: cassette.get_longitudinal_center()
+            for name, cassette in self._cassettes.items()}
+
     def set_cassete_positions(self, dp=None, dcp=None, dgv=None, dgh=None):
         """Change longitudinal cassette positions to adjust
         polarization and energy.
@@ -191,23 +201,19 @@ class Delta(_insertiondevice.InsertionDeviceModel):
         cid = self._cassettes['cid']
         cie = self._cassettes['cie']
 
-        csd_z = _np.array(_rad.ObjM(csd.radia_object))[:, 0, 2]
-        csd_shift = - (_np.max(csd_z) + _np.min(csd_z))/2 + dgv
-
-        cse_z = _np.array(_rad.ObjM(cse.radia_object))[:, 0, 2]
-        cse_shift = - (
-            _np.max(cse_z) + _np.min(cse_z))/2 + dgv + dgh + dp + dcp
-
-        cid_z = _np.array(_rad.ObjM(cid.radia_object))[:, 0, 2]
-        cid_shift = - (_np.max(cid_z) + _np.min(cid_z))/2 + dp - dcp
-
-        cie_z = _np.array(_rad.ObjM(cie.radia_object))[:, 0, 2]
-        cie_shift = - (_np.max(cie_z) + _np.min(cie_z))/2 + dgh
+        offsets = {
+            'csd': dgv,
+            'cse': dgv + dgh + dp + dcp,
+            'cid': dp - dcp,
+            'cie': dgh,
+        }
 
-        csd.shift([0, 0, csd_shift])
-        cse.shift([0, 0, cse_shift])
-        cid.shift([0, 0, cid_shift])
-        cie.shift([0, 0, cie_shift])
+        for name, cassette in [
+                ('csd', csd), ('cse', cse), ('cid', cid), ('cie', cie)]:
+            shift = offsets[name] - self._cassette_offsets[name]
+            if shift != 0:
+                cassette.shift([0, 0, shift])
+            self._cassette_offsets[name] = offsets[name]
 
         self._dp = dp
         self._dcp = dcp
@@ -307,6 +313,7 @@ class AppleX(_insertiondevice.InsertionDeviceModel):
     def dg(self, value):
         self.set_cassete_positions(dg=value)
 
+    @_profiling.timed
     def create_radia_object(
             self,
             block_names_dict=None,
@@ -405,6 +412,7 @@ class AppleX(_insertiondevice.InsertionDeviceModel):
 
         self._radia_object = _rad.ObjCnt(
             [c.radia_object for c in [csd, cse, cid, cie]])
+        self._register_radia_object()
         self.rotate([0, 0, 0], [0, 0, 1], -_np.pi/4)
 
     def set_cassete_positions(self, dp=None, dcp=None, dg=None):
@@ -546,6 +554,7 @@ class AppleII(_insertiondevice.InsertionDeviceModel):
     def dg(self, value):
         self.set_cassete_positions(dg=value)
 
+    @_profiling.timed
     def create_radia_object(
             self,
             block_names_dict=None,
@@ -646,6 +655,7 @@ class AppleII(_insertiondevice.InsertionDeviceModel):
 
         self._radia_object = _rad.ObjCnt(
             [c.radia_object for c in [csd, cse, cid, cie]])
+        self._register_radia_object()
 
     def set_cassete_positions(self, dp=None, dcp=None, dg=None):
         """Change longitudinal cassette positions and gap.
@@ -724,6 +734,7 @@ class APU(_insertiondevice.InsertionDeviceModel):
     def dg(self, value):
         self.set_cassete_positions(dg=value)
 
+    @_profiling.timed
     def create_radia_object(
             self,
             block_names_dict=None,
@@ -794,8 +805,7 @@ class APU(_insertiondevice.InsertionDeviceModel):
             ci.shift([0, -self._gap/2, 0])
         self._cassettes[name] = ci
 
-        self._radia_object = _rad.ObjCnt(
-            [c.radia_object for c in [cs, ci]])
+        self._create_midplane_container()
 
     def set_cassete_positions(self, dg=None):
         """Change longitudinal cassette position.
@@ -810,6 +820,11 @@ class APU(_insertiondevice.InsertionDeviceModel):
         if dg is None:
             dg = self._dg
 
+        if self._symmetric and dg != self._dg:
+            # Longitudinal displacement of the upper cassette breaks the
+            # midplane symmetry, so the explicit model is rebuilt.
+            self.disable_midplane_symmetry()
+
         diff_dg = dg - self._dg
 
         cs = self._cassettes['cs']
@@ -836,6 +851,7 @@ class Planar(_insertiondevice.InsertionDeviceModel):
     def dg(self, value):
         self.set_cassete_positions(dg=value)
 
+    @_profiling.timed
     def create_radia_object(
             self,
             block_names_dict=None,
@@ -899,8 +915,7 @@ class Planar(_insertiondevice.InsertionDeviceModel):
             ci.shift([0, -self._gap/2, 0])
         self._cassettes[name] = ci
 
-        self._radia_object = _rad.ObjCnt(
-            [c.radia_object for c in [cs, ci]])
+        self._create_midplane_container()
 
     def set_cassete_positions(self, dg=None):
         """Change longitudinal cassette position.
@@ -0,0 +1,350 @@
+"""Profiling and instrumentation of imaids calculations.
+
+Usage example:
+
+    >>> from imaids import profiling
+    >>> with profiling.profile() as prof:
+    ...     model.solve()
+    ...     model.save_kickmap(...)
+    >>> prof.print_stats()
+    >>> prof.save_json('profile.json')
+    >>> prof.save_folded('profile.folded')  # flamegraph.pl input
+
+Alternatively, set the IMAIDS_PROFILE environment variable to a file name
+to profile the whole script. The file is written at exit, in JSON format
+if its name ends with '.json' and in folded stacks format otherwise.
+
+Time and number of calls are aggregated by call stack: instrumented
+methods (decorated with timed), Radia calls and their callers. Counters
+(e.g. trajectory steps, field evaluation points, interpolation calls)
+are added to the innermost instrumented call. Calculations done in other
+processes (nproc arguments) are not profiled.
+
+When no profiler is active, instrumented methods only check a global
+variable, so the overhead is negligible.
+"""
+
+import atexit as _atexit
+import contextlib as _contextlib
+import functools as _functools
+import json as _json
+import os as _os
+import time as _time
+import radia as _rad
+
+
+RADIA_FUNCTIONS = (
+    'Fld', 'Solve', 'ObjM', 'ObjCnt', 'ObjRecMag', 'ObjThckPgn',
+    'ObjCylMag', 'ObjDivMag', 'MatApl', 'MatLin', 'MatSatIsoTab',
+    'TrfOrnt', 'UtiDel', 'RlxPre', 'RlxAuto',
+)
+
+_profiler = None
+
+
+class Profiler():
+    """Aggregates call times and counters by call stack."""
+
+    def __init__(self):
+        """Initializes empty profiler."""
+        self._nodes = {}
+        self._stack = ()
+        self._radia_originals = {}
+
+    @property
+    def active(self):
+        """True if this profiler is the active profiler."""
+        return _profiler is self
+
+    def __enter__(self):
+        """Start profiling."""
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        """Stop profiling."""
+        self.stop()
+        return False
+
+    def _get_node(self, path):
+        node = self._nodes.get(path)
+        if node is None:
+            node = {'count': 0, 'time': 0.0, 'counters': {}}
+            self._nodes[path] = node
+        return node
+
+    def _wrap_radia_function(self, name, func):
+        label = 'radia.' + name
+
+        @_functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if name == 'Fld' and len(args) > 2:
+                points = args[2]
+                if len(points) > 0 and not _is_scalar(points[0]):
+                    self.count('radia_points', len(points))
+                else:
+                    self.count('radia_points')
+            with self.section(label):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    def start(self):
+        """Start profiling, replacing any active profiler.
+
+        Returns:
+            bool: True.
+        """
+        global _profiler
+        if _profiler is not None and _profiler is not self:
+            _profiler.stop()
+
+        for name in RADIA_FUNCTIONS:
+            func = getattr(_rad, name, None)
+            if func is None or name in self._radia_originals:
+                continue
+            self._radia_originals[name] = func
+            setattr(_rad, name, self._wrap_radia_function(name, func))
+
+        _profiler = self
+        return True
+
+    def stop(self):
+        """Stop profiling, restoring the original Radia functions.
+
+        Returns:
+            bool: True.
+        """
+        global _profiler
+        for name, func in self._radia_originals.items():
+            setattr(_rad, name, func)
+        self._radia_originals = {}
+        if _profiler is self:
+            _profiler = None
+        return True
+
+    def clear(self):
+        """Clear collected statistics.
+
+        Returns:
+            bool: True.
+        """
+        self._nodes = {}
+        return True
+
+    @_contextlib.contextmanager
+    def section(self, name):
+        """Context manager profiling a named section.
+
+        Args:
+            name (str): Section name, appended to the current call stack.
+        """
+        parent = self._stack
+        path = parent + (name,)
+        node = self._get_node(path)
+        self._stack = path
+        t0 = _time.perf_counter()
+        try:
+            yield node
+        finally:
+            node['time'] += _time.perf_counter() - t0
+            node['count'] += 1
+            self._stack = parent
+
+    def count(self, name, value=1):
+        """Add value to counter of the innermost profiled call.
+
+        Args:
+            name (str): Counter name.
+            value (int or float, optional): Value added. Defaults to 1.
+        """
+        counters = self._get_node(self._stack)['counters']
+        counters[name] = counters.get(name, 0) + value
+
+    def get_stats(self):
+        """Statistics of each call stack.
+
+        Returns:
+            list: List of dictionaries with keys 'stack' (list of names from
+                the outermost call), 'count' (number of calls), 'time' (total
+                time, in s), 'self_time' (time not spent in profiled inner
+                calls, in s) and 'counters' (dictionary of counters).
+                Sorted by stack.
+        """
+        children_time = {}
+        for path, node in self._nodes.items():
+            if len(path) > 0:
+                parent = path[:-1]
+                children_time[parent] = children_time.get(
+                    parent, 0.0) + node['time']
+
+        stats = []
+        for path in sorted(self._nodes):
+            node = self._nodes[path]
+            self_time = node['time'] - children_time.get(path, 0.0)
+            stats.append({
+                'stack': list(path),
+                'count': node['count'],
+                'time': node['time'],
+                'self_time': max(self_time, 0.0) if path else 0.0,
+                'counters': dict(node['counters']),
+            })
+        return stats
+
+    def get_totals(self):
+        """Statistics aggregated by name, independently of the call stack.
+
+        Time of recursive calls is counted only once.
+
+        Returns:
+            dict: Dictionary {name: {'count', 'time', 'counters'}}.
+        """
+        totals = {}
+        for path, node in self._nodes.items():
+            if len(path) == 0:
+                continue
+            name = path[-1]
+            total = totals.setdefault(
+                name, {'count': 0, 'time': 0.0, 'counters': {}})
+            total['count'] += node['count']
+            if name not in path[:-1]:
+                total['time'] += node['time']
+            for key, value in node['counters'].items():
+                total['counters'][key] = total['counters'].get(key, 0) + value
+        return totals
+
+    def print_stats(self, sort_by='time', max_lines=None):
+        """Print statistics aggregated by name.
+
+        Args:
+            sort_by (str, optional): 'time' or 'count'. Defaults to 'time'.
+            max_lines (int, optional): Maximum number of printed lines.
+                If None, all lines are printed. Defaults to None.
+
+        Raises:
+            ValueError: If sort_by is not valid.
+        """
+        if sort_by not in ('time', 'count'):
+            raise ValueError("sort_by must be 'time' or 'count'.")
+
+        totals = self.get_totals()
+        names = sorted(totals, key=lambda n: totals[n][sort_by], reverse=True)
+        if max_lines is not None:
+            names = names[:max_lines]
+
+        fmtstr = '{0:<50s} {1:>10d} {2:>12.4f}  {3:s}'
+        print('{0:<50s} {1:>10s} {2:>12s}  {3:s}'.format(
+            'name', 'count', 'time [s]', 'counters'))
+        for name in names:
+            total = totals[name]
+            counters = ', '.join(
+                '{0:s}={1:g}'.format(k, v)
+                for k, v in sorted(total['counters'].items()))
+            print(fmtstr.format(
+                name, total['count'], total['time'], counters))
+
+    def save_json(self, filename):
+        """Save statistics of each call stack in JSON format.
+
+        Args:
+            filename (str): Path to file.
+
+        Returns:
+            bool: True.
+        """
+        with open(filename, 'w') as f:
+            _json.dump(self.get_stats(), f, indent=1)
+        return True
+
+    def save_folded(self, filename):
+        """Save self times in folded stacks format.
+
+        Each line holds a ';' separated call stack and its self time
+        in microseconds, as expected by flamegraph.pl and speedscope.
+
+        Args:
+            filename (str): Path to file.
+
+        Returns:
+            bool: True.
+        """
+        with open(filename, 'w') as f:
+            for stats in self.get_stats():
+                if not stats['stack']:
+                    continue
+                value = int(round(stats['self_time']*1e6))
+                f.write('{0:s} {1:d}\n'.format(
+                    ';'.join(stats['stack']), value))
+        return True
+
+
+def _is_scalar(value):
+    return not hasattr(value, '__len__')
+
+
+def get_profiler():
+    """Get active profiler.
+
+    Returns:
+        Profiler: Active profiler, None if profiling is disabled.
+    """
+    return _profiler
+
+
+def profile():
+    """Create profiler to be used as a context manager.
+
+    Returns:
+        Profiler: New profiler, started on context entry.
+    """
+    return Profiler()
+
+
+def count(name, value=1):
+    """Add value to counter of the innermost profiled call.
+
+    Does nothing if profiling is disabled.
+
+    Args:
+        name (str): Counter name.
+        value (int or float, optional): Value added. Defaults to 1.
+    """
+    if _profiler is not None:
+        _profiler.count(name, value)
+
+
+def timed(func):
+    """Decorator profiling calls of func, labeled by its qualified name."""
+    name = func.__qualname__
+
+    @_functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        profiler = _profiler
+        if profiler is None:
+            return func(*args, **kwargs)
+        with profiler.section(name):
+            return func(*args, **kwargs)
+
+    return wrapper
+
+
+def _start_from_environment():
+    filename = _os.environ.get('IMAIDS_PROFILE')
+    if not filename:
+        return None
+
+    profiler = Profiler()
+    profiler.start()
+
+    def save():
+        profiler.stop()
+        if filename.endswith('.json'):
+            profiler.save_json(filename)
+        else:
+            profiler.save_folded(filename)
+
+    _atexit.register(save)
+    return profiler
+
+
+_start_from_environment()
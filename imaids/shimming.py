@@ -1,13 +1,39 @@
 
+import hashlib as _hashlib
 import json as _json
+import os as _os
+from concurrent.futures import ProcessPoolExecutor as _ProcessPoolExecutor
+from concurrent.futures import as_completed as _as_completed
 import numpy as _np
-import matplotlib.pyplot as _plt
-import matplotlib.gridspec as _gridspec
-import pandas as _pd
 
 from . import utils as _utils
 from . import fieldsource as _fieldsource
 from . import insertiondevice as _insertiondevice
+from . import profiling as _profiling
+
+
+def _hash_json(value):
+    """SHA1 hex digest of value in (sorted keys) JSON format."""
+    data = _json.dumps(
+        value, sort_keys=True, default=lambda v: _np.asarray(v).tolist())
+    return _hashlib.sha1(data.encode()).hexdigest()
+
+
+def _element_key_to_str(element_key):
+    return '{0:s}:{1:d}'.format(*element_key)
+
+
+def _str_to_element_key(value):
+    cassette, index = value.rsplit(':', 1)
+    return (cassette, int(index))
+
+
+def _check_not_symmetric(model):
+    """Raise ValueError if model was built using midplane symmetry."""
+    if getattr(model, 'symmetric', False):
+        raise ValueError(
+            'Shimming requires a model built without midplane symmetry '
+            '(see InsertionDeviceModel.disable_midplane_symmetry).')
 
 
 class UndulatorShimming():
@@ -18,7 +44,7 @@ class UndulatorShimming():
             energy=3.0, rkstep=0.5, xpos=0.0, ypos=0.0,
             zmin_pe=None, zmax_pe=None,
             include_pe=False, field_comp=None,
-            solved_shim=True, solved_matrix=False):
+            solved_shim=True, solved_matrix=False, field_limits=None):
         """Class used for calculating insertion devices shimming.
 
         Args:
@@ -125,6 +151,10 @@ class UndulatorShimming():
                 solved (Radia solve method is run) for the insertion device
                 before calculating each shim when determining the response
                 matrix. Otherwise, solve method is not run. Defaults to False.
+            field_limits (list or str, optional): Limits of the region with
+                non negligible field ([zmin, zmax] in mm, or 'auto'), outside
+                of which trajectories are propagated analytically. See
+                FieldSource.calc_trajectory. Defaults to None.
 
         Raises:
             ValueError: If block_type is not allowed.
@@ -170,6 +200,7 @@ class UndulatorShimming():
         self._field_comp = field_comp
         self._solved_shim = solved_shim
         self._solved_matrix = solved_matrix
+        self._field_limits = field_limits
 
     @property
     def zmin(self):
@@ -199,9 +230,19 @@ class UndulatorShimming():
 
     @property
     def block_mask(self):
-        """"""
+        """Dictionary of masks specifying which non-termination blocks of
+        each cassette are movable (None for all blocks).
+        """
         return self._block_mask
 
+    @block_mask.setter
+    def block_mask(self, value):
+        if type(value) in [list, _np.ndarray, type(None)]:
+            value = {cassette:value for cassette in self.cassettes}
+        if set(value.keys()) != set(self.cassettes):
+            raise ValueError('Block mask dict does not match cassettes list')
+        self._block_mask = value
+
     @property
     def segments_type(self):
         """Defines how field zeros are used to obtain segments limits."""
@@ -266,6 +307,24 @@ class UndulatorShimming():
         """
         return self._solved_matrix
 
+    @property
+    def field_limits(self):
+        """Limits of the region with non negligible field used in
+        trajectory calculations ([zmin, zmax] in mm, 'auto' or None).
+        """
+        return self._field_limits
+
+    @property
+    def response_parameters(self):
+        """Dictionary of the parameters on which response matrix columns
+        depend (all parameters except block_mask, solved_shim)."""
+        return {
+            name: getattr(self, name) for name in [
+                'zmin', 'zmax', 'znpts', 'cassettes', 'block_type',
+                'segments_type', 'energy', 'rkstep', 'xpos', 'ypos',
+                'zmin_pe', 'zmax_pe', 'include_pe', 'field_comp',
+                'solved_matrix', 'field_limits']}
+
     @staticmethod
     def get_rounded_shims(shims, possible_shims):
         """Returns list of feasible shims which best approximate input shims.
@@ -348,6 +407,74 @@ class UndulatorShimming():
         minv = vt.T*svinv @ u.T
         return minv
 
+    @staticmethod
+    def update_svd_remove_columns(u, sv, vt, keep):
+        """Update SVD after removing columns from the decomposed matrix.
+
+        The remaining columns are in the span of u, so only the small
+        matrix diag(sv) @ vt[:, keep] is decomposed.
+
+        Args:
+            u (numpy.ndarray, M x R): Left matrix from SVD.
+            sv (numpy.ndarray, R): Singular values from SVD.
+            vt (numpy.ndarray, R x N): Right matrix from SVD.
+            keep (list): Indices (or boolean mask) of the kept columns,
+                in the order of the new matrix columns.
+
+        Returns:
+            numpy.ndarray, M x R': Updated left matrix.
+            numpy.ndarray, R': Updated singular values.
+            numpy.ndarray, R' x N': Updated right matrix.
+        """
+        small = sv[:, None]*vt[:, keep]
+        ub, svb, vtb = _np.linalg.svd(small, full_matrices=False)
+        rank = min(u.shape[0], small.shape[1])
+        return (u @ ub)[:, :rank], svb[:rank], vtb[:rank]
+
+    @staticmethod
+    def update_svd_append_column(u, sv, vt, column):
+        """Update SVD after appending a column to the decomposed matrix.
+
+        Rank-one update of a thin SVD (Brand, Linear Algebra and its
+        Applications 415, 2006).
+
+        Args:
+            u (numpy.ndarray, M x R): Left matrix from SVD.
+            sv (numpy.ndarray, R): Singular values from SVD.
+            vt (numpy.ndarray, R x N): Right matrix from SVD.
+            column (numpy.ndarray, M): Appended column.
+
+        Returns:
+            numpy.ndarray, M x R': Updated left matrix.
+            numpy.ndarray, R': Updated singular values.
+            numpy.ndarray, R' x (N+1): Updated right matrix.
+        """
+        column = _np.asarray(column, dtype=float)
+        m = u.T @ column
+        p = column - u @ m
+        ra = _np.linalg.norm(p)
+        if ra > 1e-12*max(_np.linalg.norm(column), 1e-300):
+            pn = p/ra
+        else:
+            pn = _np.zeros_like(p)
+            ra = 0
+
+        nsv = len(sv)
+        k = _np.zeros((nsv + 1, nsv + 1))
+        k[:nsv, :nsv] = _np.diag(sv)
+        k[:nsv, nsv] = m
+        k[nsv, nsv] = ra
+        uk, svk, vtk = _np.linalg.svd(k)
+
+        u_new = _np.hstack([u, pn[:, None]]) @ uk
+        vt_ext = _np.zeros((nsv + 1, vt.shape[1] + 1))
+        vt_ext[:nsv, :-1] = vt
+        vt_ext[nsv, -1] = 1
+        vt_new = vtk @ vt_ext
+
+        rank = min(u.shape[0], vt.shape[1] + 1)
+        return u_new[:, :rank], svk[:rank], vt_new[:rank]
+
     @staticmethod
     def get_weights_matrix(weights):
         """From a weights vector, get a diagonal matrix.
@@ -404,57 +531,81 @@ class UndulatorShimming():
                 list, (K+1): List of indices for trajectory points at the
                     start of K segments and at the end of the last segment.
 
+        Raises:
+            ValueError: If the last segs value is beyond the trajectory end.
         """
+        trajectory = _np.asarray(trajectory)
         trajx = trajectory[:, 0]
         trajy = trajectory[:, 1]
         trajz = trajectory[:, 2]
 
-        seg_start = []
-        seg_end = []
-        poly_x = []
-        poly_y = []
-
-        nsegs = len(segs)
-
-        # For each segs value, find lower i index for which trajz[i] >= value.
-        index_list = []
-        for pos in segs:
-            idx = _np.where(trajz >= pos)[0]
-            index_list.append(idx[0])
+        # For each segs value, find lower i index for which trajz[i] >= value
+        # (trajectory z coordinates are increasing).
+        index_list = _np.searchsorted(trajz, segs, side='left')
+        if _np.any(index_list >= len(trajz)):
+            raise ValueError('Segment limits beyond trajectory end.')
 
         # Index for ending last segment must be additionally defined.
-        last_index = _np.where(trajz >= segs[-1] + max_size)[0]
-        if len(last_index) == 0:
-            index_list.append(len(trajz)-1)
+        last_index = _np.searchsorted(trajz, segs[-1] + max_size, side='left')
+        last_index = min(last_index, len(trajz) - 1)
+        index_list = list(index_list) + [last_index]
+
+        # Segments are defined between consecutive indices in index_list.
+        # They stop at the first empty segment.
+        initial = _np.array(index_list[:-1])
+        final = _np.array(index_list[1:])
+        empty = _np.nonzero(final <= initial)[0]
+        nsegs = empty[0] if len(empty) > 0 else len(initial)
+        initial = initial[:nsegs]
+        final = final[:nsegs]
+        npts = final - initial
+
+        if nsegs == 0:
+            seg_start = _np.array([])
+            seg_end = _np.array([])
+            poly_x = _np.array([])
+            poly_y = _np.array([])
         else:
-            index_list.append(last_index[0])
-
-        # Perform a linear fit at each trajectory segment defined between
-        # consecutive indices in index_list.
-        for i in range(nsegs):
-            initial = index_list[i]
-            final = index_list[i+1]
-
-            tx = trajx[initial:final]
-            ty = trajy[initial:final]
-            tz = trajz[initial:final]
-
-            if len(tx) == 0:
-                break
-
-            seg_start.append([tx[0], ty[0], tz[0]])
-            seg_end.append([tx[-1], ty[-1], tz[-1]])
-
-            xcoefs = _np.polynomial.polynomial.polyfit(tz, tx, 1)
-            poly_x.append(xcoefs)
-
-            ycoefs = _np.polynomial.polynomial.polyfit(tz, ty, 1)
-            poly_y.append(ycoefs)
-
-        seg_start = _np.array(seg_start)
-        seg_end = _np.array(seg_end)
-        poly_x = _np.array(poly_x)
-        poly_y = _np.array(poly_y)
+            seg_start = trajectory[initial, :3]
+            seg_end = trajectory[final - 1, :3]
+
+            # Linear fits of all segments from segmented sums (segments are
+            # contiguous). Positions are taken relative to the segment start
+            # to avoid loss of precision.
+            sl = slice(initial[0], final[-1])
+            seg_id = _np.repeat(_np.arange(nsegs), npts)
+            tz = trajz[sl] - trajz[initial][seg_id]
+            tx = trajx[sl]
+            ty = trajy[sl]
+
+            def segsum(values):
+                return _np.bincount(seg_id, weights=values, minlength=nsegs)
+
+            sz = segsum(tz)
+            szz = segsum(tz*tz)
+            sx = segsum(tx)
+            sy = segsum(ty)
+            szx = segsum(tz*tx)
+            szy = segsum(tz*ty)
+
+            den = npts*szz - sz*sz
+            valid = den > 0
+            den[~valid] = 1
+            bx = (npts*szx - sz*sx)/den
+            by = (npts*szy - sz*sy)/den
+            z0 = trajz[initial]
+            ax = (sx - bx*sz)/npts - bx*z0
+            ay = (sy - by*sz)/npts - by*z0
+            poly_x = _np.transpose([ax, bx])
+            poly_y = _np.transpose([ay, by])
+
+            # Degenerate segments (single point) are fitted as before.
+            for i in _np.nonzero(~valid)[0]:
+                ssl = slice(initial[i], final[i])
+                poly_x[i] = _np.polynomial.polynomial.polyfit(
+                    trajz[ssl], trajx[ssl], 1)
+                poly_y[i] = _np.polynomial.polynomial.polyfit(
+                    trajz[ssl], trajy[ssl], 1)
 
         if full_output:
             return poly_x, poly_y, seg_start, seg_end, index_list
@@ -607,6 +758,7 @@ class UndulatorShimming():
             results = _json.load(f)
         return results['fres']
 
+    @_profiling.timed
     def _calc_traj(self, obj, xl, yl):
         """Calculate trajectory of electron with initial transversal velocity
             (xl,yl) passing through a field source object.
@@ -635,10 +787,11 @@ class UndulatorShimming():
         traj = obj.calc_trajectory(
             self.energy,
             [self.xpos, self.ypos, self.zmin, xl, yl, zl],
-            self.zmax, self.rkstep)
+            self.zmax, self.rkstep, field_limits=self.field_limits)
         return traj
 
-    def _calc_phase_error(self, obj, traj):
+    @_profiling.timed
+    def _calc_phase_error(self, obj, traj, amplitudes=None):
         """Calculate the phase error of a trajectory in relation to a
             sinusoidal field object.
 
@@ -656,18 +809,25 @@ class UndulatorShimming():
             traj (list): Electron trajectory as [x, y, z, x', y', z'] nested
                 list of x,y,z positions in mm and x',y',z' velocieites in rad
                 (dimensionless).
+            amplitudes (tuple, optional): Field amplitudes (bx_amp, by_amp),
+                in T. If None, they are calculated by the object
+                calc_field_amplitude method. Defaults to None.
         Returns:
             list: List of poles z positons (in mm).
             numpy.ndarray: List of phase erros at poles (in rad).
             numpy.float64: Phase error rms (in rad).
         """
-        bx_amp, by_amp, _, _ = obj.calc_field_amplitude()
+        if amplitudes is None:
+            bx_amp, by_amp, _, _ = obj.calc_field_amplitude()
+        else:
+            bx_amp, by_amp = amplitudes
         zpe, pe, pe_rms = obj.calc_phase_error(
             self.energy, traj, bx_amp, by_amp,
             zmin=self.zmin_pe, zmax=self.zmax_pe,
             field_comp=self.field_comp)
         return zpe, pe, pe_rms
 
+    @_profiling.timed
     def _calc_field_integrals(self, obj):
         """Calculate magnetic field integrals from field source object.
 
@@ -750,6 +910,7 @@ class UndulatorShimming():
 
         return fres
 
+    @_profiling.timed
     def calc_segments(self, obj, filename=None):
         """Generate longitudinal positions list for defining segment limits
             (see fit_trajectory_segments help for how such list might be used).
@@ -815,6 +976,7 @@ class UndulatorShimming():
 
         return segs
 
+    @_profiling.timed
     def calc_slope_and_phase_error(self, obj, segs, xl, yl, filename=None):
         """Returns slopes of linear fits performed on segments of an averaged
         trajectory (1 period moving average).
@@ -967,12 +1129,13 @@ class UndulatorShimming():
             cas = model.cassettes[cassette]
             cas_block_type = self.block_type[cassette]
             block_mask = self.block_mask[cassette]
-            mag = _np.array(cas.magnetization_list)
-            blocks = _np.array(cas.blocks)
+            mag = cas.block_table.magnetization
+            blocks = _np.empty(len(cas.blocks), dtype=object)
+            blocks[:] = cas.blocks
 
             # Eliminate termination blocks.
-            nr_start = len(cas.start_blocks_length)
-            nr_end = len(cas.end_blocks_length)
+            nr_start = cas.nr_start_blocks
+            nr_end = cas.nr_end_blocks
             if nr_end == 0:
                 regular_mag = mag[nr_start:]
                 regular_blocks = blocks[nr_start:]
@@ -1044,8 +1207,79 @@ class UndulatorShimming():
 
         return shim_elements
 
+    def get_shimming_keys(self, model):
+        """Get keys identifying the shimming elements of a model.
+
+        Keys do not depend on the block_mask attribute, so that the same
+        shimming element has the same key for any mask.
+
+        Args:
+            model (InsertionDeviceModel): Device model containing the blocks.
+
+        Returns:
+            list: List of (cassette, block index) tuples, one for each
+                shimming element (see get_shimming_blocks), in response
+                matrix column order. Block index is the index of the element
+                first block in the cassette blocks list.
+        """
+        keys = []
+        for cassette in self.cassettes:
+            cas_blocks = model.cassettes[cassette].blocks
+            indices = {id(block): idx for idx, block in enumerate(cas_blocks)}
+            elements = self.get_shimming_blocks(model, cassette)
+            keys.extend((cassette, indices[id(elem[0])]) for elem in elements)
+        return keys
+
+    def calc_response_column(
+            self, model, model_segs, element, reference, shim=0.1):
+        """Calculate derivatives of the optimizable parameters with respect
+        to a single shim (one column of the response matrix).
+
+        Args:
+            model (InsertionDeviceModel): Device model containing the blocks.
+            model_segs (list, K): Longitudinal positions of segment limits.
+            element (list): Blocks displaced together by the shim (one row
+                of the get_shimming_blocks array).
+            reference (tuple): Slopes and phase errors (sx, sy, pe) of the
+                non-shimmed model, as returned by calc_slope_and_phase_error.
+            shim (float, optional): Displacement (shim) value applied to
+                blocks. In mm. Defaults to 0.1.
+
+        Raises:
+            ValueError: If model was built using midplane symmetry.
+
+        Returns:
+            numpy.ndarray, K: x slopes derivatives.
+            numpy.ndarray, K: y slopes derivatives.
+            numpy.ndarray: Phase error derivatives, None if include_pe
+                is False.
+        """
+        _check_not_symmetric(model)
+        sx0, sy0, pe0 = reference
+
+        for block in element:
+            block.shift([0, shim, 0])
+
+        if self.solved_matrix:
+            model.solve()
+        sx, sy, pe = self.calc_slope_and_phase_error(
+            model, model_segs, 0, 0)
+
+        for block in element:
+            block.shift([0, -shim, 0])
+
+        dpx = (sx - sx0)/shim
+        dpy = (sy - sy0)/shim
+        if self.include_pe:
+            dpe = (pe - pe0)/shim
+        else:
+            dpe = None
+
+        return dpx, dpy, dpe
+
+    @_profiling.timed
     def calc_response_matrix(
-            self, model, model_segs, filename=None, shim=0.1):
+            self, model, model_segs, filename=None, shim=0.1, store=None):
         """Calculate response matrix associated to the effect of individual
         shims to a set of optimizable parameters, including segment slopes,
         and, possibly (if include_pe==True), phase errors.
@@ -1100,14 +1334,37 @@ class UndulatorShimming():
                 Defaults to None.
             shim (float, optional): Displacement (shim) value applied to blocks
                 for determining the response matrix. In mm. Defaults to 0.1.
+            store (ResponseMatrixStore, optional): If provided, columns
+                calculated before with the same inputs (model state,
+                cassette positions, segments, shim and shimming parameters)
+                are loaded from the store, and new columns are saved to it
+                in batches (see ResponseMatrixStore.batch_size) as they are
+                calculated. Defaults to None.
+
+        Raises:
+            ValueError: If model was built using midplane symmetry.
 
         Returns:
             numpy.ndarray: Response matrix, containing one line per optimized
                 parameter (slopes and, possibly, phase errors) and one column
                 per shim.
         """
+        _check_not_symmetric(model)
         response_matrix = None
 
+        if store is not None:
+            key = store.create(
+                store.get_inputs(self, model, model_segs, shim=shim))
+            element_keys = self.get_shimming_keys(model)
+            stored_matrix, missing = store.load(key, element_keys)
+            if len(missing) == 0 and filename is None:
+                return stored_matrix
+            missing = set(missing)
+        else:
+            key = None
+            element_keys = None
+            missing = None
+
         sx0, sy0, pe0 = self.calc_slope_and_phase_error(
             model, model_segs, 0, 0)
 
@@ -1125,26 +1382,32 @@ class UndulatorShimming():
         mpe = []
         blocks = self.get_shimming_blocks(model, 'all')
 
+        nsegs = len(sx0)
+        pending_keys = []
+        pending_columns = []
         for idx0 in range(len(blocks)):
-            for idx1 in range(len(blocks[idx0])):
-                blocks[idx0, idx1].shift([0, shim, 0])
-
-            if self.solved_matrix:
-                model.solve()
-            sx, sy, pe = self.calc_slope_and_phase_error(
-                model, model_segs, 0, 0)
-
-            for idx1 in range(len(blocks[idx0])):
-                blocks[idx0, idx1].shift([0, -shim, 0])
+            if store is None or element_keys[idx0] in missing:
+                dpx, dpy, dpe = self.calc_response_column(
+                    model, model_segs, blocks[idx0], (sx0, sy0, pe0),
+                    shim=shim)
+                if store is not None:
+                    column = [dpx, dpy, dpe] if self.include_pe else [
+                        dpx, dpy]
+                    pending_keys.append(element_keys[idx0])
+                    pending_columns.append(_np.concatenate(column))
+                    if len(pending_keys) >= store.batch_size:
+                        store.save_columns(key, pending_keys, pending_columns)
+                        pending_keys = []
+                        pending_columns = []
+            else:
+                column = stored_matrix[:, idx0]
+                dpx = column[:nsegs]
+                dpy = column[nsegs:2*nsegs]
+                dpe = column[2*nsegs:] if self.include_pe else None
 
-            dpx = (sx - sx0)/shim
             mx.append(dpx)
-
-            dpy = (sy - sy0)/shim
             my.append(dpy)
-
             if self.include_pe:
-                dpe = (pe - pe0)/shim
                 mpe.append(dpe)
 
             if filename is not None:
@@ -1161,6 +1424,9 @@ class UndulatorShimming():
                         strpe = '\t'.join('{0:g}'.format(v) for v in dpe)
                         fpe.write(strpe + '\n')
 
+        if store is not None:
+            store.save_columns(key, pending_keys, pending_columns)
+
         mx = _np.array(mx)
         my = _np.array(my)
         mpe = _np.array(mpe)
@@ -1175,6 +1441,7 @@ class UndulatorShimming():
 
         return response_matrix
 
+    @_profiling.timed
     def calc_error(
             self, model, meas, model_segs, meas_segs, filename=None):
         """Calculate difference (errors) between optimizable parameters (slopes
@@ -1227,6 +1494,7 @@ class UndulatorShimming():
 
         return error
 
+    @_profiling.timed
     def calc_shims(
             self, response_matrix, error, nsv=None, ws=None, filename=None):
         """From a response matrix, calculate shims that whould result in a
@@ -1268,6 +1536,137 @@ class UndulatorShimming():
 
         return shims
 
+    @_profiling.timed
+    def calc_discrete_shims(
+            self, response_matrix, error, possible_shims, nsv=None, ws=None,
+            limits=None, svd=None, max_iter=None, full_output=False,
+            filename=None):
+        """From a response matrix, calculate feasible shims that best
+        approximate a given errors array.
+
+        Shims are restricted to the available values (possible_shims) and
+        to the travel limits of each shim. The continuous solution (see
+        calc_shims) is clipped to the limits and rounded, and then shims are
+        changed one at a time, choosing at each iteration the feasible change
+        which most reduces the weighted residual, until no change improves it.
+
+        The residual is evaluated in the space of the nsv considered singular
+        values, using the SVD of the weighted response matrix (which may be
+        given to avoid recalculating it), so that each iteration costs
+        O(N x len(possible_shims)).
+
+        Args:
+            response_matrix (numpy.ndarray, MxN): Response matrix for M
+                optimizable parameters by N shims.
+            error (numpy.ndarray, M): Error array associated to optimizable
+                parameters for shimming.
+            possible_shims (list): List of available shims (in mm).
+            nsv (int, optional): Number of singular values to be considered.
+                See help in calc_inv_matrix method for details.
+                Defaults to None.
+            ws (list, M, optional): Weights for optmizable parameters.
+                See help in calc_shims method for details. Defaults to None.
+            limits (list, optional): Shim limits (in mm), as a [min, max]
+                pair for all shims or a Nx2 list of pairs, one for each shim.
+                If None, shims are only limited by possible_shims.
+                Defaults to None.
+            svd (tuple, optional): (u, sv, vt) SVD of the weighted response
+                matrix (as returned by calc_svd). If None, it is calculated.
+                Defaults to None.
+            max_iter (int, optional): Maximum number of iterations. If None,
+                10 times the number of shims. Defaults to None.
+            full_output (bool, optional): If True, a dictionary with
+                additional information is also returned. Defaults to False.
+            filename (str, optional): If provided, this will be the name
+                of a file in which the shims will also be written.
+                Defaults to None.
+                    File format:
+                        One line for each shim.
+
+        Raises:
+            ValueError: If no possible shim lies within the limits of a shim.
+
+        Returns:
+            numpy.ndarray, N: Resulting feasible shims.
+            dict: If full_output is True, dictionary with keys 'continuous'
+                (continuous shims, numpy.ndarray), 'residual_continuous',
+                'residual_rounded' and 'residual' (weighted residual norms of
+                continuous, rounded and resulting shims in the considered
+                singular values space) and 'nr_iter' (number of iterations).
+        """
+        response_matrix = _np.asarray(response_matrix)
+        nshims = response_matrix.shape[1]
+        if ws is None:
+            ws = [1.0]*response_matrix.shape[0]
+        w = self.get_weights_matrix(ws)
+
+        if svd is None:
+            svd = self.calc_svd(w @ response_matrix)
+        u, sv, vt = svd
+        if nsv is None:
+            nsv = len(sv)
+        minv = self.calc_inv_matrix(u, sv, vt, nsv=nsv)
+        continuous = minv @ (w @ error)
+
+        # Reduced problem: minimize |a @ shims - b|.
+        a = sv[:nsv, None]*vt[:nsv]
+        b = u[:, :nsv].T @ (w @ error)
+
+        possible_shims = _np.unique(_np.asarray(possible_shims, dtype=float))
+        if limits is None:
+            limits = [possible_shims[0], possible_shims[-1]]
+        limits = _np.broadcast_to(
+            _np.asarray(limits, dtype=float), (nshims, 2))
+        feasible = (possible_shims[None, :] >= limits[:, :1] - 1e-12) & (
+            possible_shims[None, :] <= limits[:, 1:] + 1e-12)
+        if not _np.all(_np.any(feasible, axis=1)):
+            raise ValueError('No possible shim within limits of some shims.')
+
+        # Clip continuous solution to limits and round to nearest feasible.
+        clipped = _np.clip(continuous, limits[:, 0], limits[:, 1])
+        dist = _np.abs(possible_shims[None, :] - clipped[:, None])
+        dist[~feasible] = _np.inf
+        shims = possible_shims[_np.argmin(dist, axis=1)]
+        rounded = shims.copy()
+
+        residual = a @ shims - b
+        grad = a.T @ residual
+        gram = a.T @ a
+        diag = _np.diag(gram)
+
+        if max_iter is None:
+            max_iter = 10*nshims
+
+        nr_iter = 0
+        while nr_iter < max_iter:
+            # Cost change for each shim set to each possible value.
+            delta = possible_shims[None, :] - shims[:, None]
+            change = 2*delta*grad[:, None] + delta**2*diag[:, None]
+            change[~feasible] = _np.inf
+            idx, jdx = _np.unravel_index(_np.argmin(change), change.shape)
+            tol = 1e-12*_np.dot(residual, residual)
+            if change[idx, jdx] >= -tol:
+                break
+            step = delta[idx, jdx]
+            shims[idx] += step
+            residual += step*a[:, idx]
+            grad += step*gram[:, idx]
+            nr_iter += 1
+
+        if filename is not None:
+            _np.savetxt(filename, shims)
+
+        if full_output:
+            info = {
+                'continuous': continuous,
+                'residual_continuous': _np.linalg.norm(a @ continuous - b),
+                'residual_rounded': _np.linalg.norm(a @ rounded - b),
+                'residual': _np.linalg.norm(residual),
+                'nr_iter': nr_iter,
+            }
+            return shims, info
+        return shims
+
     def save_shims_to_xls(self, model, shims, filename):
         """Export shim values to excel format.
 
@@ -1281,11 +1680,120 @@ class UndulatorShimming():
                         Two columns, representing block names and respective
                         shims as two columns.
         """
+        import pandas as _pd
+
         names = self.get_block_names(model, flatten=True)
         df = _pd.DataFrame({'blocks':names, 'shims':shims})
         df.to_excel(filename)
 
-    def calc_shim_signature(self, model, shims, filename=None):
+    def _calc_signature_basis_chunk(self, model, indices, shim, field0):
+        zpos = _np.linspace(self.zmin, self.zmax, self.znpts)
+        blocks = self.get_shimming_blocks(model, 'all')
+        basis = []
+        for idx0 in indices:
+            for block in blocks[idx0]:
+                block.shift([0, shim, 0])
+            if self.solved_shim:
+                model.solve()
+            field = model.get_field(z=zpos)
+            for block in blocks[idx0]:
+                block.shift([0, -shim, 0])
+            basis.append((field - field0)/shim)
+        return _np.array(basis).reshape(len(indices), self.znpts, 3)
+
+    @_profiling.timed
+    def calc_signature_basis(
+            self, model, shim=0.1, nproc=None, filename=None):
+        """Calculate the field signature of each shimming element per unit
+        shim (signature basis).
+
+        The signature of any shims vector is approximately the linear
+        combination of the basis elements weighted by the shims (see
+        calc_shim_signature), which avoids displacing blocks and solving
+        the model for each candidate shims vector.
+
+        Args:
+            model (InsertionDeviceModel): Model used for calculating fields.
+            shim (float, optional): Displacement (shim) value applied to
+                blocks. In mm. Defaults to 0.1.
+            nproc (int, optional): Number of processes for parallel
+                computation, each one calculating a subset of the elements.
+                Must be >=1. If None, elements are calculated serially.
+                Defaults to None.
+            filename (str, optional): If provided, the basis is also saved
+                to a file with this name in numpy binary format (.npy), which
+                may be read with read_signature_basis. Defaults to None.
+
+        Raises:
+            ValueError: If provided, number of processes must be >=1.
+            ValueError: If model was built using midplane symmetry.
+
+        Returns:
+            numpy.ndarray, NxPx3: Field difference (in T/mm) for each of the
+                N shimming elements at P = znpts positions along the
+                shimming line (x = xpos, y = ypos, z from zmin to zmax).
+        """
+        _check_not_symmetric(model)
+        zpos = _np.linspace(self.zmin, self.zmax, self.znpts)
+        field0 = model.get_field(z=zpos)
+        nelements = len(self.get_shimming_blocks(model, 'all'))
+
+        if nproc is not None:
+            nproc = int(nproc)
+            if nproc < 1:
+                raise ValueError('Number or processes must be >=1.')
+            chunks = [
+                c for c in _np.array_split(_np.arange(nelements), nproc)
+                if len(c) > 0]
+            with _ProcessPoolExecutor(max_workers=nproc) as executor:
+                basis_gen = executor.map(
+                    self._calc_signature_basis_chunk, [model]*len(chunks),
+                    chunks, [shim]*len(chunks), [field0]*len(chunks))
+                basis = _np.concatenate(list(basis_gen), axis=0)
+        else:
+            basis = self._calc_signature_basis_chunk(
+                model, range(nelements), shim, field0)
+            if self.solved_shim:
+                model.solve()
+
+        if filename is not None:
+            _np.save(filename, basis)
+
+        return basis
+
+    @staticmethod
+    def read_signature_basis(filename):
+        """Read signature basis from file.
+
+        Args:
+            filename (str): Name of file saved by calc_signature_basis.
+
+        Returns:
+            numpy.ndarray: Signature basis (read-only, memory mapped).
+        """
+        return _np.load(filename, mmap_mode='r')
+
+    def _get_signature_data(self, model, dfield, filename=None):
+        zpos = _np.linspace(self.zmin, self.zmax, self.znpts)
+        x = [self.xpos]*self.znpts
+        y = [self.ypos]*self.znpts
+        raw_data = _np.transpose(
+            [x, y, zpos, dfield[:, 0], dfield[:, 1], dfield[:, 2]])
+
+        shim_signature = _insertiondevice.InsertionDeviceData(
+            nr_periods=model.nr_periods,
+            period_length=model.period_length,
+            gap=model.gap,
+            raw_data=raw_data)
+
+        if filename is not None:
+            shim_signature.save_fieldmap(
+                filename, self.xpos, self.ypos, zpos)
+
+        return shim_signature
+
+    @_profiling.timed
+    def calc_shim_signature(self, model, shims, filename=None, basis=None):
         """Calculate the field difference between the non-shimmed and
         the shimmed insertion device (shimming signature).
 
@@ -1304,6 +1812,17 @@ class UndulatorShimming():
                         string '--------'. After header each line corresponds
                         to a (x,y,z) point, and has the format "x y z bx by bz"
                         containing positions in mm and field components in T.
+            basis (numpy.ndarray, optional): Signature basis calculated by
+                calc_signature_basis for the same model and elements. If
+                provided, the signature is the linear combination of the
+                basis elements, and blocks are not displaced. The deviation
+                from the calculation without basis may be checked with
+                verify_shim_signature. Defaults to None.
+
+        Raises:
+            ValueError: If the number of shims does not match the basis.
+            ValueError: If basis is None and model was built using midplane
+                symmetry.
 
         Returns:
             InsertionDeviceData: Data object with the same number of periods,
@@ -1312,6 +1831,14 @@ class UndulatorShimming():
                 shimmemd and unshimmed fields) in the format of raw_data.
                 (List of x, y, z positions and mm and bx, by, bz fields in T)
         """
+        if basis is not None:
+            if len(shims) != len(basis):
+                raise ValueError(
+                    'Number of shims does not match signature basis.')
+            dfield = _np.tensordot(_np.asarray(shims), basis, axes=1)
+            return self._get_signature_data(model, dfield, filename=filename)
+
+        _check_not_symmetric(model)
         zpos = _np.linspace(self.zmin, self.zmax, self.znpts)
         field0 = model.get_field(z=zpos)
 
@@ -1340,22 +1867,26 @@ class UndulatorShimming():
         if self.solved_shim:
             model.solve()
 
-        x = [self.xpos]*self.znpts
-        y = [self.ypos]*self.znpts
-        raw_data = _np.transpose(
-            [x, y, zpos, dfield[:, 0], dfield[:, 1], dfield[:, 2]])
+        return self._get_signature_data(model, dfield, filename=filename)
 
-        shim_signature = _insertiondevice.InsertionDeviceData(
-            nr_periods=model.nr_periods,
-            period_length=model.period_length,
-            gap=model.gap,
-            raw_data=raw_data)
+    def verify_shim_signature(self, model, shims, basis):
+        """Compare the shimming signature obtained from the signature basis
+        with the signature obtained by displacing the blocks.
 
-        if filename is not None:
-            shim_signature.save_fieldmap(
-                filename, self.xpos, self.ypos, zpos)
+        Args:
+            model (InsertionDeviceModel): Model used for calculating fields.
+            shims (numpy.ndarray): List of shims.
+            basis (numpy.ndarray): Signature basis (see calc_signature_basis).
 
-        return shim_signature
+        Returns:
+            InsertionDeviceData: Signature obtained by displacing the blocks.
+            float: Maximum absolute field deviation between signatures (in T).
+            float: RMS field deviation between signatures (in T).
+        """
+        linear = self.calc_shim_signature(model, shims, basis=basis)
+        signature = self.calc_shim_signature(model, shims)
+        dev = signature.raw_data[:, 3:] - linear.raw_data[:, 3:]
+        return signature, _np.max(_np.abs(dev)), _np.sqrt(_np.mean(dev**2))
 
     def calc_shimmed_meas(self, meas, shim_signature, filename=None):
         """From a given shimming signature object (InsertionDeviceData) and an
@@ -1407,7 +1938,62 @@ class UndulatorShimming():
 
         return shimmed_meas
 
-    def calc_results(self, objs, labels, xls=None, yls=None, filename=None):
+    def _calc_object_results(self, obj, xl, yl, share_field=False):
+        """Calculate results of a single object (see calc_results)."""
+        if share_field:
+            zpos = _np.linspace(self.zmin, self.zmax, self.znpts)
+            field = obj.get_field(x=self.xpos, y=self.ypos, z=zpos)
+            ib, iib = obj.calc_field_integrals(z_list=zpos, field_list=field)
+            bx_amp, by_amp, _, _ = obj.calc_field_amplitude(
+                z_list=zpos, field_list=field)
+            amplitudes = (bx_amp, by_amp)
+            if isinstance(obj, _fieldsource.FieldData):
+                traj = self._calc_traj(obj, xl, yl)
+            else:
+                sampled = self._get_signature_data(obj, field)
+                traj = self._calc_traj(sampled, xl, yl)
+        else:
+            traj = self._calc_traj(obj, xl, yl)
+            ib, iib = self._calc_field_integrals(obj)
+            amplitudes = None
+
+        avgtraj = obj.calc_trajectory_avg_over_period(traj)
+        zpe, pe, pe_rms = self._calc_phase_error(
+            obj, traj, amplitudes=amplitudes)
+        r = {}
+        r['trajx'] = list(traj[:, 0]*1000)
+        r['trajy'] = list(traj[:, 1]*1000)
+        r['trajz'] = list(traj[:, 2])
+        r['trajxl'] = list(traj[:, 3])
+        r['trajyl'] = list(traj[:, 4])
+        r['trajzl'] = list(traj[:, 5])
+        r['avgtrajx'] = list(avgtraj[:, 0]*1000)
+        r['avgtrajy'] = list(avgtraj[:, 1]*1000)
+        r['avgtrajz'] = list(avgtraj[:, 2])
+        r['zpe'] = list(zpe)
+        r['pe'] = list(pe*180/_np.pi)
+        r['perms'] = pe_rms*180/_np.pi
+        r['ibx'] = list(ib[:, 0])
+        r['iby'] = list(ib[:, 1])
+        r['ibz'] = list(ib[:, 2])
+        r['iibx'] = list(iib[:, 0])
+        r['iiby'] = list(iib[:, 1])
+        r['iibz'] = list(iib[:, 2])
+        return r
+
+    @staticmethod
+    def _save_results(results, labels, filename):
+        ordered = {label: results[label] for label in labels
+                   if label in results}
+        tmp_filename = filename + '.tmp'
+        with open(tmp_filename, 'w') as f:
+            _json.dump(ordered, f)
+        _os.replace(tmp_filename, filename)
+
+    @_profiling.timed
+    def calc_results(
+            self, objs, labels, xls=None, yls=None, filename=None,
+            nproc=None, share_field=False):
         """Receives a list of objects, calculates various for them (see Returns
             section), and compiles the results in a nested dictionary.
             Dictionary entries are keyed by the labels argument. Entries are
@@ -1428,11 +2014,27 @@ class UndulatorShimming():
                 calculating trajectories for each object. If None, will be
                 set to [0]*len(objs). Defaults to None.
             filename (str, optional): If provided, results dictionary will
-                be saved in a file with this name in json format.
+                be saved in a file with this name in json format. The file
+                is updated as the results of each object are completed.
                 File format:
                     JSON format containing dictionary of object dictionaries
                     with keys given by labels. Data in each dictionary is
                     described in Returns section bellow.
+            nproc (int, optional): Number of processes for parallel
+                computation, each one calculating the results of an object.
+                Must be >=1. If None, objects are calculated serially.
+                Defaults to None.
+            share_field (bool, optional): If True, the field of each object
+                is sampled once along the shimming line (zmin, zmax, znpts)
+                and the samples are used for field integrals, field
+                amplitudes and, for objects which are not field data
+                (e.g. models), for the trajectory, which is then calculated
+                from the on-axis interpolated samples. If False, each
+                calculation evaluates the field independently.
+                Defaults to False.
+
+        Raises:
+            ValueError: If provided, number of processes must be >=1.
 
         Returns:
             dict: Nested dictionary containing one dictionary per object,
@@ -1444,6 +2046,10 @@ class UndulatorShimming():
                     'trajxl' - x velocity (list, in rad or dimensionless)
                     'trajyl' - y velocity (list, in rad or dimensionless)
                     'trajzl' - z velocity (list, in rad or dimensionless)
+                Trajectory averaged over period:
+                    'avgtrajx' - x position (list, in micron)
+                    'avgtrajy' - y position (list, in micron)
+                    'avgtrajz' - z position (list, in mm)
                 Phase errors:
                     'zpe' - Pole z positions (list, in mm)
                     'pe' - Phase errors (list, in degrees)
@@ -1464,31 +2070,28 @@ class UndulatorShimming():
         if yls is None:
             yls = [0]*len(objs)
 
-        for obj, label, xl, yl in zip(objs, labels, xls, yls):
-            traj = self._calc_traj(obj, xl, yl)
-            zpe, pe, pe_rms = self._calc_phase_error(obj, traj)
-            ib, iib = self._calc_field_integrals(obj)
-            r = {}
-            r['trajx'] = list(traj[:, 0]*1000)
-            r['trajy'] = list(traj[:, 1]*1000)
-            r['trajz'] = list(traj[:, 2])
-            r['trajxl'] = list(traj[:, 3])
-            r['trajyl'] = list(traj[:, 4])
-            r['trajzl'] = list(traj[:, 5])
-            r['zpe'] = list(zpe)
-            r['pe'] = list(pe*180/_np.pi)
-            r['perms'] = pe_rms*180/_np.pi
-            r['ibx'] = list(ib[:, 0])
-            r['iby'] = list(ib[:, 1])
-            r['ibz'] = list(ib[:, 2])
-            r['iibx'] = list(iib[:, 0])
-            r['iiby'] = list(iib[:, 1])
-            r['iibz'] = list(iib[:, 2])
-            results[label] = r
+        if nproc is not None:
+            nproc = int(nproc)
+            if nproc < 1:
+                raise ValueError('Number or processes must be >=1.')
+            with _ProcessPoolExecutor(max_workers=nproc) as executor:
+                futures = {
+                    executor.submit(
+                        self._calc_object_results, obj, xl, yl,
+                        share_field): label
+                    for obj, label, xl, yl in zip(objs, labels, xls, yls)}
+                for future in _as_completed(futures):
+                    results[futures[future]] = future.result()
+                    if filename is not None:
+                        self._save_results(results, labels, filename)
+        else:
+            for obj, label, xl, yl in zip(objs, labels, xls, yls):
+                results[label] = self._calc_object_results(
+                    obj, xl, yl, share_field=share_field)
+                if filename is not None:
+                    self._save_results(results, labels, filename)
 
-        if filename is not None:
-            with open(filename, '+w') as f:
-                _json.dump(results, f)
+        results = {label: results[label] for label in labels}
         return results
 
     def plot_results(
@@ -1515,6 +2118,9 @@ class UndulatorShimming():
             figsize (tuple, 2, optional): Pair of floats specifying figure size
                 Defaults to (12, 6).
         """
+        import matplotlib.pyplot as _plt
+        import matplotlib.gridspec as _gridspec
+
         labels = list(results.keys())
 
         spec = _gridspec.GridSpec(
@@ -1601,3 +2207,756 @@ class UndulatorShimming():
             _plt.savefig(filename, dpi=400)
 
         return fig;
+
+
+class ResponseMatrixStore():
+    """Binary, content-addressed storage of response matrix columns.
+
+    Each entry is keyed by a hash of all the inputs of the response matrix
+    calculation: shimming parameters (see
+    UndulatorShimming.response_parameters), model state, cassette positions,
+    segment limits and shim value. Columns are stored individually, keyed
+    by shimming element (see UndulatorShimming.get_shimming_keys), so that:
+        > matrices for different block masks share stored columns.
+        > a partially calculated matrix is resumed from its stored columns.
+
+    Each entry is a directory with the files:
+        inputs.json  : inputs from which the key was calculated.
+        index.json   : element keys of the stored columns, in storage order.
+        columns.bin  : raw float64 columns, one after the other, loaded
+                       with memory mapping.
+
+    Usage example:
+
+        >>> store = ResponseMatrixStore('response_matrices')
+        >>> matrix = shimming.calc_response_matrix(model, segs, store=store)
+    """
+
+    def __init__(self, directory, batch_size=10):
+        """Initializes store, creating the directory if necessary.
+
+        Args:
+            directory (str): Path to store directory.
+            batch_size (int, optional): Number of calculated columns saved
+                at once by response matrix calculations (see save_columns).
+                At most batch_size columns are recalculated if a
+                calculation is interrupted. Defaults to 10.
+
+        Raises:
+            ValueError: If batch_size is less than 1.
+        """
+        if batch_size < 1:
+            raise ValueError('batch_size must be >= 1.')
+        self._directory = directory
+        self._batch_size = int(batch_size)
+        _os.makedirs(directory, exist_ok=True)
+
+    @property
+    def directory(self):
+        """Path to store directory."""
+        return self._directory
+
+    @property
+    def batch_size(self):
+        """Number of calculated columns saved at once."""
+        return self._batch_size
+
+    @staticmethod
+    def get_inputs(shimming, model, model_segs, shim=0.1):
+        """Inputs on which response matrix columns depend.
+
+        Args:
+            shimming (UndulatorShimming): Shimming calculation parameters.
+            model (InsertionDeviceModel): Device model.
+            model_segs (list, K): Longitudinal positions of segment limits.
+            shim (float, optional): Shim value (in mm). Defaults to 0.1.
+
+        Returns:
+            dict: JSON serializable dictionary of inputs.
+        """
+        return {
+            'shimming': shimming.response_parameters,
+            'model': _hash_json(model.state),
+            'cassette_positions': _hash_json(
+                model.get_cassette_positions()),
+            'model_segs': _np.asarray(model_segs, dtype=float).tolist(),
+            'shim': float(shim),
+        }
+
+    def get_key(self, shimming, model, model_segs, shim=0.1):
+        """Key of the store entry for given inputs (see get_inputs).
+
+        Returns:
+            str: Entry key (SHA1 hex digest of inputs).
+        """
+        return _hash_json(self.get_inputs(shimming, model, model_segs, shim))
+
+    def _get_path(self, key, name=None):
+        path = _os.path.join(self.directory, key)
+        if name is not None:
+            path = _os.path.join(path, name)
+        return path
+
+    def keys(self):
+        """List of entry keys in store.
+
+        Returns:
+            list: Entry keys.
+        """
+        return sorted(
+            key for key in _os.listdir(self.directory)
+            if _os.path.isfile(self._get_path(key, 'inputs.json')))
+
+    def get_inputs_from_store(self, key):
+        """Inputs of a store entry.
+
+        Args:
+            key (str): Entry key.
+
+        Returns:
+            dict: Inputs saved with the entry (see get_inputs).
+        """
+        with open(self._get_path(key, 'inputs.json')) as f:
+            return _json.load(f)
+
+    def get_element_keys(self, key):
+        """Element keys of the stored columns of an entry.
+
+        Args:
+            key (str): Entry key.
+
+        Returns:
+            list: List of (cassette, block index) tuples, in storage order.
+                Empty if entry does not exist.
+        """
+        filename = self._get_path(key, 'index.json')
+        if not _os.path.isfile(filename):
+            return []
+        with open(filename) as f:
+            index = _json.load(f)
+        return [_str_to_element_key(value) for value in index['elements']]
+
+    def _get_nr_rows(self, key):
+        filename = self._get_path(key, 'index.json')
+        if not _os.path.isfile(filename):
+            return None
+        with open(filename) as f:
+            return _json.load(f)['nr_rows']
+
+    def create(self, inputs):
+        """Create store entry, if it does not exist.
+
+        Args:
+            inputs (dict): Entry inputs (see get_inputs).
+
+        Returns:
+            str: Entry key.
+        """
+        key = _hash_json(inputs)
+        path = self._get_path(key)
+        if not _os.path.isfile(self._get_path(key, 'inputs.json')):
+            _os.makedirs(path, exist_ok=True)
+            with open(self._get_path(key, 'inputs.json'), 'w') as f:
+                _json.dump(inputs, f)
+        return key
+
+    def load(self, key, element_keys=None):
+        """Load stored columns of an entry.
+
+        Args:
+            key (str): Entry key.
+            element_keys (list, optional): Element keys of requested
+                columns. If None, all stored columns are returned as a
+                read-only memory mapped array (no data is read until used).
+                Defaults to None.
+
+        Returns:
+            numpy.ndarray, MxN: Response matrix with the requested columns.
+                Columns not stored are filled with NaN. None if the entry has
+                no stored columns.
+            list: Element keys of requested columns not stored.
+        """
+        stored = self.get_element_keys(key)
+        nr_rows = self._get_nr_rows(key)
+        if len(stored) == 0:
+            missing = [] if element_keys is None else list(element_keys)
+            return None, missing
+
+        columns = _np.memmap(
+            self._get_path(key, 'columns.bin'), dtype=float, mode='r',
+            shape=(len(stored), nr_rows))
+        if element_keys is None:
+            return columns.T, []
+
+        positions = {element_key: i for i, element_key in enumerate(stored)}
+        matrix = _np.full((nr_rows, len(element_keys)), _np.nan)
+        missing = []
+        for j, element_key in enumerate(element_keys):
+            i = positions.get(tuple(element_key))
+            if i is None:
+                missing.append(element_key)
+            else:
+                matrix[:, j] = columns[i]
+        return matrix, missing
+
+    def save_column(self, key, element_key, column):
+        """Append column to a store entry (see save_columns).
+
+        Args:
+            key (str): Entry key, created with the create method.
+            element_key (tuple): Element key (cassette, block index).
+            column (numpy.ndarray, M): Response matrix column.
+
+        Returns:
+            int: Number of stored columns of the entry.
+        """
+        return self.save_columns(key, [element_key], [column])
+
+    def save_columns(self, key, element_keys, columns):
+        """Append columns to a store entry.
+
+        The columns are written with a single synchronized write (fsync),
+        and the index is rewritten once, with a cost proportional to the
+        number of stored columns. Columns should therefore be saved in
+        batches (see batch_size) rather than one at a time.
+
+        Args:
+            key (str): Entry key, created with the create method.
+            element_keys (list, N): Element keys (cassette, block index)
+                of the columns.
+            columns (list or numpy.ndarray, NxM): Response matrix columns.
+
+        Raises:
+            ValueError: If the number of columns does not match the number
+                of element keys.
+            ValueError: If column length does not match stored columns.
+
+        Returns:
+            int: Number of stored columns of the entry.
+        """
+        stored = self.get_element_keys(key)
+        if len(element_keys) == 0:
+            return len(stored)
+        columns = _np.ascontiguousarray(columns, dtype=float)
+        if columns.ndim != 2 or len(columns) != len(element_keys):
+            raise ValueError(
+                'Number of columns does not match number of element keys.')
+        nr_rows = self._get_nr_rows(key)
+        if nr_rows is None:
+            nr_rows = columns.shape[1]
+        elif columns.shape[1] != nr_rows:
+            raise ValueError('Column length does not match stored columns.')
+
+        # Data written after the last index update (e.g. by an interrupted
+        # calculation) is discarded.
+        filename = self._get_path(key, 'columns.bin')
+        with open(filename, 'ab') as f:
+            f.truncate(len(stored)*nr_rows*columns.itemsize)
+            f.write(columns.tobytes())
+            f.flush()
+            _os.fsync(f.fileno())
+
+        stored.extend(tuple(element_key) for element_key in element_keys)
+        index = {
+            'nr_rows': nr_rows,
+            'elements': [_element_key_to_str(k) for k in stored],
+        }
+        tmp_filename = self._get_path(key, 'index.json.tmp')
+        with open(tmp_filename, 'w') as f:
+            _json.dump(index, f)
+        _os.replace(tmp_filename, self._get_path(key, 'index.json'))
+        return len(stored)
+
+    def validate(self, key):
+        """Check consistency of a store entry.
+
+        Args:
+            key (str): Entry key.
+
+        Returns:
+            bool: True if inputs match the key, the columns file holds all
+                indexed columns and all stored values are finite.
+        """
+        try:
+            inputs = self.get_inputs_from_store(key)
+        except (OSError, ValueError):
+            return False
+        if _hash_json(inputs) != key:
+            return False
+
+        stored = self.get_element_keys(key)
+        if len(stored) == 0:
+            return True
+        nr_rows = self._get_nr_rows(key)
+        filename = self._get_path(key, 'columns.bin')
+        if not _os.path.isfile(filename) or _os.path.getsize(
+                filename) < len(stored)*nr_rows*8:
+            return False
+        matrix, _ = self.load(key)
+        return bool(_np.all(_np.isfinite(matrix)))
+
+    def remove(self, key):
+        """Remove store entry.
+
+        Args:
+            key (str): Entry key.
+
+        Returns:
+            bool: True if the entry existed, False otherwise.
+        """
+        path = self._get_path(key)
+        if not _os.path.isdir(path):
+            return False
+        for name in _os.listdir(path):
+            _os.remove(_os.path.join(path, name))
+        _os.rmdir(path)
+        return True
+
+
+class ShimmingLoop():
+    """Iterative shimming driver keeping calculations across rounds.
+
+    Segment limits and parameters of the model, response matrix columns
+    and the SVD of the (weighted) response matrix are kept in memory, so
+    that a new measurement round only recalculates measurement dependent
+    quantities (errors, shims, signature, shimmed measurement and results).
+
+    Response matrix columns are keyed by cassette and block index, so
+    changing the block_mask of the shimming object only calculates the
+    columns of blocks not seen before, and the SVD is updated (columns
+    removed by a low rank update, columns appended by rank-one updates)
+    instead of recalculated.
+
+    Response matrix columns are saved to a ResponseMatrixStore as they are
+    calculated, and segment limits and finished rounds are saved to the
+    checkpoint file, so that an interrupted calculation resumes where it
+    stopped. The checkpoint stores a fingerprint of the shimming
+    parameters, the shim value, the model state and the cassette positions,
+    and is rejected if they do not match.
+
+    Usage example:
+
+        >>> loop = ShimmingLoop(shimming, model, 'checkpoint.json')
+        >>> round1 = loop.run_round(meas1, 'round1', nsv=40)
+        >>> shimming.block_mask = new_mask
+        >>> round2 = loop.run_round(meas2, 'round2', nsv=40)
+    """
+
+    def __init__(
+            self, shimming, model, checkpoint_filename=None, shim=0.1,
+            store=None):
+        """Initializes loop and loads checkpoint file, if it exists.
+
+        Args:
+            shimming (UndulatorShimming): Shimming calculation parameters.
+            model (InsertionDeviceModel): Device model used for shimming.
+                Blocks must not be modified between rounds, except by the
+                shimming calculations themselves.
+            checkpoint_filename (str, optional): Path to checkpoint file
+                (.json). If None, no checkpoint is saved. Defaults to None.
+            shim (float, optional): Displacement (shim) value applied to
+                blocks for calculating the response matrix. In mm.
+                Defaults to 0.1.
+            store (ResponseMatrixStore, optional): Store of response matrix
+                columns. If None and checkpoint_filename is given, columns
+                are stored in the directory with the checkpoint file name
+                without extension followed by '_columns'. If both are None,
+                columns are only kept in memory. Defaults to None.
+
+        Raises:
+            ValueError: If checkpoint file does not match shimming
+                parameters, shim value, model or cassette positions.
+        """
+        self._shimming = shimming
+        self._model = model
+        self._checkpoint_filename = checkpoint_filename
+        self._shim = shim
+        self._fingerprint = self._get_fingerprint()
+
+        if store is None and checkpoint_filename is not None:
+            store = ResponseMatrixStore(
+                _os.path.splitext(checkpoint_filename)[0] + '_columns')
+        self._store = store
+        self._store_key = None
+
+        self._model_segs = None
+        self._reference = None
+        self._columns = {}
+        self._rounds = {}
+        self._svd = None
+
+        if checkpoint_filename is not None and _os.path.isfile(
+                checkpoint_filename):
+            self.load_checkpoint()
+
+    @property
+    def shimming(self):
+        """Shimming calculation parameters (UndulatorShimming)."""
+        return self._shimming
+
+    @property
+    def model(self):
+        """Device model used for shimming."""
+        return self._model
+
+    @property
+    def checkpoint_filename(self):
+        """Path to checkpoint file."""
+        return self._checkpoint_filename
+
+    @property
+    def shim(self):
+        """Shim value used for calculating response matrix [mm]."""
+        return self._shim
+
+    @property
+    def store(self):
+        """Store of response matrix columns (ResponseMatrixStore)."""
+        return self._store
+
+    @property
+    def model_segs(self):
+        """Longitudinal positions of model segment limits [mm]."""
+        if self._model_segs is None:
+            self._model_segs = self.shimming.calc_segments(self.model)
+            self._save_checkpoint()
+        return self._model_segs
+
+    @property
+    def rounds(self):
+        """Labels of finished rounds."""
+        return list(self._rounds.keys())
+
+    def _get_fingerprint(self):
+        return {
+            'shimming': _hash_json(self.shimming.response_parameters),
+            'shim': self.shim,
+            'model': _hash_json(self.model.state),
+            'cassette_positions': _hash_json(
+                self.model.get_cassette_positions()),
+        }
+
+    def _get_reference(self):
+        if self._reference is None:
+            self._reference = self.shimming.calc_slope_and_phase_error(
+                self.model, self.model_segs, 0, 0)
+        return self._reference
+
+    def _get_store_key(self):
+        if self._store_key is None:
+            self._store_key = self.store.create(self.store.get_inputs(
+                self.shimming, self.model, self.model_segs, shim=self.shim))
+        return self._store_key
+
+    def load_checkpoint(self):
+        """Load segment limits and finished rounds from checkpoint.
+
+        Raises:
+            ValueError: If checkpoint file does not match shimming
+                parameters, shim value, model or cassette positions.
+
+        Returns:
+            bool: True.
+        """
+        with open(self.checkpoint_filename) as f:
+            data = _json.load(f)
+
+        if data['fingerprint'] != self._fingerprint:
+            raise ValueError(
+                'Checkpoint file does not match shimming parameters, '
+                'shim value, model or cassette positions.')
+
+        if data['model_segs'] is not None:
+            self._model_segs = _np.array(data['model_segs'])
+        self._rounds = data['rounds']
+        return True
+
+    def _save_checkpoint(self):
+        if self.checkpoint_filename is None:
+            return False
+
+        model_segs = self._model_segs
+        data = {
+            'fingerprint': self._fingerprint,
+            'model_segs': None if model_segs is None else list(model_segs),
+            'rounds': self._rounds,
+        }
+
+        # Write to a temporary file first, so that an interruption while
+        # writing does not corrupt the checkpoint.
+        tmp_filename = self.checkpoint_filename + '.tmp'
+        with open(tmp_filename, 'w') as f:
+            _json.dump(data, f)
+        _os.replace(tmp_filename, self.checkpoint_filename)
+        return True
+
+    def get_element_keys(self):
+        """Keys of the current shimming elements.
+
+        Returns:
+            list: List of (cassette, block index) tuples, one for each
+                shimming element (see UndulatorShimming.get_shimming_keys).
+        """
+        return self.shimming.get_shimming_keys(self.model)
+
+    def get_response_matrix(self):
+        """Get response matrix of the current shimming elements.
+
+        Only columns not calculated before (in memory or in the store)
+        are calculated. New columns are saved to the store in batches (see
+        ResponseMatrixStore.batch_size) as they are calculated.
+
+        Returns:
+            numpy.ndarray, MxN: Response matrix for M optimizable parameters
+                by N shims (see UndulatorShimming.calc_response_matrix).
+        """
+        keys = self.get_element_keys()
+        missing = [key for key in keys if key not in self._columns]
+
+        if missing and self.store is not None:
+            matrix, not_stored = self.store.load(
+                self._get_store_key(), missing)
+            not_stored = set(tuple(key) for key in not_stored)
+            for idx, key in enumerate(missing):
+                if key not in not_stored:
+                    self._columns[key] = _np.array(matrix[:, idx])
+            missing = [key for key in missing if key in not_stored]
+
+        if missing:
+            reference = self._get_reference()
+            elements = {
+                cassette: self.shimming.get_shimming_blocks(
+                    self.model, cassette)
+                for cassette in self.shimming.cassettes}
+            positions = {key: idx for idx, key in enumerate(keys)}
+            offsets = {}
+            count = 0
+            for cassette in self.shimming.cassettes:
+                offsets[cassette] = count
+                count += len(elements[cassette])
+
+            pending_keys = []
+            pending_columns = []
+            for key in missing:
+                cassette = key[0]
+                element = elements[cassette][
+                    positions[key] - offsets[cassette]]
+                dpx, dpy, dpe = self.shimming.calc_response_column(
+                    self.model, self.model_segs, element, reference,
+                    shim=self.shim)
+                if dpe is None:
+                    column = _np.concatenate([dpx, dpy])
+                else:
+                    column = _np.concatenate([dpx, dpy, dpe])
+                self._columns[key] = column
+                if self.store is not None:
+                    pending_keys.append(key)
+                    pending_columns.append(column)
+                    if len(pending_keys) >= self.store.batch_size:
+                        self.store.save_columns(
+                            self._get_store_key(), pending_keys,
+                            pending_columns)
+                        pending_keys = []
+                        pending_columns = []
+            if self.store is not None:
+                self.store.save_columns(
+                    self._get_store_key(), pending_keys, pending_columns)
+
+        return _np.transpose([self._columns[key] for key in keys])
+
+    def get_svd(self, ws=None):
+        """Get SVD of the weighted response matrix of the current elements.
+
+        The SVD of the previous call is updated if only the shimming
+        elements changed (e.g. by a new block_mask). It is recalculated
+        if the weights changed or if more columns were added than kept.
+
+        Args:
+            ws (list, M, optional): Weights for optmizable parameters.
+                See UndulatorShimming.calc_shims. Defaults to None.
+
+        Returns:
+            numpy.ndarray, MxR: Left matrix from SVD.
+            numpy.ndarray, R: Singular values from SVD.
+            numpy.ndarray, RxN: Right matrix from SVD.
+        """
+        response_matrix = self.get_response_matrix()
+        keys = self.get_element_keys()
+        if ws is None:
+            ws = [1.0]*response_matrix.shape[0]
+        ws = list(_np.array(ws, dtype=float))
+        w = self.shimming.get_weights_matrix(ws)
+
+        svd = self._svd
+        if svd is not None and svd['ws'] == ws and svd['keys'] == keys:
+            return svd['u'], svd['sv'], svd['vt']
+
+        old_positions = {} if svd is None or svd['ws'] != ws else {
+            key: idx for idx, key in enumerate(svd['keys'])}
+        kept = [key for key in keys if key in old_positions]
+        added = [key for key in keys if key not in old_positions]
+
+        if len(kept) == 0 or len(added) > len(kept):
+            u, sv, vt = self.shimming.calc_svd(w @ response_matrix)
+        else:
+            u, sv, vt = self.shimming.update_svd_remove_columns(
+                svd['u'], svd['sv'], svd['vt'],
+                [old_positions[key] for key in kept])
+            for key in added:
+                u, sv, vt = self.shimming.update_svd_append_column(
+                    u, sv, vt, w @ self._columns[key])
+            # Reorder right matrix columns to the current elements order.
+            order = {key: idx for idx, key in enumerate(kept + added)}
+            vt = vt[:, [order[key] for key in keys]]
+
+        self._svd = {'ws': ws, 'keys': keys, 'u': u, 'sv': sv, 'vt': vt}
+        return u, sv, vt
+
+    def reset(self, columns=False):
+        """Forget cached SVD and model parameters.
+
+        Args:
+            columns (bool, optional): If True, response matrix columns
+                (including the store entry of the current inputs), segment
+                limits and finished rounds are also forgotten, and the
+                checkpoint is overwritten. Defaults to False.
+
+        Returns:
+            bool: True.
+        """
+        self._svd = None
+        self._reference = None
+        if columns:
+            if self.store is not None and self._model_segs is not None:
+                self.store.remove(self._get_store_key())
+            self._store_key = None
+            self._model_segs = None
+            self._columns = {}
+            self._rounds = {}
+            self._save_checkpoint()
+        return True
+
+    def calc_shims(
+            self, error, nsv=None, ws=None, possible_shims=None, limits=None):
+        """Calculate shims of the current elements for a given errors array.
+
+        Args:
+            error (numpy.ndarray, M): Error array associated to optimizable
+                parameters for shimming.
+            nsv (int, optional): Number of singular values to be considered.
+                See UndulatorShimming.calc_inv_matrix. Defaults to None.
+            ws (list, M, optional): Weights for optmizable parameters.
+                See UndulatorShimming.calc_shims. Defaults to None.
+            possible_shims (list, optional): List of available shims (in mm).
+                If not None, feasible shims are calculated with
+                UndulatorShimming.calc_discrete_shims. Defaults to None.
+            limits (list, optional): Shim limits (in mm), see
+                UndulatorShimming.calc_discrete_shims. Only used if
+                possible_shims is not None. Defaults to None.
+
+        Returns:
+            numpy.ndarray, N: Resulting shims associated to input errors.
+        """
+        svd = self.get_svd(ws=ws)
+        if possible_shims is not None:
+            return self.shimming.calc_discrete_shims(
+                self.get_response_matrix(), error, possible_shims,
+                nsv=nsv, ws=ws, limits=limits, svd=svd)
+
+        u, sv, vt = svd
+        if ws is None:
+            ws = [1.0]*len(error)
+        w = self.shimming.get_weights_matrix(ws)
+        minv = self.shimming.calc_inv_matrix(u, sv, vt, nsv=nsv)
+        return minv @ (w @ error)
+
+    def run_round(
+            self, meas, label, nsv=None, ws=None, possible_shims=None,
+            limits=None, force=False):
+        """Run a shimming round for a measurement.
+
+        If a round with the same label, measurement, elements and parameters
+        was finished before (in this or a previous session, through the
+        checkpoint file), its results are reused.
+
+        Args:
+            meas (InsertionDeviceData): Measurement of the round.
+            label (str): Round label.
+            nsv (int, optional): Number of singular values to be considered.
+                See UndulatorShimming.calc_inv_matrix. Defaults to None.
+            ws (list, M, optional): Weights for optmizable parameters.
+                See UndulatorShimming.calc_shims. Defaults to None.
+            possible_shims (list, optional): List of available shims (in mm).
+                If not None, shims are restricted to these values (see
+                calc_shims). Defaults to None.
+            limits (list, optional): Shim limits (in mm), used with
+                possible_shims (see calc_shims). Defaults to None.
+            force (bool, optional): If True, the round is recalculated even
+                if it was finished before. Defaults to False.
+
+        Returns:
+            dict: Dictionary with keys 'error' (numpy.ndarray), 'shims'
+                (numpy.ndarray), 'shim_signature' (InsertionDeviceData),
+                'shimmed_meas' (InsertionDeviceData) and 'results' (dict,
+                see UndulatorShimming.calc_results, keyed by 'meas' and
+                'shimmed').
+        """
+        shimming = self.shimming
+        zpos = _np.linspace(shimming.zmin, shimming.zmax, shimming.znpts)
+        keys = [_element_key_to_str(key) for key in self.get_element_keys()]
+        params = {
+            'meas': _hash_json(meas.get_field(z=zpos)),
+            'keys': keys,
+            'nsv': nsv,
+            'ws': None if ws is None else list(_np.array(ws, dtype=float)),
+            'possible_shims': None if possible_shims is None else list(
+                _np.array(possible_shims, dtype=float)),
+            'limits': None if limits is None else _np.array(
+                limits, dtype=float).tolist(),
+            'solved_shim': shimming.solved_shim,
+        }
+
+        saved = self._rounds.get(label)
+        if not force and saved is not None and saved['params'] == params:
+            raw_data = _np.array(saved['shim_signature'])
+            shim_signature = _insertiondevice.InsertionDeviceData(
+                nr_periods=self.model.nr_periods,
+                period_length=self.model.period_length,
+                gap=self.model.gap,
+                raw_data=raw_data)
+            return {
+                'error': _np.array(saved['error']),
+                'shims': _np.array(saved['shims']),
+                'shim_signature': shim_signature,
+                'shimmed_meas': shimming.calc_shimmed_meas(
+                    meas, shim_signature),
+                'results': saved['results'],
+            }
+
+        meas_segs = shimming.calc_segments(meas)
+        error = shimming.calc_error(
+            self.model, meas, self.model_segs, meas_segs)
+        shims = self.calc_shims(
+            error, nsv=nsv, ws=ws, possible_shims=possible_shims,
+            limits=limits)
+        shim_signature = shimming.calc_shim_signature(self.model, shims)
+        shimmed_meas = shimming.calc_shimmed_meas(meas, shim_signature)
+        results = shimming.calc_results(
+            [meas, shimmed_meas], ['meas', 'shimmed'])
+
+        self._rounds[label] = {
+            'params': params,
+            'error': list(error),
+            'shims': list(shims),
+            'shim_signature': shim_signature.raw_data.tolist(),
+            'results': results,
+        }
+        self._save_checkpoint()
+
+        return {
+            'error': error,
+            'shims': shims,
+            'shim_signature': shim_signature,
+            'shimmed_meas': shimmed_meas,
+            'results': results,
+        }
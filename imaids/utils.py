@@ -1,10 +1,49 @@
 
+import sys as _sys
+import importlib.util as _importlib_util
 import numpy as _np
-from scipy import constants as _constants
-from scipy import signal as _signal
-from scipy import optimize as _optimize
 import radia as _rad
 
+from . import materials as _materials
+from . import lifecycle as _lifecycle
+
+
+def lazy_import(name):
+    """Import module lazily.
+
+    The module is only executed when one of its attributes is first
+    accessed, reducing the import time of modules that seldom use it.
+
+    Args:
+        name (str): Absolute module name (e.g. 'scipy.interpolate').
+
+    Raises:
+        ModuleNotFoundError: If the module is not found.
+
+    Returns:
+        module: Lazy module (or the module itself, if already imported).
+    """
+    module = _sys.modules.get(name)
+    if module is not None:
+        return module
+
+    spec = _importlib_util.find_spec(name)
+    if spec is None:
+        raise ModuleNotFoundError(
+            'No module named {0:s}'.format(repr(name)), name=name)
+
+    loader = _importlib_util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = _importlib_util.module_from_spec(spec)
+    _sys.modules[name] = module
+    loader.exec_module(module)
+    return module
+
+
+_constants = lazy_import('scipy.constants')
+_signal = lazy_import('scipy.signal')
+_optimize = lazy_import('scipy.optimize')
+
 
 # NOTE: package lnls-sirius/mathphys could be used to defined these consts
 
@@ -46,6 +85,8 @@ def delete_recursive(ref):
         for in_ref in _rad.ObjCntStuf(ref):
             delete_recursive(in_ref)
     _rad.UtiDel(ref)
+    _materials.registry.release_reference(ref)
+    _lifecycle.tracker.forget(ref)
     return 0
 
     
@@ -60,6 +101,8 @@ def delete_all():
     Returns:
         int: 0
     """
+    _materials.registry.clear()
+    _lifecycle.tracker.clear()
     return _rad.UtiDelAll()
 
 
@@ -91,6 +134,10 @@ def get_info_all(max_ref=100000):
     Tip:
         Getting a list of all reference integers:
             >>> ref_list = list(get_info_all().keys())
+
+    Note:
+        Probing all references is slow. Objects created by field models
+        are tracked by lifecycle.tracker, see get_tracked_stats.
     """
     info_dict = {}
     for ref in range(max_ref+1):
@@ -101,6 +148,64 @@ def get_info_all(max_ref=100000):
     return info_dict
 
 
+def count_elements(ref):
+    """Count elementary (non container) Radia objects in an object tree.
+
+    Args:
+        ref (int): Radia object reference.
+
+    Returns:
+        int: Number of elementary objects.
+    """
+    nr_objects = _rad.ObjCntSize(ref)
+    if nr_objects == 0:
+        return 1
+    return sum(count_elements(in_ref) for in_ref in _rad.ObjCntStuf(ref))
+
+
+def get_element_limits(ref):
+    """Geometrical limits of elementary Radia objects in an object tree.
+
+    Args:
+        ref (int): Radia object reference.
+
+    Returns:
+        numpy.ndarray, Nx6: Limits [xmin, xmax, ymin, ymax, zmin, zmax]
+            of each of the N elementary objects (in mm).
+    """
+    refs = [ref]
+    limits = []
+    while refs:
+        in_ref = refs.pop()
+        if _rad.ObjCntSize(in_ref) == 0:
+            limits.append(_rad.ObjGeoLim(in_ref))
+        else:
+            refs.extend(reversed(_rad.ObjCntStuf(in_ref)))
+    return _np.array(limits, dtype=float).reshape(-1, 6)
+
+
+def get_tracked_stats(count_objects=True):
+    """Returns statistics of Radia objects tracked by field model owners.
+
+    Args:
+        count_objects (bool, optional): If True, owned object trees are
+            traversed to count objects and estimate memory.
+            Defaults to True.
+
+    Returns:
+        dict: Dictionary with keys 'live_count' (number of live owners),
+            'classes' (statistics grouped by owner class, see
+            lifecycle.RadiaObjectTracker.get_class_stats) and 'leaks'
+            (objects of garbage collected owners not deleted).
+    """
+    tracker = _lifecycle.tracker
+    return {
+        'live_count': tracker.live_count,
+        'classes': tracker.get_class_stats(count_objects=count_objects),
+        'leaks': tracker.get_leaks(),
+    }
+
+
 def get_info_all_str(max_ref=100000):
     """Returns a string with information of all Radia objects, concatenating
         the values of the dictionary returned by get_info_all(max_ref=max_ref).
@@ -525,6 +630,8 @@ def calc_cosine_amplitude(pos_list, values_list, freq_guess, maxfev=5000):
 def depth(lst):
     """Returns list depth.
 
+    Tuples and numpy arrays are handled as lists.
+
     Args:
         lst (list): List for which depth is to be determined.
 
@@ -539,7 +646,62 @@ def depth(lst):
         >>> depth([[[1,2],[3,4]]])
         3
     """
-    return isinstance(lst, list) and max(map(depth, lst)) + 1
+    return (
+        isinstance(lst, (list, tuple, _np.ndarray)) and
+        max(map(depth, lst)) + 1)
+
+
+def to_list(value):
+    """Converts nested tuples and numpy arrays into nested lists.
+
+    Args:
+        value (list, tuple or numpy.ndarray): Nested sequence (e.g. the
+            read-only block shape returned by Block.shape).
+
+    Returns:
+        list: Nested list with the same values. Other types are returned
+            unchanged.
+
+    Examples:
+        >>> to_list((np.array([[0, 0], [1, 0]]), [[0, 1], [1, 1]]))
+        [[[0, 0], [1, 0]], [[0, 1], [1, 1]]]
+    """
+    if isinstance(value, _np.ndarray):
+        return value.tolist()
+    if isinstance(value, (list, tuple)):
+        return [to_list(item) for item in value]
+    return value
+
+
+def readonly_array(value, dtype=float):
+    """Returns read-only numpy array with the input values.
+
+    Args:
+        value (list): Values to store in the array.
+        dtype (type, optional): Array data type. Defaults to float.
+
+    Returns:
+        numpy.ndarray: Array with writeable flag set to False.
+    """
+    array = _np.array(value, dtype=dtype)
+    array.flags.writeable = False
+    return array
+
+
+def readonly_shape(shape):
+    """Returns read-only view of a block shape.
+
+    Args:
+        shape (list, Mx2 or NxMx2): Single polygon or list of N polygons
+            of M 2D points (M may vary between polygons).
+
+    Returns:
+        tuple: Tuple of N read-only numpy arrays, one Mx2 array for each
+            polygon.
+    """
+    if depth(shape) != 3:
+        shape = [shape]
+    return tuple(readonly_array(polygon) for polygon in shape)
 
 
 def flatten(lst):
@@ -707,6 +869,9 @@ def newton_lorentz_equation(a, r, b):
             (coordinates in mm).
             (derivatives in mm/s or dimensionless, for t or s parameters).        
         b (list, 3): Magnetic field 3D vector (in T)
+            
+        For several particles, r and b may be arrays of shapes (M, 6) and
+        (M, 3), respectively.
     
     Returns:
         list, 6: Derivative of the input trajectory vector, contains
@@ -714,7 +879,16 @@ def newton_lorentz_equation(a, r, b):
             derivatives (acceleracionts)
                 (first derivatives in mm/s or dimensionless, for t or s).
                 (second derivatives in mm/(s^2) or 1/mm, for t or s).
+            Array of shape (M, 6) for several particles.
     """
+    if _np.ndim(r) > 1:
+        r = _np.asarray(r, dtype=float)
+        b = _np.asarray(b, dtype=float)
+        drds = _np.empty(r.shape)
+        drds[:, :3] = r[:, 3:]
+        drds[:, 3:] = -a*_np.cross(r[:, 3:], b)
+        return drds
+
     drds = _np.zeros(6)
     drds[0] = r[3]
     drds[1] = r[4]
@@ -725,6 +899,121 @@ def newton_lorentz_equation(a, r, b):
     return drds
 
 
+def sample_beam_distribution(
+        nr_particles, beta=(17.2, 3.6), alpha=(0, 0), emittance=2.5e-10,
+        coupling=0.01, seed=None):
+    """Sample gaussian beam initial conditions from Twiss parameters.
+
+    Default values are the storage ring values used in get_spectra_accel.
+
+    Args:
+        nr_particles (int): Number of particles (M).
+        beta (list, optional): Twiss beta functions [beta_x, beta_y]
+            (in m). Defaults to (17.2, 3.6).
+        alpha (list, optional): Twiss alpha functions [alpha_x, alpha_y].
+            Defaults to (0, 0).
+        emittance (float, optional): Natural emittance (in m.rad).
+            Defaults to 2.5e-10.
+        coupling (float, optional): Coupling constant, ratio between
+            vertical and horizontal emittances. Defaults to 0.01.
+        seed (int, optional): Random generator seed. Defaults to None.
+
+    Returns:
+        numpy.ndarray: Initial conditions array of shape (M, 6), each row
+            as [x, y, z, x', y', z'], x,y,z in mm and x',y',z' in rad or
+            dimensionless. z is zero and z' is defined from the unit
+            direction vector.
+    """
+    emittances = [emittance/(1 + coupling), emittance*coupling/(1 + coupling)]
+    rng = _np.random.default_rng(seed)
+
+    r0 = _np.zeros((int(nr_particles), 6))
+    for i in range(2):
+        u = rng.standard_normal(int(nr_particles))
+        v = rng.standard_normal(int(nr_particles))
+        r0[:, i] = _np.sqrt(emittances[i]*beta[i])*u*1000
+        r0[:, i + 3] = _np.sqrt(emittances[i]/beta[i])*(v - alpha[i]*u)
+    r0[:, 5] = _np.sqrt(1 - r0[:, 3]**2 - r0[:, 4]**2)
+    return r0
+
+
+# Dormand-Prince 5(4) coefficients, with the 4th order continuous extension
+# used for dense output (Hairer, Norsett and Wanner, Solving Ordinary
+# Differential Equations I).
+DOPRI_C = _np.array([0, 1/5, 3/10, 4/5, 8/9, 1])
+DOPRI_A = [
+    _np.array([]),
+    _np.array([1/5]),
+    _np.array([3/40, 9/40]),
+    _np.array([44/45, -56/15, 32/9]),
+    _np.array([19372/6561, -25360/2187, 64448/6561, -212/729]),
+    _np.array([9017/3168, -355/33, 46732/5247, 49/176, -5103/18656]),
+]
+DOPRI_B = _np.array([35/384, 0, 500/1113, 125/192, -2187/6784, 11/84])
+DOPRI_E = _np.array([
+    -71/57600, 0, 71/16695, -71/1920, 17253/339200, -22/525, 1/40])
+DOPRI_P = _np.array([
+    [1, -8048581381/2820520608, 8663915743/2820520608,
+     -12715105075/11282082432],
+    [0, 0, 0, 0],
+    [0, 131558114200/32700410799, -68118460800/10900136933,
+     87487479700/32700410799],
+    [0, -1754552775/470086768, 14199869525/1410260304,
+     -10690763975/1880347072],
+    [0, 127303824393/49829197408, -318862633887/49829197408,
+     701980252875/199316789632],
+    [0, -282668133/205662961, 2019193451/616988883,
+     -1453857185/822651844],
+    [0, 40617522/29380423, -110615467/29380423, 69997945/29380423],
+])
+
+
+def dormand_prince_step(func, y, f, h):
+    """Single Dormand-Prince 5(4) step of an autonomous equation.
+
+    Args:
+        func (callable): Derivative function, dy/ds = func(y).
+        y (numpy.ndarray): Initial state.
+        f (numpy.ndarray): Derivative at initial state, func(y).
+        h (float): Step size.
+
+    Returns:
+        tuple: (y_new, f_new, error, k), with the 5th order solution,
+            its derivative (reused as f in the next step), the embedded
+            error estimate and the (7, n) array of stage derivatives used
+            for dense output.
+    """
+    k = _np.zeros((7, len(y)))
+    k[0] = f
+    for i in range(1, 6):
+        k[i] = func(y + h*_np.dot(DOPRI_A[i], k[:i]))
+    y_new = y + h*_np.dot(DOPRI_B, k[:6])
+    f_new = func(y_new)
+    k[6] = f_new
+    error = h*_np.dot(DOPRI_E, k)
+    return y_new, f_new, error, k
+
+
+def dormand_prince_dense(y, h, k, theta):
+    """Dense output of a Dormand-Prince step.
+
+    Args:
+        y (numpy.ndarray): State at the beginning of the step.
+        h (float): Step size.
+        k (numpy.ndarray): Stage derivatives returned by dormand_prince_step.
+        theta (float or numpy.ndarray): Fractions of the step, in [0, 1].
+
+    Returns:
+        numpy.ndarray: Interpolated states, shape (len(theta), len(y)) if
+            theta is an array, or (len(y), ) otherwise.
+    """
+    q = _np.dot(k.T, DOPRI_P)
+    theta = _np.asarray(theta, dtype=float)
+    powers = _np.cumprod(
+        _np.repeat(theta[..., None], 4, axis=-1), axis=-1)
+    return y + h*_np.dot(powers, q.T)
+
+
 def rotation_matrix(axis, theta):
     """Returns rotation matrix for rotation by an angle around an axis
 
@@ -844,3 +1133,64 @@ def find_zeros(pos, data):
     dataa = data[idxa]
     pos_zeros = (dataa*posb - datab*posa)/(dataa - datab)
     return pos_zeros
+
+
+def calc_moving_average(pos, data, width, rtol=1e-6):
+    """Moving average of data over a window of given longitudinal width.
+
+    All data columns are averaged in a single pass, from cumulative sums.
+    If positions are uniformly spaced (within rtol), each average is the
+    mean of navg = int(width/step) consecutive points, equal to a
+    convolution with a navg points box kernel (numpy.convolve with
+    mode='same'). Otherwise, the average is the integral of the linear
+    interpolation of data over [pos - width/2, pos + width/2] (trapezoidal
+    rule) divided by width.
+
+    Args:
+        pos (numpy.ndarray, N): Increasing positions list.
+        data (numpy.ndarray, N or NxM): Data list.
+        width (float): Window width, in the same units as pos.
+        rtol (float, optional): Relative tolerance of the step for
+            considering positions uniformly spaced. Defaults to 1e-6.
+
+    Returns:
+        numpy.ndarray: Averaged data, with the same shape as data. Values
+            whose window is not contained in the positions range are NaN.
+    """
+    pos = _np.asarray(pos, dtype=float)
+    data = _np.asarray(data, dtype=float)
+    values = data.reshape(len(pos), -1)
+    npts = len(pos)
+    avg = _np.full(values.shape, _np.nan)
+
+    steps = _np.diff(pos)
+    step = _np.abs(steps[0]) if npts > 1 else 0
+    if step > 0 and _np.all(_np.abs(steps - step) <= rtol*step):
+        navg = int(width/step)
+        if 0 < navg <= npts:
+            csum = _np.zeros((npts + 1, values.shape[1]))
+            _np.cumsum(values, axis=0, out=csum[1:])
+            idx = _np.arange(navg//2, npts - (navg + 1)//2 + 1)
+            avg[idx] = (
+                csum[idx + (navg + 1)//2] - csum[idx - navg//2])/navg
+        return avg.reshape(data.shape)
+
+    # Cumulative trapezoidal integral at each position.
+    integral = _np.zeros((npts, values.shape[1]))
+    _np.cumsum(
+        0.5*steps[:, None]*(values[1:] + values[:-1]),
+        axis=0, out=integral[1:])
+
+    def integrate_to(zq):
+        k = _np.clip(_np.searchsorted(pos, zq, side='right') - 1, 0, npts - 2)
+        d = (zq - pos[k])[:, None]
+        slope = (values[k + 1] - values[k])/steps[k][:, None]
+        return integral[k] + values[k]*d + 0.5*slope*d**2
+
+    idx = _np.nonzero(
+        (pos - width/2 >= pos[0]) & (pos + width/2 <= pos[-1]))[0]
+    if len(idx) > 0:
+        avg[idx] = (
+            integrate_to(pos[idx] + width/2) -
+            integrate_to(pos[idx] - width/2))/width
+    return avg.reshape(data.shape)
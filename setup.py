@@ -39,6 +39,11 @@ setup(
         'imaids': ['presets/*']
     },
     install_requires=_requirements,
+    entry_points={
+        'console_scripts': [
+            'imaids-maps=imaids.batchmaps:main',
+        ],
+    },
     test_suite='nose.collector',
     tests_require=['nose'],
     zip_safe=False)